@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""Measure claim latency with and without the partial claim index.
+
+Fills a scratch collection with synthetic media documents at each size, then
+has several backends claim files concurrently, first with the old ``$ne``
+filter over the filename index only and then through ``claim_next`` and the
+partial claim index. Each backend uses its own MongoClient, like separate
+backend processes. Needs a MongoDB server at DB_URL; the scratch database is
+dropped afterwards.
+
+Example:
+    python benchmarks/claim_benchmark.py
+    python benchmarks/claim_benchmark.py --sizes 10000 100000 --backends 8 --claims 50
+"""
+
+from __future__ import annotations
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import os
+from pathlib import Path
+import random
+import statistics
+import sys
+import time
+from typing import Any, Callable
+
+SRC_DIR = Path(__file__).resolve().parents[1] / "src"
+
+# The claim filter before the partial index
+LEGACY_FILTER = {
+    "conversion_required": True,
+    "converting": {"$ne": True},
+    "converted": {"$ne": True},
+    "conversion_error": {"$ne": True},
+    "deleted": {"$ne": True},
+    "copying": {"$ne": True},
+}
+
+
+def _fill(collection: Any, size: int, claimable_fraction: float, batch_size: int) -> None:
+    from pymongo import ASCENDING
+
+    collection.drop()
+    collection.create_index([("filename", ASCENDING)], unique=True)
+
+    randomizer = random.Random(size)
+    batch: list[dict[str, Any]] = []
+    for index in range(size):
+        converted = randomizer.random() >= claimable_fraction
+        batch.append(
+            {
+                "filename": f"/Media/Benchmark/{index:08d}.mkv",
+                "conversion_required": not converted,
+                "converting": False,
+                "converted": converted,
+                "conversion_error": False,
+                "deleted": False,
+                "copying": False,
+                "video_information": {
+                    "format": {"bit_rate": randomizer.randint(500_000, 80_000_000)}
+                },
+            }
+        )
+        if len(batch) >= batch_size:
+            collection.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        collection.insert_many(batch, ordered=False)
+
+
+def _docs_examined(collection: Any, query: dict[str, Any], sort: list[Any]) -> int:
+    explanation = collection.find(query).sort(sort).limit(1).explain()
+    return explanation["executionStats"]["totalDocsExamined"]
+
+
+def _run_backends(
+    claim: Callable[[Any], dict[str, Any] | None],
+    connect: Callable[[], Any],
+    backends: int,
+    claims: int,
+) -> tuple[list[float], int]:
+    def _backend() -> tuple[list[float], list[Any]]:
+        client, collection = connect()
+        latencies: list[float] = []
+        claimed: list[Any] = []
+        try:
+            for _ in range(claims):
+                start = time.perf_counter()
+                document = claim(collection)
+                latencies.append(time.perf_counter() - start)
+                if document is not None:
+                    claimed.append(document["_id"])
+        finally:
+            client.close()
+        return latencies, claimed
+
+    with ThreadPoolExecutor(max_workers=backends) as executor:
+        results = list(executor.map(lambda _: _backend(), range(backends)))
+
+    latencies = [latency for result in results for latency in result[0]]
+    claimed = [claimed_id for result in results for claimed_id in result[1]]
+    if len(claimed) != len(set(claimed)):
+        raise RuntimeError("A file was claimed by more than one backend")
+    return latencies, len(claimed)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--backends", type=int, default=4)
+    parser.add_argument("--claims", type=int, default=50, help="claims per backend")
+    parser.add_argument("--claimable-fraction", type=float, default=0.2)
+    parser.add_argument("--batch-size", type=int, default=10_000)
+    args = parser.parse_args()
+
+    os.environ.setdefault("DB_URL", "mongodb://localhost:27017")
+    os.environ.setdefault("DB_NAME", "claim_benchmark")
+    os.environ.setdefault("DB_COLLECTION", "media_collection")
+    os.environ.setdefault("PUSH_COLLECTION", "push_subscriptions")
+    sys.path.insert(0, SRC_DIR.as_posix())
+
+    from pymongo import MongoClient
+
+    from converter.claim_queue import (
+        CLAIM_SORT,
+        CLAIMABLE_FILTER,
+        claim_next,
+        create_claim_indexes,
+    )
+
+    database_name = os.environ["DB_NAME"]
+    collection_name = os.environ["DB_COLLECTION"]
+
+    def _connect() -> tuple[Any, Any]:
+        client = MongoClient(os.environ["DB_URL"])
+        return client, client[database_name][collection_name]
+
+    def _legacy_claim(collection: Any) -> dict[str, Any] | None:
+        return collection.find_one_and_update(
+            LEGACY_FILTER,
+            {"$set": {"converting": True, "prefetched": False}},
+            sort=CLAIM_SORT,
+        )
+
+    client, collection = _connect()
+    try:
+        for size in args.sizes:
+            print(f"Filling {size} document(s)")
+            _fill(collection, size, args.claimable_fraction, args.batch_size)
+
+            modes = [
+                ("legacy", LEGACY_FILTER, _legacy_claim),
+                ("indexed", CLAIMABLE_FILTER, claim_next),
+            ]
+            for mode, query, claim in modes:
+                if mode == "indexed":
+                    create_claim_indexes(collection)
+
+                # Give back the files claimed by the previous mode
+                collection.update_many({"converting": True}, {"$set": {"converting": False}})
+
+                examined = _docs_examined(collection, query, CLAIM_SORT)
+                start = time.perf_counter()
+                latencies, claimed = _run_backends(
+                    claim, _connect, args.backends, args.claims
+                )
+                elapsed = time.perf_counter() - start
+
+                latencies.sort()
+                p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+                print(
+                    f"{size:>9} docs, {mode:>7}: median {statistics.median(latencies) * 1000:8.2f} ms, "
+                    f"p95 {p95 * 1000:8.2f} ms, {claimed / elapsed:8.1f} claims/s, "
+                    f"{examined} doc(s) examined per claim"
+                )
+    finally:
+        client.drop_database(database_name)
+        client.close()
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
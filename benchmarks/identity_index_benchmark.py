@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""Compare equivalent-path lookups by linear search and by PathIdentityIndex.
+
+Generates synthetic library paths, then looks up DB spellings that differ from
+disk only by Unicode normalization or case, the way the codec detector does
+when reconciling. The linear search scans every disk path per lookup, so it is
+only run for a sample of the lookups and extrapolated. MongoDB does not need
+to be reachable.
+
+Example:
+    python benchmarks/identity_index_benchmark.py
+    python benchmarks/identity_index_benchmark.py --paths 25000 50000 100000 --lookups 5000
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+from pathlib import Path
+import random
+import sys
+import time
+import unicodedata
+
+SRC_DIR = Path(__file__).resolve().parents[1] / "src"
+
+
+def _generate_paths(count: int) -> list[str]:
+    # Mix in accented names so NFC and NFD spellings differ
+    names = ["Amélie", "Pokémon", "Señorita", "Café Society", "Noël", "Show"]
+    return [
+        f"/Media/TV/{names[index % len(names)]} {index // 500}/"
+        f"Season {index % 10}/Episode {index:06d}.mkv"
+        for index in range(count)
+    ]
+
+
+def _db_spelling(path: str) -> str:
+    # Stored with decomposed accents and different case, as a Mac client would
+    return unicodedata.normalize("NFD", path).upper()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--paths", type=int, nargs="+", default=[100_000])
+    parser.add_argument("--lookups", type=int, default=1000)
+    parser.add_argument("--linear-sample", type=int, default=20)
+    args = parser.parse_args()
+
+    os.environ.setdefault("DB_URL", "mongodb://localhost:27017")
+    os.environ.setdefault("DB_NAME", "identity_index_benchmark")
+    os.environ.setdefault("DB_COLLECTION", "media_collection")
+    os.environ.setdefault("PUSH_COLLECTION", "push_subscriptions")
+    sys.path.insert(0, SRC_DIR.as_posix())
+
+    from converter.unicode_paths import (
+        PathIdentityIndex,
+        find_equivalent_path,
+        path_identity_key,
+    )
+
+    random_generator = random.Random(0)
+
+    for path_count in args.paths:
+        paths = _generate_paths(path_count)
+        drive_paths = set(paths)
+        lookups = [
+            _db_spelling(path)
+            for path in random_generator.sample(paths, min(args.lookups, path_count))
+        ]
+
+        # Linear search, measured on a sample and extrapolated
+        path_identity_key.cache_clear()
+        sample = lookups[: args.linear_sample]
+        start = time.perf_counter()
+        for name in sample:
+            find_equivalent_path(name, drive_paths)
+        linear_elapsed = (time.perf_counter() - start) / len(sample) * len(lookups)
+
+        # Index built once, then one dictionary lookup per name
+        path_identity_key.cache_clear()
+        start = time.perf_counter()
+        identity_index = PathIdentityIndex(paths)
+        build_elapsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        misses = sum(1 for name in lookups if identity_index.find(name) is None)
+        lookup_elapsed = time.perf_counter() - start
+
+        # A second build reuses the memoized keys, as the next walk does
+        start = time.perf_counter()
+        PathIdentityIndex(paths)
+        rebuild_elapsed = time.perf_counter() - start
+
+        print(
+            f"{path_count:>8} paths, {len(lookups)} lookups: "
+            f"linear ~{linear_elapsed:8.2f} s, "
+            f"index build {build_elapsed * 1000:7.1f} ms "
+            f"(memoized {rebuild_elapsed * 1000:6.1f} ms), "
+            f"lookups {lookup_elapsed * 1000:6.2f} ms, {misses} miss(es)"
+        )
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
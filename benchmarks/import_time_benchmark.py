@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""Measure the cold-start import time of the walker and backend entry points.
+
+Each run imports the modules a role loads before its first walk or
+conversion in a fresh interpreter, and reports the median time and which of
+the heavy optional stacks were loaded. MongoDB does not need to be reachable;
+run it against an older checkout to compare.
+
+Example:
+    python benchmarks/import_time_benchmark.py
+    python benchmarks/import_time_benchmark.py --runs 20 --roles walker
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+from pathlib import Path
+import statistics
+import subprocess
+import sys
+
+SRC_DIR = Path(__file__).resolve().parents[1] / "src"
+
+# Modules the roles import before they start work
+ROLE_MODULES = {
+    "walker": ["converter.task_scheduler"],
+    "backend": [
+        "converter.task_scheduler",
+        "converter.converter",
+        "converter.conversion_slots",
+        "converter.prefetch",
+    ],
+}
+
+HEAVY_MODULES = ["ffmpeg", "pywebpush", "http_ece", "requests", "media_cover_art"]
+
+_CHILD = """
+import importlib, json, sys, time
+sys.path.insert(0, {src!r})
+start = time.perf_counter()
+for module in {modules!r}:
+    importlib.import_module(module)
+elapsed = time.perf_counter() - start
+print(json.dumps({{
+    "seconds": elapsed,
+    "loaded": [name for name in {heavy!r} if name in sys.modules],
+}}))
+"""
+
+
+def _run_once(role: str) -> tuple[float, list[str]]:
+    environment = dict(os.environ)
+    environment["FOLDER_WALKER"] = "TRUE" if role == "walker" else "FALSE"
+
+    code = _CHILD.format(
+        src=SRC_DIR.as_posix(), modules=ROLE_MODULES[role], heavy=HEAVY_MODULES
+    )
+    completed = subprocess.run(
+        [sys.executable, "-c", code],
+        env=environment,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    result = json.loads(completed.stdout.splitlines()[-1])
+    return result["seconds"], result["loaded"]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument(
+        "--roles", nargs="+", choices=sorted(ROLE_MODULES), default=["walker", "backend"]
+    )
+    args = parser.parse_args()
+
+    os.environ.setdefault("DB_URL", "mongodb://localhost:27017")
+    os.environ.setdefault("DB_NAME", "import_time_benchmark")
+    os.environ.setdefault("DB_COLLECTION", "media_collection")
+    os.environ.setdefault("PUSH_COLLECTION", "push_subscriptions")
+
+    for role in args.roles:
+        timings: list[float] = []
+        loaded: list[str] = []
+        for _ in range(args.runs):
+            seconds, loaded = _run_once(role)
+            timings.append(seconds)
+
+        print(
+            f"{role:>7}: median {statistics.median(timings) * 1000:8.1f} ms, "
+            f"min {min(timings) * 1000:8.1f} ms, "
+            f"loaded {', '.join(loaded) or 'none'}"
+        )
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
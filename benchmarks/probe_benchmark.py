@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""Measure ffprobe throughput of the detector's ProbePool at 1, 4 and 8 workers.
+
+Probes every video file under DIRECTORY, or generates short test clips with
+ffmpeg when no directory is given. ffprobe (and ffmpeg for generated clips)
+must be on PATH. MongoDB does not need to be reachable.
+
+Example:
+    python benchmarks/probe_benchmark.py
+    python benchmarks/probe_benchmark.py /Media/TV/Some\\ Show --workers 1 4 8 16
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+from pathlib import Path
+import subprocess
+import sys
+import tempfile
+import time
+
+SRC_DIR = Path(__file__).resolve().parents[1] / "src"
+
+
+def _generate_clips(directory: Path, count: int) -> None:
+    for index in range(count):
+        subprocess.run(
+            [
+                "ffmpeg",
+                "-v",
+                "error",
+                "-f",
+                "lavfi",
+                "-i",
+                "testsrc=duration=2:size=320x240:rate=25",
+                "-f",
+                "lavfi",
+                "-i",
+                "sine=duration=2",
+                "-c:v",
+                "libx264",
+                "-c:a",
+                "aac",
+                (directory / f"clip-{index:04d}.mkv").as_posix(),
+            ],
+            check=True,
+        )
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("directory", type=Path, nargs="?")
+    parser.add_argument("--clips", type=int, default=64)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--timeout", type=float, default=300)
+    args = parser.parse_args()
+
+    os.environ.setdefault("DB_URL", "mongodb://localhost:27017")
+    os.environ.setdefault("DB_NAME", "probe_benchmark")
+    os.environ.setdefault("DB_COLLECTION", "media_collection")
+    os.environ.setdefault("PUSH_COLLECTION", "push_subscriptions")
+    sys.path.insert(0, SRC_DIR.as_posix())
+
+    from converter.folder_walker import VIDEO_SUFFIXES
+    from converter.models import FileInfo
+    from converter.probe_pool import ProbePool
+
+    with tempfile.TemporaryDirectory(prefix="probe-bench-") as temp_dir:
+        directory = args.directory
+        if directory is None:
+            directory = Path(temp_dir)
+            print(f"Generating {args.clips} test clips")
+            _generate_clips(directory, args.clips)
+
+        files = [
+            FileInfo(filename=path.as_posix())
+            for path in sorted(directory.rglob("*"))
+            if path.suffix in VIDEO_SUFFIXES and path.is_file()
+        ]
+        print(f"Probing {len(files)} file(s)")
+
+        for workers in args.workers:
+            pool = ProbePool(workers=workers, timeout_seconds=args.timeout)
+            failures = 0
+            start = time.perf_counter()
+            for result in pool.probe(files):
+                if not result.successful:
+                    failures += 1
+            elapsed = time.perf_counter() - start
+
+            print(
+                f"{workers:>2} worker(s): {elapsed:7.2f} s, "
+                f"{len(files) / elapsed:7.1f} probes/s, {failures} failure(s)"
+            )
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
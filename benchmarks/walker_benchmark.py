@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""Compare the pathlib and scandir FolderWalker engines on a generated tree.
+
+The tree mimics the library layout (show / season / episode plus sidecar
+files) and is created in a temporary directory that is removed afterwards.
+MongoDB does not need to be reachable; importing the converter package only
+logs that the indexes could not be created.
+
+Example:
+    python benchmarks/walker_benchmark.py
+    python benchmarks/walker_benchmark.py --shows 400 --seasons 5 --episodes 20
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+from pathlib import Path
+import statistics
+import sys
+import tempfile
+import time
+
+SRC_DIR = Path(__file__).resolve().parents[1] / "src"
+SIDECAR_SUFFIXES = (".nfo", ".srt", ".jpg")
+
+
+def _generate_tree(root: Path, shows: int, seasons: int, episodes: int) -> int:
+    video_count = 0
+    for show in range(shows):
+        for season in range(1, seasons + 1):
+            season_dir = root / "TV" / f"Show {show:04d}" / f"Season {season:02d}"
+            season_dir.mkdir(parents=True)
+            for episode in range(1, episodes + 1):
+                stem = f"Show {show:04d} - S{season:02d}E{episode:02d}"
+                (season_dir / f"{stem}.mkv").touch()
+                video_count += 1
+                for suffix in SIDECAR_SUFFIXES:
+                    (season_dir / f"{stem}{suffix}").touch()
+    return video_count
+
+
+def _write_config(config_path: Path, root: Path) -> None:
+    config_path.write_text(
+        "\n".join(
+            [
+                "[folders]",
+                f'include = ["{(root / "TV").as_posix()}"]',
+                f'backup = "{(root / "Backup").as_posix()}"',
+                f'conversions = "{(root / "Conversions").as_posix()}"',
+                "",
+                "[schedule]",
+                'timezone = "Europe/London"',
+                "scan_time = 00:00:00",
+                "start_conversion_time = 00:05:00",
+                "end_conversion_time = 23:59:00",
+                "",
+            ]
+        )
+    )
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--shows", type=int, default=200)
+    parser.add_argument("--seasons", type=int, default=5)
+    parser.add_argument("--episodes", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="walker-bench-") as temp_dir:
+        root = Path(temp_dir)
+        video_count = _generate_tree(root, args.shows, args.seasons, args.episodes)
+        config_path = root / "config.toml"
+        _write_config(config_path, root)
+
+        os.environ["CONVERTER_CONFIG_PATH"] = config_path.as_posix()
+        os.environ.setdefault("DB_URL", "mongodb://localhost:27017")
+        os.environ.setdefault("DB_NAME", "walker_benchmark")
+        os.environ.setdefault("DB_COLLECTION", "media_collection")
+        os.environ.setdefault("PUSH_COLLECTION", "push_subscriptions")
+        sys.path.insert(0, SRC_DIR.as_posix())
+
+        from converter import config
+        from converter.folder_walker import FolderWalker
+
+        print(
+            f"Generated {video_count} video files "
+            f"({video_count * (len(SIDECAR_SUFFIXES) + 1)} entries)"
+        )
+
+        for engine in ("pathlib", "scandir"):
+            config.config_data.walker.engine = engine
+            timings: list[float] = []
+            found = 0
+            for _ in range(args.repeat):
+                walker = FolderWalker()
+                start = time.perf_counter()
+                walker.walk_folders()
+                timings.append(time.perf_counter() - start)
+                found = len(walker.files_dict)
+
+            print(
+                f"{engine:>8}: best {min(timings) * 1000:8.1f} ms, "
+                f"median {statistics.median(timings) * 1000:8.1f} ms, "
+                f"{found} files"
+            )
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
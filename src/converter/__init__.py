@@ -1,11 +1,15 @@
 import logging
 import atexit
 import os
+import threading
+import time
+from typing import Any
 
 from pymongo import MongoClient, ASCENDING
 from pymongo.errors import ServerSelectionTimeoutError, NetworkTimeout, AutoReconnect
 from bson.codec_options import CodecOptions
 
+from .claim_queue import create_claim_indexes, normalize_claim_flags
 from .config import Config
 
 def _close_mongo_connection() -> None:
@@ -47,9 +51,9 @@ except KeyError:
     logging.error("PUSH_COLLECTION environment variable not set")
     exit(1)
 
-# Connect to MongoDB
-_client = MongoClient(f'{mongo_uri}?timeoutMS=5000')
-logging.info("Connected to MongoDB")
+# Create the MongoDB client without connecting, so importing the package does not
+# wait on the network; the connection is made by bootstrap() or the first query
+_client = MongoClient(f'{mongo_uri}?timeoutMS=5000', connect=False)
 
 # Register the close_mongo_connection function to run at exit
 atexit.register(_close_mongo_connection)
@@ -66,27 +70,143 @@ push_collection = _db.get_collection(_push_collection_name)
 # Cover art metadata is written by website3 into the same media database.
 cover_art_cache_collection = _db.get_collection("cover_art_cache")
 
-try:
-    media_collection.create_index([("filename", ASCENDING)], unique=True)
-except ServerSelectionTimeoutError:
-    logging.error("Could not create index on filename")
-except NetworkTimeout:
-    logging.error("Could not create index on filename")
-except AutoReconnect:
-    logging.error("Could not create index on filename")
-else:
-    logging.info("Created index on filename in media collection")
-
-try:
-    push_collection.create_index([("endpoint", ASCENDING)], unique=True)
-except ServerSelectionTimeoutError:
-    logging.error("Could not create index on endpoint")
-except NetworkTimeout:
-    logging.error("Could not create index on endpoint")
-except AutoReconnect:
-    logging.error("Could not create index on endpoint")
-else:
-    logging.info("Created index on endpoint in push collection")
-
-# Import TaskScheduler to make it available directly from the converter package
-from .task_scheduler import TaskScheduler
+# Segments of files being encoded, claimable by every backend
+segment_jobs_collection = _db.get_collection(
+    "segment_jobs", codec_options=CodecOptions(tz_aware=True)
+)
+
+# Seconds between attempts at a bootstrap that could not reach MongoDB
+BOOTSTRAP_RETRY_SECONDS = 60
+
+_bootstrap_lock = threading.Lock()
+_bootstrapped = False
+_next_bootstrap_time = 0.0
+
+
+def bootstrap() -> bool:
+    """Connect to MongoDB and check the indexes, returning whether they exist.
+
+    Called by the application entry point before it starts work and again
+    from the scheduler loop, so a bootstrap that failed while MongoDB was
+    unreachable is retried every ``BOOTSTRAP_RETRY_SECONDS`` until it
+    succeeds; after that it does nothing. Scripts that only read or update
+    documents do not need it.
+    """
+    global _bootstrapped, _next_bootstrap_time
+
+    with _bootstrap_lock:
+        if _bootstrapped:
+            return True
+        if time.monotonic() < _next_bootstrap_time:
+            return False
+
+        logging.info("Connecting to MongoDB")
+        indexes_created = _create_indexes()
+        claim_queue_prepared = _prepare_claim_queue()
+
+        _bootstrapped = indexes_created and claim_queue_prepared
+        if not _bootstrapped:
+            logging.error(
+                f"MongoDB bootstrap incomplete, retrying in {BOOTSTRAP_RETRY_SECONDS} seconds"
+            )
+            _next_bootstrap_time = time.monotonic() + BOOTSTRAP_RETRY_SECONDS
+        return _bootstrapped
+
+
+def _create_indexes() -> bool:
+    # Returns whether every index exists
+    successful = True
+
+    try:
+        media_collection.create_index([("filename", ASCENDING)], unique=True)
+    except ServerSelectionTimeoutError:
+        logging.error("Could not create index on filename")
+        successful = False
+    except NetworkTimeout:
+        logging.error("Could not create index on filename")
+        successful = False
+    except AutoReconnect:
+        logging.error("Could not create index on filename")
+        successful = False
+    else:
+        logging.info("Created index on filename in media collection")
+
+    try:
+        media_collection.create_index([("content_fingerprint", ASCENDING)])
+    except ServerSelectionTimeoutError:
+        logging.error("Could not create index on content_fingerprint")
+        successful = False
+    except NetworkTimeout:
+        logging.error("Could not create index on content_fingerprint")
+        successful = False
+    except AutoReconnect:
+        logging.error("Could not create index on content_fingerprint")
+        successful = False
+    else:
+        logging.info("Created index on content_fingerprint in media collection")
+
+    try:
+        push_collection.create_index([("endpoint", ASCENDING)], unique=True)
+    except ServerSelectionTimeoutError:
+        logging.error("Could not create index on endpoint")
+        successful = False
+    except NetworkTimeout:
+        logging.error("Could not create index on endpoint")
+        successful = False
+    except AutoReconnect:
+        logging.error("Could not create index on endpoint")
+        successful = False
+    else:
+        logging.info("Created index on endpoint in push collection")
+
+    try:
+        segment_jobs_collection.create_index(
+            [("filename", ASCENDING), ("index", ASCENDING)], unique=True
+        )
+        segment_jobs_collection.create_index(
+            [("state", ASCENDING), ("created_time", ASCENDING), ("index", ASCENDING)]
+        )
+    except ServerSelectionTimeoutError:
+        logging.error("Could not create indexes on segment jobs")
+        successful = False
+    except NetworkTimeout:
+        logging.error("Could not create indexes on segment jobs")
+        successful = False
+    except AutoReconnect:
+        logging.error("Could not create indexes on segment jobs")
+        successful = False
+    else:
+        logging.info("Created indexes on segment jobs collection")
+
+    return successful
+
+
+def _prepare_claim_queue() -> bool:
+    # Claims match the flags by equality so they can use the partial claim index
+    try:
+        normalized = normalize_claim_flags(media_collection)
+        create_claim_indexes(media_collection)
+    except ServerSelectionTimeoutError:
+        logging.error("Could not create claim indexes")
+        return False
+    except NetworkTimeout:
+        logging.error("Could not create claim indexes")
+        return False
+    except AutoReconnect:
+        logging.error("Could not create claim indexes")
+        return False
+
+    if normalized:
+        logging.info(f"Stored missing claim flags as false on {normalized} document(s)")
+    logging.info("Created claim indexes in media collection")
+    return True
+
+
+def __getattr__(name: str) -> Any:
+    # Import TaskScheduler on first use, so importing the package does not load the
+    # conversion stack
+    if name == "TaskScheduler":
+        from .task_scheduler import TaskScheduler
+
+        return TaskScheduler
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,188 @@
+"""Batched MongoDB writes for the walker.
+
+Operations are sent as unordered ``bulk_write`` batches so one bad document
+does not stop the rest of its batch, and per-operation failures are reported
+back by their index in the original list.
+
+``StreamingBulkWriter`` is used while probing: it flushes as results arrive
+instead of holding a whole walk's writes until the end, so new files become
+claimable by backends as soon as they are probed.
+"""
+
+from __future__ import annotations
+
+import logging
+import time
+from typing import Callable, Sequence
+
+from pymongo.collection import Collection
+from pymongo.errors import (
+    AutoReconnect,
+    BulkWriteError,
+    NetworkTimeout,
+    ServerSelectionTimeoutError,
+)
+
+
+class BulkWriteOutcome:
+    def __init__(self) -> None:
+        # Error message of each rejected operation, keyed by its index
+        self.failures: dict[int, str] = {}
+
+        # Index of the first operation not known to be written after a connection error
+        self.unsent_from: int | None = None
+
+    @property
+    def connection_successful(self) -> bool:
+        return self.unsent_from is None
+
+    def successful(self, index: int) -> bool:
+        if index in self.failures:
+            return False
+        return self.unsent_from is None or index < self.unsent_from
+
+
+def bulk_write_batches(
+    collection: Collection,
+    operations: Sequence,
+    batch_size: int,
+) -> BulkWriteOutcome:
+    """Write ``operations`` in unordered batches of ``batch_size``.
+
+    After a connection error the remaining batches are not sent. Unordered
+    batches give no way to tell which writes of the failed batch landed, so
+    everything from its first operation on counts as unsent.
+    """
+    batch_size = max(1, batch_size)
+    outcome = BulkWriteOutcome()
+
+    for start in range(0, len(operations), batch_size):
+        batch = operations[start : start + batch_size]
+
+        try:
+            collection.bulk_write(list(batch), ordered=False)
+        except BulkWriteError as e:
+            for write_error in e.details.get("writeErrors", []):
+                outcome.failures[start + write_error["index"]] = write_error.get(
+                    "errmsg", "Unknown write error"
+                )
+        except ServerSelectionTimeoutError:
+            logging.error("Could not connect to MongoDB")
+            outcome.unsent_from = start
+            break
+        except NetworkTimeout:
+            logging.error("Could not connect to MongoDB")
+            outcome.unsent_from = start
+            break
+        except AutoReconnect:
+            logging.error("Could not connect to MongoDB.")
+            outcome.unsent_from = start
+            break
+
+    return outcome
+
+
+class StreamingBulkWriter:
+    """Flush unordered batches every ``batch_size`` operations or ``interval_seconds``.
+
+    The interval is checked as operations are added, and ``flush`` must be
+    called once after the last one. Batches that fail with a connection error
+    are retried with exponential backoff, which is safe for idempotent upserts.
+    ``on_flush`` receives the items of the operations that were written.
+    """
+
+    def __init__(
+        self,
+        collection: Collection,
+        batch_size: int,
+        interval_seconds: float,
+        retry_attempts: int,
+        retry_backoff_seconds: float,
+        on_flush: Callable[[list], None] | None = None,
+    ) -> None:
+        self._collection = collection
+        self._batch_size = max(1, batch_size)
+        self._interval_seconds = interval_seconds
+        self._retry_attempts = max(1, retry_attempts)
+        self._retry_backoff_seconds = retry_backoff_seconds
+        self._on_flush = on_flush
+
+        self._operations: list = []
+        self._items: list = []
+        self._last_flush_time = time.monotonic()
+
+        # Totals since the writer was created
+        self.written = 0
+        self.failed = 0
+
+        # False once any batch could not be written
+        self.successful = True
+
+    def add(self, operation, item=None) -> None:
+        self._operations.append(operation)
+        self._items.append(item)
+
+        if (
+            len(self._operations) >= self._batch_size
+            or time.monotonic() - self._last_flush_time >= self._interval_seconds
+        ):
+            self.flush()
+
+    def flush(self) -> None:
+        self._last_flush_time = time.monotonic()
+        if not self._operations:
+            return
+
+        operations, self._operations = self._operations, []
+        items, self._items = self._items, []
+
+        failures = self._write_with_retries(operations)
+        if failures is None:
+            self.failed += len(operations)
+            self.successful = False
+            logging.error(f"Could not write {len(operations)} operation(s) to MongoDB")
+            return
+
+        for index, message in failures.items():
+            logging.error(f"Could not write {items[index]}: {message}")
+        if failures:
+            self.failed += len(failures)
+            self.successful = False
+
+        written_items = [
+            item for index, item in enumerate(items) if index not in failures
+        ]
+        self.written += len(written_items)
+        logging.info(f"Wrote {len(written_items)} operation(s) to MongoDB")
+
+        if self._on_flush is not None and written_items:
+            self._on_flush(written_items)
+
+    def _write_with_retries(self, operations: list) -> dict[int, str] | None:
+        # Returns the rejected operations by index, or None if MongoDB stayed unreachable
+        for attempt in range(1, self._retry_attempts + 1):
+            try:
+                self._collection.bulk_write(operations, ordered=False)
+            except BulkWriteError as e:
+                return {
+                    write_error["index"]: write_error.get("errmsg", "Unknown write error")
+                    for write_error in e.details.get("writeErrors", [])
+                }
+            except ServerSelectionTimeoutError:
+                logging.error("Could not connect to MongoDB")
+            except NetworkTimeout:
+                logging.error("Could not connect to MongoDB")
+            except AutoReconnect:
+                logging.error("Could not connect to MongoDB.")
+            else:
+                return {}
+
+            if attempt < self._retry_attempts:
+                delay = self._retry_backoff_seconds * 2 ** (attempt - 1)
+                logging.info(
+                    f"Retrying bulk write in {delay:.1f} seconds "
+                    f"(attempt {attempt + 1} of {self._retry_attempts})"
+                )
+                time.sleep(delay)
+
+        return None
@@ -0,0 +1,107 @@
+"""Claim the next file to convert through a partial index.
+
+Only files that can be claimed are kept in the claim index, ordered by video
+bit rate, so a claim reads the first index entry instead of scanning and
+sorting the whole library. A partial index can only be used by a query that
+implies its filter, and partial filters cannot use ``$ne``, so the claim
+matches the flags by equality. Documents written before the flags were
+always stored have them missing or null; ``normalize_claim_flags`` sets those
+to ``False`` when a backend starts. Anything written with a missing or null
+flag after that, or while MongoDB was unreachable at startup, is still
+claimed: when the index has nothing to give, a claim with the old ``$ne``
+filter is tried, at most every ``FALLBACK_CLAIM_SECONDS`` as it scans the
+collection.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from typing import Any
+
+from pymongo import ASCENDING, DESCENDING
+from pymongo.collection import Collection
+
+CLAIM_INDEX_NAME = "claim_queue"
+RECOVERY_INDEX_NAME = "overwrite_recovery"
+
+# Flags that must all be False for a file to be claimed
+CLAIM_FLAGS = ("converting", "converted", "conversion_error", "deleted", "copying")
+
+CLAIMABLE_FILTER: dict[str, Any] = {
+    "conversion_required": True,
+    **{flag: False for flag in CLAIM_FLAGS},
+}
+
+# Claimable files whatever the stored type of their flags, as matched before the index
+FALLBACK_FILTER: dict[str, Any] = {
+    "conversion_required": True,
+    **{flag: {"$ne": True} for flag in CLAIM_FLAGS},
+}
+
+CLAIM_SORT = [("video_information.format.bit_rate", DESCENDING)]
+
+# Seconds between fallback claims while they find nothing
+FALLBACK_CLAIM_SECONDS = 60
+
+_fallback_lock = threading.Lock()
+_next_fallback_time = 0.0
+
+
+def create_claim_indexes(collection: Collection) -> None:
+    collection.create_index(
+        CLAIM_SORT,
+        name=CLAIM_INDEX_NAME,
+        partialFilterExpression=CLAIMABLE_FILTER,
+    )
+
+    # Interrupted overwrites are looked for before every claim
+    collection.create_index(
+        [("backend_name", ASCENDING)],
+        name=RECOVERY_INDEX_NAME,
+        partialFilterExpression={"overwrite_in_progress": True},
+    )
+
+
+def normalize_claim_flags(collection: Collection) -> int:
+    """Store missing or null claim flags as False, returning the documents changed."""
+    modified = 0
+    for flag in CLAIM_FLAGS:
+        result = collection.update_many(
+            {flag: {"$nin": [True, False]}}, {"$set": {flag: False}}
+        )
+        modified += result.modified_count
+    return modified
+
+
+def _fallback_due() -> bool:
+    global _next_fallback_time
+
+    with _fallback_lock:
+        now = time.monotonic()
+        if now < _next_fallback_time:
+            return False
+        _next_fallback_time = now + FALLBACK_CLAIM_SECONDS
+        return True
+
+
+def claim_next(collection: Collection, prefetch: bool = False) -> dict[str, Any] | None:
+    """Atomically claim the claimable file with the highest bit rate."""
+    global _next_fallback_time
+
+    update = {"$set": {"converting": True, "prefetched": prefetch}}
+
+    document = collection.find_one_and_update(CLAIMABLE_FILTER, update, sort=CLAIM_SORT)
+    if document is not None or not _fallback_due():
+        return document
+
+    # Only files with a missing or null flag can match here
+    update["$set"].update(
+        {flag: False for flag in CLAIM_FLAGS if flag != "converting"}
+    )
+    document = collection.find_one_and_update(FALLBACK_FILTER, update, sort=CLAIM_SORT)
+    if document is not None:
+        # Claim any others straight away too
+        with _fallback_lock:
+            _next_fallback_time = 0.0
+    return document
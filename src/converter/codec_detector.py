@@ -1,52 +1,125 @@
-from pathlib import Path
-import subprocess
 import logging
+import os
+from pathlib import Path
+import re
+import sqlite3
+import time
+from typing import Any
 
+from bson import ObjectId
 from pymongo import UpdateOne
 from pymongo.errors import ServerSelectionTimeoutError, NetworkTimeout, AutoReconnect
 
 from pydantic import ValidationError
 
-from .models import VideoInformation, FileData, FileInfo
-from . import media_collection
+from .models import VideoInformation, FileData, FileInfo, WalkDiff
+from . import media_collection, config
+from .bulk_writer import StreamingBulkWriter, bulk_write_batches
+from .content_fingerprint import compute_partial_hash
+from .conversion_rules import decide
 from .cover_art_prefetch import ensure_posters_background
+from .probe_cache import ProbeFailure, get_probe_cache
+from .probe_pool import ProbePool, ProbeResult
 from .unicode_paths import (
+    PathIdentityIndex,
     clear_directory_cache,
-    find_equivalent_path,
     path_identity_key,
     paths_same_file,
     resolve_filesystem_path,
 )
 
+# Filename suffix of a row moved aside by a rename that has not finished
+_RENAMING_SUFFIX = re.compile(r"\.renaming-[0-9a-f]{24}-\d+$")
+
+# Rows with any of these set are never re-probed when their file changes
+_REPROBE_BLOCKING_FLAGS = ("converting", "converted", "copying", "overwrite_in_progress")
+
 
 class CodecDetector:
-    def __init__(self, files: dict[str, FileInfo]) -> None:
+    def __init__(
+        self,
+        files: dict[str, FileInfo],
+        diff: WalkDiff | None = None,
+        identity_index: PathIdentityIndex | None = None,
+        unreadable_directories: set[str] | None = None,
+    ) -> None:
         # List of files to detect the encoding of
         self._files: dict[str, FileInfo] = files
 
-        # The base command to run ffprobe
-        self._ffprobe_base_command = [
-            "ffprobe",
-            "-v",
-            "quiet",
-            "-print_format",
-            "json",
-            "-show_format",
-            "-show_streams",
-        ]
+        # Directories the walk could not read, whose files may still exist
+        self._unreadable_prefixes = tuple(
+            os.path.join(directory, "") for directory in unreadable_directories or ()
+        )
+
+        # Identity keys of the files on disk, built by the walker when available
+        self._identity_index = (
+            identity_index if identity_index is not None else PathIdentityIndex(files)
+        )
+
+        # Paths added and removed since the previous walk, None to check every file
+        self._diff = diff
+
+        # Known files that were rewritten on disk since they were probed
+        self._rewritten_filenames: set[str] = set()
+
+        # Whether the new data was written to MongoDB
+        self.write_successful = True
+
+        # Cache of earlier probe results and the pool of ffprobe workers used for new files
+        self._probe_cache = get_probe_cache()
+        self._probe_pool = ProbePool(
+            workers=config.config_data.probe.workers,
+            timeout_seconds=config.config_data.probe.timeout_seconds,
+            cache=self._probe_cache,
+        )
+
+        # Files that failed to probe and are due another try, found on incremental
+        # walks as an unchanged file never appears in the diff
+        self._retries_due = (
+            self._get_retries_due(self._get_probe_failures())
+            if diff is not None
+            else set()
+        )
+
+        if (
+            diff is not None
+            and not diff.added
+            and not diff.removed
+            and not diff.changed
+            and not self._retries_due
+        ):
+            # Nothing has changed on disk, so there is nothing to reconcile
+            logging.info("No changes since the last walk")
+            self._list_from_db = []
+            self.connection_successful = True
+            return
 
         # Get the old data from MongoDB getting just the filename
         logging.info("Getting old data from MongoDB")
         try:
             data_from_db = media_collection.find(
-                {"deleted": False}, {"filename": 1, "_id": 0}
+                {"deleted": False},
+                {
+                    "filename": 1,
+                    "content_fingerprint": 1,
+                    "current_size": 1,
+                    **{flag: 1 for flag in _REPROBE_BLOCKING_FLAGS},
+                    "_id": 0,
+                },
             )
 
             self._list_from_db: list[FileInfo] = []
             for data in data_from_db:
                 filename = data.get("filename")
                 if isinstance(filename, str) and filename:
-                    self._list_from_db.append(FileInfo(filename=filename))
+                    self._list_from_db.append(
+                        FileInfo(
+                            filename=filename,
+                            content_fingerprint=data.get("content_fingerprint"),
+                        )
+                    )
+                    if self._is_rewritten(filename, data):
+                        self._rewritten_filenames.add(filename)
         except ServerSelectionTimeoutError:
             logging.error("Could not connect to MongoDB")
 
@@ -75,78 +148,449 @@ class CodecDetector:
             # Show that the data was retrieved successfully
             self.connection_successful = True
 
+            # Put back rows left on a placeholder by an interrupted rename
+            self._restore_interrupted_renames()
+
             # Remove files that have been deleted
             clear_directory_cache()
             self._update_changed_files()
 
-    def _set_filename_in_db(self, old_filename: str, new_filename: str) -> bool:
+    def _is_rewritten(self, filename: str, data: dict[str, Any]) -> bool:
+        # A file still being copied in when it was first probed has grown since
+        if self._diff is None or (
+            filename not in self._diff.changed and filename not in self._retries_due
+        ):
+            return False
+
+        # Files being converted, or already converted, are rewritten by the converter
+        if any(data.get(flag) is True for flag in _REPROBE_BLOCKING_FLAGS):
+            return False
+
+        return data.get("current_size") != self._files[filename].size
+
+    def _restore_placeholders(self, restores: list[tuple[str, str]]) -> int:
+        """Move placeholder rows back to their filenames, returning the rows restored."""
+        if not restores:
+            return 0
+
+        outcome = bulk_write_batches(
+            media_collection,
+            [
+                UpdateOne(
+                    {"filename": placeholder},
+                    {"$set": {"filename": filename, "deleted": False}},
+                )
+                for placeholder, filename in restores
+            ],
+            config.config_data.walker.reconcile_batch_size,
+        )
+        if not outcome.connection_successful:
+            self.write_successful = False
+
+        restored = 0
+        for index, (placeholder, filename) in enumerate(restores):
+            if outcome.successful(index):
+                restored += 1
+            else:
+                logging.error(
+                    "Could not restore %s to %s: %s",
+                    placeholder,
+                    filename,
+                    outcome.failures.get(index, "Could not connect to MongoDB"),
+                )
+        return restored
+
+    def _restore_interrupted_renames(self) -> None:
+        # Placeholder rows are marked deleted, so they are never claimed or listed
         try:
-            media_collection.update_one(
-                {"filename": old_filename},
-                {"$set": {"filename": new_filename, "deleted": False}},
-            )
+            placeholders = [
+                data["filename"]
+                for data in media_collection.find(
+                    {"filename": {"$regex": _RENAMING_SUFFIX.pattern}},
+                    {"filename": 1, "_id": 0},
+                )
+            ]
         except ServerSelectionTimeoutError:
             logging.error("Could not connect to MongoDB")
-            return False
+            self.write_successful = False
+            return
         except NetworkTimeout:
             logging.error("Could not connect to MongoDB")
-            return False
+            self.write_successful = False
+            return
         except AutoReconnect:
             logging.error("Could not connect to MongoDB.")
-            return False
-
-        logging.info("Updated filename in database from %s to %s", old_filename, new_filename)
-        return True
+            self.write_successful = False
+            return
 
-    def _mark_deleted_in_db(self, filename: str) -> bool:
+        restores = [
+            (placeholder, _RENAMING_SUFFIX.sub("", placeholder))
+            for placeholder in placeholders
+        ]
+        restored = self._restore_placeholders(restores)
+        if restored:
+            logging.info(f"Restored {restored} row(s) left by an interrupted rename")
+
+    def _rename_in_db(self, renames: list[tuple[FileInfo, str]]) -> set[FileInfo]:
+        """Rename DB rows in batches, returning the rows that were renamed."""
+        if not renames:
+            return set()
+
+        batch_size = config.config_data.walker.reconcile_batch_size
+
+        # A target still held by another row (e.g. one marked deleted) would
+        # fail the unique filename index, so leave those rows alone
+        old_filenames = {db_file_info.filename for db_file_info, _ in renames}
+        targets = [
+            new_filename
+            for _, new_filename in renames
+            if new_filename not in old_filenames
+        ]
         try:
-            media_collection.update_one(
-                {"filename": filename}, {"$set": {"deleted": True}}
-            )
+            taken_filenames = {
+                data["filename"]
+                for data in media_collection.find(
+                    {"filename": {"$in": targets}}, {"filename": 1, "_id": 0}
+                )
+            }
         except ServerSelectionTimeoutError:
             logging.error("Could not connect to MongoDB")
-            return False
+            self.write_successful = False
+            return set()
         except NetworkTimeout:
             logging.error("Could not connect to MongoDB")
-            return False
+            self.write_successful = False
+            return set()
         except AutoReconnect:
             logging.error("Could not connect to MongoDB.")
-            return False
-        return True
+            self.write_successful = False
+            return set()
+
+        pending: list[tuple[FileInfo, str]] = []
+        for db_file_info, new_filename in renames:
+            if new_filename in taken_filenames:
+                logging.error(
+                    "Could not rename %s to %s: the new filename is already in the database",
+                    db_file_info.filename,
+                    new_filename,
+                )
+                continue
+            pending.append((db_file_info, new_filename))
+
+        # Move every row to a unique placeholder first, so renames that swap or
+        # chain filenames never collide on the unique index within a batch. While
+        # on its placeholder a row is marked deleted so backends cannot claim it;
+        # a row whose rename fails is moved back, and one left behind by an
+        # interrupted walk is restored when the next detector starts.
+        token = ObjectId()
+        placeholders = [
+            f"{db_file_info.filename}.renaming-{token}-{index}"
+            for index, (db_file_info, _) in enumerate(pending)
+        ]
+
+        outcome = bulk_write_batches(
+            media_collection,
+            [
+                UpdateOne(
+                    {"filename": db_file_info.filename},
+                    {"$set": {"filename": placeholder, "deleted": True}},
+                )
+                for (db_file_info, _), placeholder in zip(pending, placeholders)
+            ],
+            batch_size,
+        )
+        if not outcome.connection_successful:
+            self.write_successful = False
+
+        moved: list[int] = []
+        for index, (db_file_info, new_filename) in enumerate(pending):
+            if outcome.successful(index):
+                moved.append(index)
+            elif index in outcome.failures:
+                logging.error(
+                    "Could not rename %s to %s: %s",
+                    db_file_info.filename,
+                    new_filename,
+                    outcome.failures[index],
+                )
+
+        outcome = bulk_write_batches(
+            media_collection,
+            [
+                UpdateOne(
+                    {"filename": placeholders[index]},
+                    {"$set": {"filename": pending[index][1], "deleted": False}},
+                )
+                for index in moved
+            ],
+            batch_size,
+        )
+        if not outcome.connection_successful:
+            self.write_successful = False
+
+        renamed: set[FileInfo] = set()
+        restores: list[tuple[str, str]] = []
+        for position, index in enumerate(moved):
+            db_file_info, new_filename = pending[index]
+            if not outcome.successful(position):
+                logging.error(
+                    "Could not rename %s to %s, moving it back: %s",
+                    db_file_info.filename,
+                    new_filename,
+                    outcome.failures.get(position, "Could not connect to MongoDB"),
+                )
+                restores.append((placeholders[index], db_file_info.filename))
+                continue
+
+            logging.info(
+                "Updated filename in database from %s to %s",
+                db_file_info.filename,
+                new_filename,
+            )
+            db_file_info.filename = new_filename
+            renamed.add(db_file_info)
+
+        if restores:
+            self._restore_placeholders(restores)
+
+            # Keep the snapshot, so the next walk sees these renames again
+            self.write_successful = False
+
+        return renamed
+
+    def _mark_deleted_in_db(self, filenames: list[str]) -> None:
+        if not filenames:
+            return
+
+        outcome = bulk_write_batches(
+            media_collection,
+            [
+                UpdateOne({"filename": filename}, {"$set": {"deleted": True}})
+                for filename in filenames
+            ],
+            config.config_data.walker.reconcile_batch_size,
+        )
+
+        for index, message in outcome.failures.items():
+            logging.error("Could not mark %s deleted: %s", filenames[index], message)
+
+        if not outcome.connection_successful:
+            logging.error(
+                f"{len(filenames) - outcome.unsent_from} deletion(s) were not written"
+            )
+            self.write_successful = False
 
     def _update_changed_files(self) -> None:
         # Update DB paths that differ from disk only by Unicode spelling or case.
-        drive_paths = set(self._files.keys())
+        drive_paths = self._files.keys()
+
+        # DB rows to rename, written together once every rename is known
+        renames: list[tuple[FileInfo, str]] = []
+
+        # DB rows with no matching path on disk, checked for renames by fingerprint
+        missing_from_disk: list[FileInfo] = []
 
         for db_file_info in self._list_from_db:
             if db_file_info.filename in drive_paths:
                 continue
 
-            equivalent_path = find_equivalent_path(db_file_info.filename, drive_paths)
+            # The walk could not tell whether files under these directories are gone
+            if self._unreadable_prefixes and db_file_info.filename.startswith(
+                self._unreadable_prefixes
+            ):
+                continue
+
+            # Incremental walks only reconcile paths that disappeared from disk
+            if self._diff is not None and db_file_info.filename not in self._diff.removed:
+                continue
+
+            equivalent_path = self._identity_index.find(db_file_info.filename)
             if equivalent_path is not None:
                 drive_file_info = self._files[equivalent_path]
                 if not paths_same_file(
                     db_file_info.filename, drive_file_info.filename
                 ):
-                    if self._set_filename_in_db(
-                        db_file_info.filename,
-                        drive_file_info.filename,
-                    ):
-                        db_file_info.filename = drive_file_info.filename
+                    renames.append((db_file_info, drive_file_info.filename))
+                continue
+
+            missing_from_disk.append(db_file_info)
+
+        renames.extend(self._match_renamed_files(missing_from_disk))
+        renamed = self._rename_in_db(renames)
+
+        # Rows whose rename could not be written are treated as deleted
+        deleted_filenames: list[str] = []
+        for db_file_info in missing_from_disk:
+            if db_file_info in renamed:
                 continue
 
             logging.info("File deleted: %s", db_file_info.filename)
-            self._mark_deleted_in_db(db_file_info.filename)
+            deleted_filenames.append(db_file_info.filename)
+
+        self._mark_deleted_in_db(deleted_filenames)
+
+    def _match_renamed_files(
+        self, missing_from_disk: list[FileInfo]
+    ) -> list[tuple[FileInfo, str]]:
+        # Index the missing DB rows by their stored content fingerprint
+        missing_by_fingerprint: dict[str, list[FileInfo]] = {}
+        for db_file_info in missing_from_disk:
+            if db_file_info.content_fingerprint:
+                missing_by_fingerprint.setdefault(
+                    db_file_info.content_fingerprint, []
+                ).append(db_file_info)
+
+        if not missing_by_fingerprint:
+            return []
+
+        # Only paths that are new on disk can be the new name of a missing row
+        identity_keys_from_db = {
+            path_identity_key(db_file_info.filename)
+            for db_file_info in self._list_from_db
+        }
+        if self._diff is not None:
+            new_paths = [path for path in self._diff.added if path in self._files]
+        else:
+            new_paths = list(self._files)
+
+        candidates: dict[str, list[FileInfo]] = {}
+        for path in new_paths:
+            if path_identity_key(path) in identity_keys_from_db:
+                continue
+
+            drive_file_info = self._files[path]
+            if drive_file_info.content_fingerprint is None:
+                try:
+                    drive_file_info.content_fingerprint = compute_partial_hash(
+                        resolve_filesystem_path(Path(path)), drive_file_info.size
+                    )
+                except OSError as e:
+                    logging.error(f"Could not fingerprint {path}: {e}")
+                    continue
+
+            if drive_file_info.content_fingerprint in missing_by_fingerprint:
+                candidates.setdefault(drive_file_info.content_fingerprint, []).append(
+                    drive_file_info
+                )
+
+        renames: list[tuple[FileInfo, str]] = []
+        for fingerprint, drive_file_infos in candidates.items():
+            db_file_infos = missing_by_fingerprint[fingerprint]
+            if len(db_file_infos) > 1:
+                logging.warning(
+                    "Skipping rename match for %s: %s database rows share its fingerprint",
+                    drive_file_infos[0].filename,
+                    len(db_file_infos),
+                )
+                continue
+
+            db_file_info = db_file_infos[0]
+            drive_file_info = self._closest_path(db_file_info.filename, drive_file_infos)
+            if drive_file_info is None:
+                logging.warning(
+                    "Skipping rename match for %s: %s files on disk share its fingerprint",
+                    db_file_info.filename,
+                    len(drive_file_infos),
+                )
+                continue
+
+            logging.info(
+                "File renamed: %s -> %s", db_file_info.filename, drive_file_info.filename
+            )
+            renames.append((db_file_info, drive_file_info.filename))
+
+        return renames
+
+    @staticmethod
+    def _closest_path(filename: str, candidates: list[FileInfo]) -> FileInfo | None:
+        # Tie-break on the longest common path prefix, giving up if still ambiguous
+        if len(candidates) == 1:
+            return candidates[0]
+
+        def prefix_length(candidate: FileInfo) -> int:
+            return len(os.path.commonprefix([filename, candidate.filename]))
+
+        ranked = sorted(candidates, key=prefix_length, reverse=True)
+        if prefix_length(ranked[0]) == prefix_length(ranked[1]):
+            return None
+        return ranked[0]
+
+    @staticmethod
+    def _get_size_and_mtime(file_info: FileInfo) -> tuple[int | None, int | None]:
+        # Prefer the values collected by the walk over another stat
+        if file_info.size is not None and file_info.mtime_ns is not None:
+            return file_info.size, file_info.mtime_ns
+        try:
+            file_stat = resolve_filesystem_path(Path(file_info.filename)).stat()
+        except OSError:
+            return None, None
+        return file_stat.st_size, file_stat.st_mtime_ns
+
+    def _record_probe_failure(self, probe_result: ProbeResult, error: str) -> None:
+        # Files that vanished before they could be stat'ed are not recorded
+        if (
+            self._probe_cache is None
+            or probe_result.file_size is None
+            or probe_result.mtime_ns is None
+        ):
+            return
+
+        # The file is only probed again sooner if the failure is not recorded
+        try:
+            self._probe_cache.record_failure(
+                probe_result.file_info.filename,
+                probe_result.file_size,
+                probe_result.mtime_ns,
+                error.strip() or "Unknown error",
+            )
+        except sqlite3.Error as e:
+            logging.error(
+                f"Could not record the probe failure of {probe_result.file_info.filename}: {e}"
+            )
+
+    def _get_probe_failures(self) -> dict[str, ProbeFailure]:
+        # Without readable failure records every file is probed, as before backoff
+        if self._probe_cache is None:
+            return {}
+
+        try:
+            if self._diff is None:
+                self._probe_cache.prune_failures(self._files)
+            else:
+                self._probe_cache.clear_failures(self._diff.removed)
+            return self._probe_cache.get_failures()
+        except sqlite3.Error as e:
+            logging.error(f"Could not read probe failures from the probe cache: {e}")
+            return {}
+
+    def _get_retries_due(self, probe_failures: dict[str, ProbeFailure]) -> set[str]:
+        # Files on disk that failed to probe and whose backoff has run out
+        now = time.time()
+        return {
+            filename
+            for filename, probe_failure in probe_failures.items()
+            if filename in self._files
+            and not probe_failure.pending(
+                *self._get_size_and_mtime(self._files[filename]), now
+            )
+        }
 
     def get_file_encoding(self) -> None:
         # Only run if the connection to MongoDB was successful
         if not self.connection_successful:
             return
 
-        # List of bulk write operations to run
-        bulk_write_operations = []
-        # Filenames newly upserted this walk (cover-art prefetch; not renames)
-        new_filenames: list[str] = []
+        # Write new files in batches as they are probed, prefetching cover art
+        # for each batch once it is stored (new files only, not renames)
+        walker_config = config.config_data.walker
+        writer = StreamingBulkWriter(
+            media_collection,
+            batch_size=walker_config.write_batch_size,
+            interval_seconds=walker_config.write_interval_seconds,
+            retry_attempts=walker_config.write_retry_attempts,
+            retry_backoff_seconds=walker_config.write_retry_backoff_seconds,
+            on_flush=ensure_posters_background,
+        )
 
         logging.info("Getting file encoding")
 
@@ -155,28 +599,67 @@ class CodecDetector:
             path_identity_key(filename) for filename in filenames_from_db
         }
 
-        for file_info in self._files.values():
-            if file_info.filename in filenames_from_db:
-                continue
-            if path_identity_key(file_info.filename) in normalized_filenames_from_db:
-                continue
-
-            probe_path = resolve_filesystem_path(Path(file_info.filename))
+        if self._diff is not None:
+            # Incremental walks only probe paths that appeared on disk, changed
+            # since the last walk or are due another try after failing to probe
+            candidate_files = [
+                self._files[filename]
+                for filename in self._diff.added | self._diff.changed | self._retries_due
+                if filename in self._files
+            ]
+        else:
+            candidate_files = list(self._files.values())
+
+        new_files = [
+            file_info
+            for file_info in candidate_files
+            if file_info.filename in self._rewritten_filenames
+            or (
+                file_info.filename not in filenames_from_db
+                and path_identity_key(file_info.filename)
+                not in normalized_filenames_from_db
+            )
+        ]
 
-            file_stat = probe_path.stat()
-            file_size = file_stat.st_size
+        # Skip files that failed to probe recently and have not changed since
+        probe_failures = self._get_probe_failures()
+        if probe_failures:
+            now = time.time()
+            backing_off = {
+                file_info.filename
+                for file_info in new_files
+                if file_info.filename in probe_failures
+                and probe_failures[file_info.filename].pending(
+                    *self._get_size_and_mtime(file_info), now
+                )
+            }
+            if backing_off:
+                logging.info(
+                    f"Skipping {len(backing_off)} file(s) that failed to probe recently"
+                )
+                new_files = [
+                    file_info
+                    for file_info in new_files
+                    if file_info.filename not in backing_off
+                ]
+
+        if new_files:
+            rewritten_count = sum(
+                file_info.filename in self._rewritten_filenames for file_info in new_files
+            )
+            logging.info(
+                f"Probing {len(new_files) - rewritten_count} new and "
+                f"{rewritten_count} rewritten file(s)"
+            )
 
-            ffprobe_command = list(self._ffprobe_base_command)
-            ffprobe_command.append(probe_path.as_posix())
+        # Files that probed successfully after failing before
+        recovered_filenames: list[str] = []
 
-            ffprobe_output = subprocess.run(
-                ffprobe_command,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                universal_newlines=True,
-            )
+        # Probe in parallel and handle each result as soon as it completes
+        for probe_result in self._probe_pool.probe(new_files):
+            file_info = probe_result.file_info
+            file_size = probe_result.file_size
 
-            conversion_required = True
             video_stream_count = 0
             audio_stream_count = 0
             subtitle_stream_count = 0
@@ -186,14 +669,15 @@ class CodecDetector:
             first_und_audio_stream = None
             first_subtitle_stream = None
 
-            if ffprobe_output.returncode == 0:
+            if probe_result.successful and file_size is not None:
                 try:
                     video_information = VideoInformation.parse_raw(
-                        ffprobe_output.stdout
+                        probe_result.stdout
                     )
                 except ValidationError as e:
                     logging.error(f"Error parsing {file_info.filename}")
                     logging.error(e)
+                    self._record_probe_failure(probe_result, str(e))
                     continue
 
                 for stream in video_information.streams:
@@ -233,11 +717,19 @@ class CodecDetector:
                 if first_audio_stream is None:
                     first_audio_stream = 1
 
+                decision = decide(
+                    video_information,
+                    first_video_stream,
+                    config.config_data.conversion_rules,
+                )
+
                 file_data = FileData(
                     filename=file_info.filename,
                     deleted=False,
                     video_information=video_information,
-                    conversion_required=conversion_required,
+                    conversion_required=decision.conversion_required,
+                    conversion_skip_reason=decision.skip_reason,
+                    conversion_mode=decision.conversion_mode or "encode",
                     converting=False,
                     converted=False,
                     conversion_error=False,
@@ -259,42 +751,63 @@ class CodecDetector:
                     pre_conversion_size=file_size,
                     current_size=file_size,
                     backend_name="None",
+                    content_fingerprint=probe_result.partial_hash,
                 )
 
-                if conversion_required:
+                if decision.conversion_mode == "remux":
+                    logging.info(f"{file_info.filename}: REMUX")
+                elif decision.conversion_required:
                     logging.info(f"{file_info.filename}: CONVERT")
                 else:
-                    logging.info(f"{file_info.filename}: OK")
-
-                bulk_write_operations.append(
-                    UpdateOne(
+                    logging.info(f"{file_info.filename}: OK ({decision.skip_reason})")
+
+                if file_info.filename in self._rewritten_filenames:
+                    # Leave the row alone if a backend claimed it since it was read
+                    update = UpdateOne(
+                        {
+                            "filename": file_info.filename,
+                            **{
+                                flag: {"$ne": True}
+                                for flag in _REPROBE_BLOCKING_FLAGS
+                            },
+                        },
+                        {"$set": file_data.model_dump()},
+                    )
+                else:
+                    update = UpdateOne(
                         {"filename": file_info.filename},
                         {"$set": file_data.model_dump()},
                         upsert=True,
                     )
-                )
-                new_filenames.append(file_info.filename)
+                writer.add(update, file_info.filename)
+
+                if file_info.filename in probe_failures:
+                    recovered_filenames.append(file_info.filename)
             else:
                 logging.error(f"ffprobe failed for {file_info.filename}")
-                logging.error(ffprobe_output.stderr)
+                logging.error(probe_result.stderr)
+                self._record_probe_failure(probe_result, probe_result.stderr)
 
-        if bulk_write_operations:
-            # There is new data to write to MongoDB
-            logging.info("Writing to MongoDB")
-
-            # Write the new data to MongoDB
+        if recovered_filenames and self._probe_cache is not None:
             try:
-                media_collection.bulk_write(bulk_write_operations)
-            except ServerSelectionTimeoutError:
-                logging.error("Could not connect to MongoDB")
-            except NetworkTimeout:
-                logging.error("Could not connect to MongoDB")
-            except AutoReconnect:
-                logging.error("Could not connect to MongoDB.")
-            else:
-                logging.info("Finished writing to MongoDB")
-                # Prefetch cover art off the walk thread (soft-fail inside helper)
-                ensure_posters_background(new_filenames)
+                self._probe_cache.clear_failures(recovered_filenames)
+            except sqlite3.Error as e:
+                logging.error(f"Could not clear probe failures from the probe cache: {e}")
+
+        if new_files and self._probe_cache is not None:
+            self._probe_cache.log_stats()
+
+        # Write whatever is left from the last batch
+        writer.flush()
+
+        if not writer.successful:
+            self.write_successful = False
+
+        if writer.written or writer.failed:
+            logging.info(
+                f"Finished writing to MongoDB: {writer.written} written, "
+                f"{writer.failed} failed"
+            )
         else:
             # There is no new data to write to MongoDB
             logging.info("No new data to write to MongoDB")
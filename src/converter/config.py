@@ -2,6 +2,7 @@ from datetime import time
 import os
 from pathlib import Path
 import tomllib
+from typing import Literal
 
 from pydantic import BaseModel, ConfigDict, Field
 
@@ -40,9 +41,95 @@ class Encoding(BaseModel):
     vt_realtime: int = 0
 
 
+class Walker(BaseModel):
+    engine: Literal["scandir", "pathlib"] = "scandir"
+    incremental: bool = True
+    full_reconcile_minutes: int = 60
+    discovery: Literal["poll", "inotify"] = "poll"
+    debounce_seconds: float = 5.0
+    reconcile_batch_size: int = 1000
+    write_batch_size: int = 100
+    write_interval_seconds: float = 10.0
+    write_retry_attempts: int = 3
+    write_retry_backoff_seconds: float = 2.0
+
+
+class Probe(BaseModel):
+    workers: int = 4
+    timeout_seconds: float = 300
+    cache_enabled: bool = True
+    cache_max_entries: int = 200_000
+    failure_retry_seconds: float = 60
+    failure_retry_max_seconds: float = 86400
+    failure_max_attempts: int = 10
+
+
+class ConversionRules(BaseModel):
+    enabled: bool = True
+    skip_codecs: list[str] = Field(default_factory=lambda: ["hevc", "av1"])
+    skip_codec_max_bits_per_pixel: float = 0.15
+    min_height: int = 0
+    min_bit_rate: int = 0
+    min_bits_per_pixel: float = 0.0
+    target_bits_per_pixel: float = 0.03
+    min_expected_saving: float = 0.2
+    remux_enabled: bool = True
+    remux_codecs: list[str] = Field(default_factory=lambda: ["hevc"])
+
+
+class Segments(BaseModel):
+    enabled: bool = False
+    workers: int = 0
+    segment_seconds: float = 300
+    min_duration_seconds: float = 1200
+    keyframe_search_seconds: float = 30
+    resume: bool = True
+    distributed: bool = False
+    shared_directory: Path = Path("/Media/Conversions/segments")
+    poll_seconds: float = 5
+    heartbeat_seconds: float = 10
+    stale_claim_seconds: float = 120
+
+
+class Sampling(BaseModel):
+    enabled: bool = False
+    sample_count: int = 3
+    sample_seconds: float = 20
+    min_duration_seconds: float = 600
+    min_predicted_saving: float = 0.1
+
+
+class EarlyAbort(BaseModel):
+    enabled: bool = False
+    max_output_fraction: float = 1.0
+    warmup_seconds: float = 300
+    warmup_fraction: float = 0.1
+
+
+class Slots(BaseModel):
+    max_slots: int = 1
+    cores: int = 0
+    cores_per_job: int = 16
+    cores_per_small_job: int = 4
+
+
+class Prefetch(BaseModel):
+    enabled: bool = False
+
+
+class Verification(BaseModel):
+    mode: Literal["edges", "full"] = "edges"
+    algorithm: Literal["blake2b", "xxh3"] = "blake2b"
+
+
+class Progress(BaseModel):
+    interval_seconds: float = 1.0
+
+
 class Runtime(BaseModel):
     log_directory: Path | None = None
     secrets_dir: Path = Path("src/secrets")
+    state_directory: Path = Path("/tmp/convert-to-h265/state")
 
 
 class PathMap(BaseModel):
@@ -55,6 +142,16 @@ class ConfigData(BaseModel):
     folders: Folders
     schedule: Schedule
     encoding: Encoding = Field(default_factory=Encoding)
+    walker: Walker = Field(default_factory=Walker)
+    probe: Probe = Field(default_factory=Probe)
+    conversion_rules: ConversionRules = Field(default_factory=ConversionRules)
+    segments: Segments = Field(default_factory=Segments)
+    sampling: Sampling = Field(default_factory=Sampling)
+    early_abort: EarlyAbort = Field(default_factory=EarlyAbort)
+    slots: Slots = Field(default_factory=Slots)
+    prefetch: Prefetch = Field(default_factory=Prefetch)
+    verification: Verification = Field(default_factory=Verification)
+    progress: Progress = Field(default_factory=Progress)
     runtime: Runtime = Field(default_factory=Runtime)
     path_map: PathMap = Field(default_factory=PathMap)
 
@@ -94,5 +191,8 @@ class Config:
         config_data.runtime.secrets_dir = _resolve_path(
             config_data.runtime.secrets_dir
         )
+        config_data.runtime.state_directory = _resolve_path(
+            config_data.runtime.state_directory
+        )
 
         self.config_data = config_data
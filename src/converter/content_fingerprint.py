@@ -0,0 +1,32 @@
+"""Partial content hash identifying a media file without reading all of it.
+
+See Design/InodeIdentityAndRenameDetection.md: SHA-256 over the first MiB,
+the file size as a little-endian uint64 and the last MiB. Files smaller than
+two MiB are hashed in full (still including the size).
+"""
+
+from __future__ import annotations
+
+import hashlib
+from pathlib import Path
+
+_EDGE_SIZE = 1024 * 1024
+
+
+def compute_partial_hash(path: Path, size: int | None = None) -> str:
+    if size is None:
+        size = path.stat().st_size
+
+    digest = hashlib.sha256()
+
+    with path.open("rb") as f:
+        if size < 2 * _EDGE_SIZE:
+            digest.update(f.read())
+            digest.update(size.to_bytes(8, "little"))
+        else:
+            digest.update(f.read(_EDGE_SIZE))
+            digest.update(size.to_bytes(8, "little"))
+            f.seek(size - _EDGE_SIZE)
+            digest.update(f.read(_EDGE_SIZE))
+
+    return digest.hexdigest()
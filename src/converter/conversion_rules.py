@@ -0,0 +1,155 @@
+"""Decide from probe data whether a file is worth converting.
+
+Rules come from the ``[conversion_rules]`` config section. Each returns the
+reason a file should be skipped, and a file is encoded only if no rule
+applies. Skipped files whose video is already in a remux codec but not in a
+Matroska container are stream-copied into one instead. The walker evaluates
+the rules for new files and ``src/reevaluate_rules.py`` applies changed rules
+to existing rows.
+"""
+
+from __future__ import annotations
+
+from .config import ConversionRules
+from .models import ConversionMode, Stream, VideoInformation
+
+
+class ConversionDecision:
+    def __init__(
+        self, conversion_mode: ConversionMode | None, skip_reason: str | None
+    ) -> None:
+        # None when the file is not converted at all
+        self.conversion_mode = conversion_mode
+        self.skip_reason = skip_reason
+
+    @property
+    def conversion_required(self) -> bool:
+        return self.conversion_mode is not None
+
+
+def _parse_frame_rate(frame_rate: str | None) -> float | None:
+    # ffprobe reports rates as fractions such as "24000/1001"
+    if not frame_rate:
+        return None
+    numerator, _, denominator = frame_rate.partition("/")
+    try:
+        rate = float(numerator) / float(denominator or 1)
+    except (ValueError, ZeroDivisionError):
+        return None
+    return rate if rate > 0 else None
+
+
+def _get_video_stream(
+    video_information: VideoInformation, first_video_stream: int | None
+) -> Stream | None:
+    video_streams = [
+        stream for stream in video_information.streams if stream.codec_type == "video"
+    ]
+    for stream in video_streams:
+        if stream.index == first_video_stream:
+            return stream
+    return video_streams[0] if video_streams else None
+
+
+def get_video_bit_rate(
+    video_information: VideoInformation, video_stream: Stream
+) -> int | None:
+    # Matroska rarely reports a per-stream bit rate, so fall back to the
+    # container rate less the audio streams that do report one
+    if video_stream.bit_rate:
+        return video_stream.bit_rate
+    if not video_information.format.bit_rate:
+        return None
+
+    audio_bit_rate = sum(
+        stream.bit_rate or 0
+        for stream in video_information.streams
+        if stream.codec_type == "audio"
+    )
+    bit_rate = video_information.format.bit_rate - audio_bit_rate
+    return bit_rate if bit_rate > 0 else video_information.format.bit_rate
+
+
+def get_bits_per_pixel(
+    video_information: VideoInformation, video_stream: Stream
+) -> float | None:
+    """Video bits per pixel per frame, or None if the probe data is incomplete."""
+    bit_rate = get_video_bit_rate(video_information, video_stream)
+    frame_rate = _parse_frame_rate(video_stream.avg_frame_rate) or _parse_frame_rate(
+        video_stream.r_frame_rate
+    )
+    if not bit_rate or not frame_rate or not video_stream.width or not video_stream.height:
+        return None
+    return bit_rate / (video_stream.width * video_stream.height * frame_rate)
+
+
+def get_skip_reason(
+    video_information: VideoInformation,
+    first_video_stream: int | None,
+    rules: ConversionRules,
+) -> str | None:
+    """Return why the file should not be converted, or None to convert it."""
+    if not rules.enabled:
+        return None
+
+    video_stream = _get_video_stream(video_information, first_video_stream)
+    if video_stream is None:
+        return None
+
+    bits_per_pixel = get_bits_per_pixel(video_information, video_stream)
+    codec_name = (video_stream.codec_name or "").lower()
+
+    if codec_name in rules.skip_codecs:
+        if (
+            bits_per_pixel is None
+            or rules.skip_codec_max_bits_per_pixel <= 0
+            or bits_per_pixel <= rules.skip_codec_max_bits_per_pixel
+        ):
+            return f"already {codec_name}"
+
+    if video_stream.height and video_stream.height < rules.min_height:
+        return f"height {video_stream.height} is below {rules.min_height}"
+
+    bit_rate = video_information.format.bit_rate
+    if bit_rate and bit_rate < rules.min_bit_rate:
+        return f"bit rate {bit_rate} is below {rules.min_bit_rate}"
+
+    if bits_per_pixel is not None:
+        if bits_per_pixel < rules.min_bits_per_pixel:
+            return (
+                f"{bits_per_pixel:.3f} bits per pixel is below "
+                f"{rules.min_bits_per_pixel}"
+            )
+
+        # Expect the encoder to land near target_bits_per_pixel
+        expected_saving = 1 - rules.target_bits_per_pixel / bits_per_pixel
+        if expected_saving < rules.min_expected_saving:
+            return (
+                f"expected saving {expected_saving:.0%} is below "
+                f"{rules.min_expected_saving:.0%}"
+            )
+
+    return None
+
+
+def decide(
+    video_information: VideoInformation,
+    first_video_stream: int | None,
+    rules: ConversionRules,
+) -> ConversionDecision:
+    """Choose between encoding, remuxing and skipping the file."""
+    skip_reason = get_skip_reason(video_information, first_video_stream, rules)
+    if skip_reason is None:
+        return ConversionDecision("encode", None)
+
+    video_stream = _get_video_stream(video_information, first_video_stream)
+    format_name = video_information.format.format_name or ""
+    if (
+        rules.remux_enabled
+        and video_stream is not None
+        and (video_stream.codec_name or "").lower() in rules.remux_codecs
+        and "matroska" not in format_name.split(",")
+    ):
+        return ConversionDecision("remux", None)
+
+    return ConversionDecision(None, skip_reason)
@@ -0,0 +1,134 @@
+"""Run several converters at once on one backend.
+
+Each slot keeps its own ``Converter``, reused for every file it converts,
+and runs each conversion in a thread. A slot only claims a file
+when the cores left over could take at least a small file, and once it knows
+what it claimed it reserves the cores that file needs: ``cores_per_job`` for
+files taller than ``encoding.small_height_threshold`` and
+``cores_per_small_job`` otherwise. Segments shared by other backends carry no
+height and reserve ``cores_per_job``. Only one slot claims at a time, so an
+empty queue is polled by a single slot.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import threading
+
+from . import config
+from .converter import Converter
+from .models import FileData, SegmentJob
+
+
+def get_slot_cores(configured_cores: int) -> int:
+    if configured_cores > 0:
+        return configured_cores
+    return os.cpu_count() or 1
+
+
+def get_job_cores(file_data: FileData) -> int:
+    slots = config.config_data.slots
+    first_video_stream = file_data.first_video_stream
+    streams = file_data.video_information.streams
+
+    height = None
+    if first_video_stream is not None and first_video_stream < len(streams):
+        height = streams[first_video_stream].height
+
+    if height is not None and height <= config.config_data.encoding.small_height_threshold:
+        return slots.cores_per_small_job
+    return slots.cores_per_job
+
+
+class ConversionSlots:
+    def __init__(self) -> None:
+        self._max_slots = max(1, config.config_data.slots.max_slots)
+        self._cores = get_slot_cores(config.config_data.slots.cores)
+
+        self._lock = threading.Lock()
+        # Converter of each slot that has run, kept for its later files
+        self._slot_converters: dict[int, Converter] = {}
+        # Converter of each busy slot, and the cores reserved for its file
+        self._converters: dict[int, Converter] = {}
+        self._reserved_cores: dict[int, int] = {}
+        # Slot that has not yet claimed a file
+        self._claiming_slot: int | None = None
+
+    @property
+    def active(self) -> int:
+        with self._lock:
+            return len(self._converters)
+
+    def _free_slot(self) -> int | None:
+        for slot in range(self._max_slots):
+            if slot not in self._converters:
+                return slot
+        return None
+
+    def fill(self) -> None:
+        """Start a slot if there is room for another file."""
+        with self._lock:
+            if self._claiming_slot is not None:
+                return
+
+            free_cores = self._cores - sum(self._reserved_cores.values())
+            # Always allow one slot, so a small machine still converts
+            if self._converters and free_cores < config.config_data.slots.cores_per_small_job:
+                return
+
+            slot = self._free_slot()
+            if slot is None:
+                return
+
+            converter = self._slot_converters.get(slot)
+            if converter is None:
+                converter = Converter(
+                    slot=slot,
+                    on_claimed=lambda claimed: self._on_claimed(slot, claimed),
+                )
+                self._slot_converters[slot] = converter
+            self._converters[slot] = converter
+            self._claiming_slot = slot
+
+        # Daemon threads so stopping the backend does not wait for encodes
+        threading.Thread(
+            target=self._run,
+            args=(slot, converter),
+            name=f"slot-{slot}",
+            daemon=True,
+        ).start()
+
+    def _on_claimed(self, slot: int, claimed: FileData | SegmentJob) -> None:
+        if isinstance(claimed, SegmentJob):
+            job_cores = config.config_data.slots.cores_per_job
+        else:
+            job_cores = get_job_cores(claimed)
+        logging.info(
+            f"Slot {slot} claimed {claimed.filename}, reserving {job_cores} cores"
+        )
+
+        with self._lock:
+            self._reserved_cores[slot] = job_cores
+            if self._claiming_slot == slot:
+                self._claiming_slot = None
+
+    def _run(self, slot: int, converter: Converter) -> None:
+        try:
+            converter.convert()
+        except Exception:
+            logging.exception(f"Conversion in slot {slot} failed")
+        finally:
+            with self._lock:
+                self._converters.pop(slot, None)
+                self._reserved_cores.pop(slot, None)
+                if self._claiming_slot == slot:
+                    self._claiming_slot = None
+
+    def terminate(self) -> None:
+        """Stop every slot's ffmpeg processes and clean up their files."""
+        with self._lock:
+            converters = list(self._converters.values())
+
+        for converter in converters:
+            converter.terminate()
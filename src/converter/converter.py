@@ -4,59 +4,58 @@ import hashlib
 import json
 from pathlib import Path
 import logging
-import signal
 import subprocess
-import sys
 import shutil
 import os
 import time
-from typing import Any
+from typing import TYPE_CHECKING, Any, Callable
 
-from pymongo import DESCENDING
 from pymongo.errors import ServerSelectionTimeoutError, NetworkTimeout, AutoReconnect
 
 from ffmpeg import FFmpeg, FFmpegError
 from ffmpeg import Progress as FFmpegProgress
 
-from pywebpush import webpush, WebPushException
-
-from requests.status_codes import codes
-
-from .models import FileData
+from .models import FileData, Segment, SegmentJob
 from . import media_collection, push_collection, cover_art_cache_collection, config, NOTIFICATION_TTL
-from .cover_art import notification_image_fields
+from .claim_queue import claim_next
+from .content_fingerprint import compute_partial_hash
+from .copy_engine import FileHasher, copy_file, hash_file
+from .progress_reporter import get_progress_reporter
+from .conversion_rules import get_video_bit_rate
+from .sampling import SizePrediction, SizePredictor
+from .segment_jobs import DistributedSegmentedEncode, SegmentHelper
+from .segments import SegmentedEncode, get_segment_workers, plan_segments
 from .unicode_paths import resolve_filesystem_path
 
+if TYPE_CHECKING:
+    from .prefetch import StagingPrefetcher
+
 
-class _ProgressReader:
-    """Wrap a readable file object and report copy progress on each read()."""
+class _SizeProjector:
+    """Project the final output size of an encode from the bytes written so far."""
 
     def __init__(
         self,
-        raw: Any,
-        *,
-        base_bytes: int,
-        total_size: int,
-        on_progress: Any,
+        input_size: int,
+        duration: float,
+        max_output_fraction: float,
+        warmup_seconds: float,
+        warmup_fraction: float,
     ) -> None:
-        self._raw = raw
-        self._base_bytes = base_bytes
-        self._total_size = total_size
-        self._bytes_copied = 0
-        self._on_progress = on_progress
-
-    def read(self, size: int = -1) -> bytes:
-        chunk = self._raw.read(size)
-        if chunk:
-            self._bytes_copied += len(chunk)
-            if self._total_size > 0:
-                percentage_complete = (
-                    (self._base_bytes + self._bytes_copied) / self._total_size
-                ) * 100
-            else:
-                percentage_complete = 100.0
-            self._on_progress(percentage_complete)
-        return chunk
+        self._max_output_size = input_size * max_output_fraction
+        self._duration = duration
+        # The opening minutes are often not representative, so wait for both
+        self._warmup_seconds = max(warmup_seconds, duration * warmup_fraction)
+
+    def projected_oversize(self, encoded_seconds: float, output_size: int) -> int | None:
+        """Return the projected size if it exceeds the limit after the warm-up."""
+        if encoded_seconds < self._warmup_seconds or encoded_seconds <= 0:
+            return None
+
+        projected_size = int(output_size / encoded_seconds * self._duration)
+        if projected_size <= self._max_output_size:
+            return None
+        return projected_size
 
 
 class Converter:
@@ -64,9 +63,20 @@ class Converter:
     _copy_chunk_size = 8 * 1024 * 1024
     _copy_max_attempts = 3
     _copy_retry_backoff_seconds = (2, 5, 10)
-    _progress_update_interval_seconds = 1.0
 
-    def __init__(self):
+    def __init__(
+        self,
+        slot: int | None = None,
+        on_claimed: Callable[[FileData | SegmentJob], None] | None = None,
+        prefetcher: "StagingPrefetcher | None" = None,
+    ):
+        self._slot = slot
+        self._on_claimed = on_claimed
+        self._terminated = False
+
+        # Stages the next file while this one encodes
+        self._prefetcher = prefetcher
+
         # Create ffmpeg object and set it to None
         self._ffmpeg: FFmpeg | None = None
 
@@ -80,13 +90,21 @@ class Converter:
         # Create the backup path and set it to None
         self._backup_path: Path | None = None
 
-        # Track the last persisted progress update so copy and conversion progress
-        # do not overwhelm MongoDB with writes.
-        self._last_progress_update_time: datetime | None = None
+        # Segment-parallel encode of the current file
+        self._segmented_encode: SegmentedEncode | None = None
+
+        # Segment of another backend's file being encoded
+        self._segment_helper: SegmentHelper | None = None
+
+        # Sample encodes predicting the output size of the current file
+        self._size_predictor: SizePredictor | None = None
 
-        # Register signal handlers
-        signal.signal(signal.SIGINT, self._signal_handler)
-        signal.signal(signal.SIGTERM, self._signal_handler)
+        # Projected output size that stopped the current encode early
+        self._early_abort_size: int | None = None
+
+        # Writes copy and conversion progress in the background, coalescing updates
+        # so the copy and encode paths never wait on MongoDB
+        self._progress_reporter = get_progress_reporter()
 
     def _resolve_source_path(self, filename: str) -> Path:
         source_path = Path(filename)
@@ -145,7 +163,21 @@ class Converter:
         logging.info(f"Using video encoder {video_codec}")
         self._validated_encoders.add(video_codec)
 
+    def _is_remux(self) -> bool:
+        return (
+            self._file_data is not None
+            and self._file_data.conversion_mode == "remux"
+        )
+
     def _build_output_options(self, subtitle_codec: str) -> dict[str, Any]:
+        if self._is_remux():
+            # Already in the target codec, only the container changes
+            return {
+                "c:v": "copy",
+                "c:a": "copy",
+                "c:s": subtitle_codec,
+            }
+
         encoding = config.config_data.encoding
         video_codec = encoding.video_codec
         video_height = self._get_first_video_height()
@@ -183,6 +215,487 @@ class Converter:
 
         return options
 
+    def _plan_segments(self) -> list[Segment] | None:
+        segments_config = config.config_data.segments
+        if (
+            not segments_config.enabled
+            or self._is_remux()
+            or self._file_data is None
+            or self._temporary_input_path is None
+        ):
+            return None
+
+        # Resume with the plan the finished segments were encoded from
+        if self._file_data.segment_plan is not None:
+            logging.info(
+                f"Resuming {self._file_data.filename} with "
+                f"{len(self._file_data.completed_segments)} of "
+                f"{len(self._file_data.segment_plan)} segments finished"
+            )
+            return self._file_data.segment_plan
+
+        duration = self._file_data.video_information.format.duration
+        workers = get_segment_workers(segments_config.workers)
+        # Other backends add workers to a distributed encode, and a resumable
+        # encode is worth splitting for its checkpoints alone
+        min_workers = 1 if segments_config.distributed or segments_config.resume else 2
+        if duration < segments_config.min_duration_seconds or workers < min_workers:
+            return None
+
+        segments = plan_segments(
+            self._temporary_input_path,
+            self._file_data.first_video_stream or 0,
+            duration,
+            segments_config.segment_seconds,
+            segments_config.keyframe_search_seconds,
+        )
+        if len(segments) < 2:
+            return None
+
+        logging.info(
+            f"Encoding {self._file_data.filename} as {len(segments)} segments "
+            f"with {workers} workers"
+        )
+
+        if segments_config.resume:
+            self._save_segment_plan(segments)
+
+        return segments
+
+    def _get_size_projector(self, input_file_path: Path) -> _SizeProjector | None:
+        early_abort = config.config_data.early_abort
+        if not early_abort.enabled or self._is_remux() or self._file_data is None:
+            return None
+
+        return _SizeProjector(
+            input_file_path.stat().st_size,
+            self._file_data.video_information.format.duration,
+            early_abort.max_output_fraction,
+            early_abort.warmup_seconds,
+            early_abort.warmup_fraction,
+        )
+
+    def _abort_oversized_encode(self) -> None:
+        if self._file_data is None or self._early_abort_size is None:
+            return
+
+        pre_conversion_size = self._file_data.pre_conversion_size
+        self._mark_incompressible(
+            f"projected size is {self._early_abort_size / pre_conversion_size:.0%} "
+            "of the input"
+            if pre_conversion_size > 0
+            else "projected size is too large",
+            {
+                "predicted_size": self._early_abort_size,
+                "predicted_saving": (
+                    1 - self._early_abort_size / pre_conversion_size
+                    if pre_conversion_size > 0
+                    else None
+                ),
+            },
+        )
+
+        self._ffmpeg = None
+        self._early_abort_size = None
+        self._delete_temporary_files()
+        self._file_data = None
+
+    def _should_sample(self) -> bool:
+        sampling = config.config_data.sampling
+        return (
+            sampling.enabled
+            and not self._is_remux()
+            and self._file_data is not None
+            # A resumed encode was sampled before it was stopped
+            and self._file_data.segment_plan is None
+            and self._file_data.video_information.format.duration
+            >= sampling.min_duration_seconds
+        )
+
+    def _predict_output_size(
+        self, output_options: dict[str, Any]
+    ) -> SizePrediction | None:
+        if self._file_data is None or self._temporary_input_path is None:
+            return None
+
+        sampling = config.config_data.sampling
+        video_information = self._file_data.video_information
+        first_video_stream = self._file_data.first_video_stream or 0
+
+        logging.info(
+            f"Encoding {sampling.sample_count} samples of {self._file_data.filename}"
+        )
+
+        self._size_predictor = SizePredictor(
+            self._temporary_input_path,
+            self._temporary_input_path.with_name(
+                self._temporary_input_path.stem + ".samples"
+            ),
+            video_information.format.duration,
+            first_video_stream,
+            get_video_bit_rate(
+                video_information, video_information.streams[first_video_stream]
+            ),
+            output_options,
+            sampling.sample_count,
+            sampling.sample_seconds,
+        )
+        try:
+            return self._size_predictor.predict(self._file_data.pre_conversion_size)
+        finally:
+            self._size_predictor = None
+
+    def _record_prediction(self, prediction: SizePrediction) -> bool:
+        """Store the prediction, returning False if the file is not worth converting."""
+        if self._file_data is None:
+            return False
+
+        min_predicted_saving = config.config_data.sampling.min_predicted_saving
+
+        logging.info(
+            f"Predicted size of {self._file_data.filename} is "
+            f"{prediction.predicted_size} bytes, saving "
+            f"{prediction.predicted_saving:.0%}"
+        )
+
+        self._file_data.predicted_size = prediction.predicted_size
+        self._file_data.predicted_saving = prediction.predicted_saving
+        fields: dict[str, Any] = {
+            "predicted_size": prediction.predicted_size,
+            "predicted_saving": prediction.predicted_saving,
+        }
+
+        if prediction.predicted_saving < min_predicted_saving:
+            self._mark_incompressible(
+                f"predicted saving {prediction.predicted_saving:.0%} is below "
+                f"{min_predicted_saving:.0%}",
+                fields,
+            )
+            return False
+
+        try:
+            media_collection.update_one(
+                {"filename": self._file_data.filename},
+                {"$set": fields},
+            )
+        except ServerSelectionTimeoutError:
+            logging.error("Could not connect to MongoDB.")
+        except NetworkTimeout:
+            logging.error("Could not connect to MongoDB.")
+        except AutoReconnect:
+            logging.error("Could not connect to MongoDB.")
+
+        return True
+
+    def _mark_incompressible(
+        self, reason: str, fields: dict[str, Any] | None = None
+    ) -> None:
+        # Leave the file alone until it changes, as a full encode would be wasted
+        if self._file_data is None:
+            return
+
+        logging.info(f"Skipping {self._file_data.filename}: {reason}")
+        self._discard_pending_progress()
+
+        self._file_data.converting = False
+        self._file_data.conversion_required = False
+        self._file_data.conversion_skip_reason = reason
+        self._file_data.incompressible = True
+        self._file_data.start_conversion_time = None
+        self._file_data.percentage_complete = 0
+
+        try:
+            media_collection.update_one(
+                {"filename": self._file_data.filename},
+                {
+                    "$set": {
+                        **(fields or {}),
+                        "converting": False,
+                        "conversion_required": False,
+                        "conversion_skip_reason": reason,
+                        "incompressible": True,
+                        "start_conversion_time": None,
+                        "percentage_complete": 0,
+                        "speed": None,
+                        "segment_plan": None,
+                        "completed_segments": [],
+                    }
+                },
+            )
+        except ServerSelectionTimeoutError:
+            logging.error("Could not connect to MongoDB.")
+        except NetworkTimeout:
+            logging.error("Could not connect to MongoDB.")
+        except AutoReconnect:
+            logging.error("Could not connect to MongoDB.")
+
+    def _save_segment_plan(self, segments: list[Segment]) -> None:
+        if self._file_data is None:
+            return
+
+        self._file_data.segment_plan = segments
+        self._file_data.completed_segments = []
+
+        try:
+            media_collection.update_one(
+                {"filename": self._file_data.filename},
+                {
+                    "$set": {
+                        "segment_plan": [segment.model_dump() for segment in segments],
+                        "completed_segments": [],
+                    }
+                },
+            )
+        except ServerSelectionTimeoutError:
+            logging.error("Could not connect to MongoDB.")
+        except NetworkTimeout:
+            logging.error("Could not connect to MongoDB.")
+        except AutoReconnect:
+            logging.error("Could not connect to MongoDB.")
+
+    def _record_completed_segment(self, index: int) -> None:
+        # Called from the segment workers as each segment is finished
+        if self._file_data is None or not config.config_data.segments.resume:
+            return
+
+        try:
+            media_collection.update_one(
+                {"filename": self._file_data.filename},
+                {"$addToSet": {"completed_segments": index}},
+            )
+        except ServerSelectionTimeoutError:
+            logging.error("Could not connect to MongoDB.")
+        except NetworkTimeout:
+            logging.error("Could not connect to MongoDB.")
+        except AutoReconnect:
+            logging.error("Could not connect to MongoDB.")
+
+    def _can_resume_segments(self, input_file_path: Path) -> bool:
+        # Finished segments are only reused with the staged input they came from
+        if (
+            self._file_data is None
+            or self._file_data.segment_plan is None
+            or not config.config_data.segments.enabled
+            or not config.config_data.segments.resume
+        ):
+            return False
+
+        return self._staged_input_matches(input_file_path)
+
+    def _run_segmented_encode(
+        self,
+        segments: list[Segment],
+        output_options: dict[str, Any],
+        subtitle_codec: str,
+        mapping: list[str],
+    ) -> bool:
+        """Encode the segments and join them, returning False if terminated."""
+        if (
+            self._file_data is None
+            or self._temporary_input_path is None
+            or self._temporary_output_path is None
+        ):
+            return False
+
+        segments_config = config.config_data.segments
+        duration = self._file_data.video_information.format.duration
+        video_stream = self._file_data.first_video_stream or 0
+        workers = get_segment_workers(segments_config.workers)
+
+        def _on_progress(percentage_complete: float, speed: float | None) -> None:
+            self._update_percentage_complete(
+                percentage_complete, speed=speed, phase="encoding"
+            )
+
+        completed = set(self._file_data.completed_segments)
+
+        if segments_config.distributed:
+            distributed_encode = DistributedSegmentedEncode(
+                self._file_data.filename,
+                self._temporary_input_path,
+                self._resolve_source_path,
+                segments,
+                duration,
+                video_stream,
+                output_options,
+                workers,
+                _on_progress,
+                os.getenv("BACKEND_NAME", "None"),
+                completed,
+                self._record_completed_segment,
+            )
+            if distributed_encode.create_jobs():
+                self._segmented_encode = distributed_encode
+            else:
+                logging.warning(
+                    f"Could not share the segments of {self._file_data.filename}, "
+                    "encoding them locally"
+                )
+                distributed_encode.cleanup()
+
+        if self._segmented_encode is None:
+            self._segmented_encode = SegmentedEncode(
+                self._temporary_input_path,
+                self._temporary_input_path.with_name(
+                    self._temporary_input_path.stem + ".segments"
+                ),
+                segments,
+                duration,
+                video_stream,
+                output_options,
+                workers,
+                _on_progress,
+                completed,
+                self._record_completed_segment,
+            )
+
+        if not self._segmented_encode.encode():
+            return False
+
+        # The joined video is input 0, audio and subtitles come from the staged input
+        join_mapping = ["0:v"] + [
+            stream_map.replace("0:", "1:", 1)
+            for stream_map in mapping
+            if stream_map in ("0:a?", "0:s?")
+        ]
+        return self._segmented_encode.join(
+            self._temporary_output_path, subtitle_codec, join_mapping
+        )
+
+    def _get_staging_paths(self, input_file_path: Path) -> tuple[Path, Path]:
+        if self._file_data is None:
+            raise RuntimeError("No file claimed")
+
+        # Unique per file with a short hash of the library path, since files in
+        # different folders share names
+        staging_id = hashlib.sha1(
+            self._file_data.filename.encode("utf-8")
+        ).hexdigest()[:8]
+        conversions = config.config_data.folders.conversions
+        return (
+            conversions / f"{input_file_path.stem}.{staging_id}{input_file_path.suffix}",
+            conversions / f"{input_file_path.stem}.{staging_id}.hevc.mkv",
+        )
+
+    def _staged_input_matches(self, input_file_path: Path) -> bool:
+        if self._temporary_input_path is None or not self._temporary_input_path.exists():
+            return False
+
+        try:
+            self._verify_copied_file(input_file_path, self._temporary_input_path)
+        except OSError as e:
+            logging.info(f"Not using staged input {self._temporary_input_path}: {e}")
+            return False
+
+        return True
+
+    def stage_next(self) -> FileData | None:
+        """Claim the next file and copy it to the conversions folder for a later convert()."""
+        self._file_data = self._get_highest_bit_rate(prefetch=True)
+        if self._file_data is None:
+            return None
+        self._open_progress()
+
+        # Released before the claim came back
+        if self._terminated:
+            self._cleanup_and_terminate()
+            return None
+
+        input_file_path = self._resolve_source_path(self._file_data.filename)
+        if not input_file_path.exists():
+            logging.error(f"{input_file_path} does not exist, not prefetching it")
+            self._cleanup_and_terminate()
+            return None
+
+        logging.info(f"Prefetching {self._file_data.filename}")
+
+        config.config_data.folders.conversions.mkdir(parents=True, exist_ok=True)
+        self._temporary_input_path, self._temporary_output_path = (
+            self._get_staging_paths(input_file_path)
+        )
+        staged_input_path = self._temporary_input_path
+
+        self._file_data.backend_name = os.getenv("BACKEND_NAME", "None")
+        self._file_data.copying = True
+        self._file_data.start_copy_time = self._utc_now()
+        try:
+            media_collection.update_one(
+                {"filename": self._file_data.filename},
+                {
+                    "$set": {
+                        "backend_name": self._file_data.backend_name,
+                        "copying": True,
+                        "start_copy_time": self._file_data.start_copy_time,
+                        "percentage_complete": 0,
+                    }
+                },
+            )
+        except ServerSelectionTimeoutError:
+            logging.error("Could not connect to MongoDB.")
+        except NetworkTimeout:
+            logging.error("Could not connect to MongoDB.")
+        except AutoReconnect:
+            logging.error("Could not connect to MongoDB.")
+
+        try:
+            source_checksum = self._copy_file_with_progress(
+                input_file_path, staged_input_path
+            )
+        except OSError as e:
+            self._record_copy_failure(self._format_copy_failure_message(e))
+            self._delete_temporary_files()
+            return None
+
+        # Released while copying
+        if self._terminated:
+            staged_input_path.unlink(missing_ok=True)
+            return None
+
+        self._file_data.copying = False
+        self._file_data.start_copy_time = None
+        if source_checksum is not None:
+            self._file_data.source_checksum = source_checksum
+        try:
+            media_collection.update_one(
+                {"filename": self._file_data.filename},
+                {
+                    "$set": {
+                        "copying": False,
+                        "start_copy_time": None,
+                        "source_checksum": self._file_data.source_checksum,
+                    }
+                },
+            )
+        except ServerSelectionTimeoutError:
+            logging.error("Could not connect to MongoDB.")
+        except NetworkTimeout:
+            logging.error("Could not connect to MongoDB.")
+        except AutoReconnect:
+            logging.error("Could not connect to MongoDB.")
+
+        logging.info(f"Prefetched {self._file_data.filename}")
+        return self._file_data
+
+    def _run_segment_helper(self) -> bool:
+        """Encode one segment shared by another backend, returning False if there was none."""
+        video_codec = config.config_data.encoding.video_codec
+        try:
+            self._ensure_encoder_available(video_codec)
+        except (OSError, RuntimeError, subprocess.CalledProcessError) as e:
+            logging.error(f"Cannot encode shared segments: {e}")
+            return False
+
+        self._segment_helper = SegmentHelper(
+            os.getenv("BACKEND_NAME", "None"),
+            video_codec,
+            self._resolve_source_path,
+            on_claimed=self._on_claimed,
+        )
+        try:
+            return self._segment_helper.run_next()
+        finally:
+            self._segment_helper = None
+
     def _get_secrets_path(self, filename: str) -> Path:
         return config.config_data.runtime.secrets_dir / filename
 
@@ -194,20 +707,13 @@ class Converter:
         percentage_complete: float,
         *,
         speed: float | None = None,
+        phase: str | None = None,
         force: bool = False,
     ) -> None:
         if self._file_data is None:
             return
 
-        now = self._utc_now()
         bounded_percentage = max(0.0, min(percentage_complete, 100.0))
-
-        if not force and self._last_progress_update_time is not None:
-            if (
-                now - self._last_progress_update_time
-            ).total_seconds() < self._progress_update_interval_seconds:
-                return
-
         self._file_data.percentage_complete = bounded_percentage
 
         update_fields: dict[str, Any] = {
@@ -218,19 +724,25 @@ class Converter:
             self._file_data.speed = speed
             update_fields["speed"] = speed
 
-        try:
-            media_collection.update_one(
-                {"filename": self._file_data.filename},
-                {"$set": update_fields},
-            )
-        except ServerSelectionTimeoutError:
-            pass
-        except NetworkTimeout:
-            pass
-        except AutoReconnect:
-            pass
+        if phase is not None:
+            self._file_data.progress_phase = phase
+            update_fields["progress_phase"] = phase
+
+        # Forced updates mark the start or end of a step, so write them now
+        if force:
+            self._progress_reporter.flush(self._file_data.filename, update_fields)
         else:
-            self._last_progress_update_time = now
+            self._progress_reporter.report(self._file_data.filename, update_fields)
+
+    def _open_progress(self) -> None:
+        # Accept progress again for a file whose earlier job discarded it
+        if self._file_data is not None:
+            self._progress_reporter.open(self._file_data.filename)
+
+    def _discard_pending_progress(self) -> None:
+        # Unwritten progress must not land after the file's state is written directly
+        if self._file_data is not None:
+            self._progress_reporter.discard(self._file_data.filename)
 
     def _get_copy_edge_hashes(self, file_path: Path) -> tuple[int, str, str]:
         file_size = file_path.stat().st_size
@@ -314,14 +826,28 @@ class Converter:
             details.append(f"Backup: {self._backup_path}")
         return ". ".join(details)
 
+    def _verify_copied_checksum(self, destination_path: Path, checksum: str) -> None:
+        # Read the destination back once and compare it with the hash of the source
+        algorithm = checksum.partition(":")[0]
+        destination_checksum = hash_file(
+            destination_path, algorithm, self._copy_chunk_size
+        )
+        if destination_checksum != checksum:
+            raise OSError(
+                f"Copy verification failed for {destination_path}: checksum mismatch"
+            )
+
     def _verify_copied_file_with_retry(
-        self, source_path: Path, destination_path: Path
+        self, source_path: Path, destination_path: Path, checksum: str | None = None
     ) -> None:
         last_error: OSError | None = None
 
         for attempt in range(1, self._copy_max_attempts + 1):
             try:
-                self._verify_copied_file(source_path, destination_path)
+                if checksum is not None:
+                    self._verify_copied_checksum(destination_path, checksum)
+                else:
+                    self._verify_copied_file(source_path, destination_path)
                 return
             except OSError as exc:
                 last_error = exc
@@ -355,11 +881,13 @@ class Converter:
         if self._file_data is None:
             return
 
+        self._discard_pending_progress()
         self._file_data.converting = False
         self._file_data.copying = False
         self._file_data.start_copy_time = None
         self._file_data.conversion_error = True
         self._file_data.conversion_error_message = message
+        self._file_data.prefetched = False
 
         if retain_temporary_files:
             # Conversion already succeeded; retain staged files for overwrite recovery.
@@ -423,6 +951,7 @@ class Converter:
                 "temp_output_path": self._file_data.temp_output_path,
                 "backup_path": self._file_data.backup_path,
             }
+        update_fields["prefetched"] = self._file_data.prefetched
 
         try:
             media_collection.update_one(
@@ -444,7 +973,8 @@ class Converter:
         base_bytes: int = 0,
         total_bytes: int | None = None,
         protect_destination: bool = False,
-    ) -> None:
+    ) -> str | None:
+        """Copy and verify a file, returning its full checksum in full verification mode."""
         destination_path.parent.mkdir(parents=True, exist_ok=True)
         source_size = source_path.stat().st_size
         total_size = total_bytes if total_bytes is not None else source_size
@@ -454,28 +984,51 @@ class Converter:
         else:
             starting_percentage = 0
 
-        self._update_percentage_complete(starting_percentage, force=True)
+        self._update_percentage_complete(
+            starting_percentage, phase="copying", force=True
+        )
+
+        def _on_copy_progress(bytes_copied: int) -> None:
+            if total_size > 0:
+                percentage_complete = ((base_bytes + bytes_copied) / total_size) * 100
+            else:
+                percentage_complete = 100.0
+            self._update_percentage_complete(percentage_complete, phase="copying")
+
+        verification = config.config_data.verification
+        checksum: str | None = None
 
         last_error: OSError | None = None
         for attempt in range(1, self._copy_max_attempts + 1):
             try:
+                # Full verification hashes the source as it is copied
+                hasher = (
+                    FileHasher(verification.algorithm)
+                    if verification.mode == "full"
+                    else None
+                )
+
                 with source_path.open("rb") as source_file, destination_path.open(
                     "wb"
                 ) as destination_file:
-                    # Python 3.14+: length is the read buffer size, not total bytes.
-                    shutil.copyfileobj(
-                        _ProgressReader(
-                            source_file,
-                            base_bytes=base_bytes,
-                            total_size=total_size,
-                            on_progress=self._update_percentage_complete,
-                        ),
+                    # Reflink or copy in the kernel where possible
+                    copy_method = copy_file(
+                        source_file,
                         destination_file,
-                        length=self._copy_chunk_size,
+                        source_size,
+                        self._copy_chunk_size,
+                        _on_copy_progress,
+                        hasher,
                     )
+                logging.debug(
+                    f"Copied {source_path} to {destination_path} with {copy_method}"
+                )
 
                 shutil.copystat(source_path, destination_path)
-                self._verify_copied_file_with_retry(source_path, destination_path)
+                checksum = hasher.checksum if hasher is not None else None
+                self._verify_copied_file_with_retry(
+                    source_path, destination_path, checksum
+                )
                 break
             except OSError as exc:
                 last_error = exc
@@ -505,7 +1058,7 @@ class Converter:
         else:
             final_percentage = 100
 
-        self._update_percentage_complete(final_percentage, force=True)
+        self._update_percentage_complete(final_percentage, phase="copying", force=True)
 
         if protect_destination:
             logging.debug(
@@ -513,15 +1066,7 @@ class Converter:
                 "destination was rewritten in place without unlinking"
             )
 
-    def _signal_handler(self, sig: int, _):
-        # Handle SIGINT and SIGTERM signals to ensure the Docker container stops gracefully
-        match sig:
-            case signal.SIGINT:
-                logging.info("Stopping Conversion due to keyboard interrupt...")
-                self._cleanup_and_terminate()
-            case signal.SIGTERM:
-                logging.info("Stopping Conversion due to SIGTERM...")
-                self._cleanup_and_terminate()
+        return checksum
 
     def _overwrite_recovery_active(self) -> bool:
         return self._file_data is not None and self._file_data.overwrite_in_progress
@@ -561,13 +1106,24 @@ class Converter:
 
             self._temporary_output_path = None
 
+        if self._segmented_encode is not None:
+            self._segmented_encode.cleanup()
+            self._segmented_encode = None
+
     def _clear_runtime_paths(self) -> None:
         self._file_data = None
         self._temporary_input_path = None
         self._temporary_output_path = None
         self._backup_path = None
         self._ffmpeg = None
-        self._last_progress_update_time = None
+        self._segmented_encode = None
+
+    def _reset_job_state(self) -> None:
+        # The same converter runs file after file, so nothing may leak between jobs
+        self._clear_runtime_paths()
+        self._segment_helper = None
+        self._size_predictor = None
+        self._early_abort_size = None
 
     def _clear_overwrite_recovery_state(self) -> None:
         self._set_overwrite_recovery_state(overwrite_in_progress=False)
@@ -576,6 +1132,7 @@ class Converter:
         if self._file_data is None:
             return
 
+        self._discard_pending_progress()
         self._clear_overwrite_recovery_state()
         self._file_data.converted = True
         self._file_data.conversion_error = False
@@ -584,6 +1141,13 @@ class Converter:
         self._file_data.start_copy_time = None
         self._file_data.percentage_complete = 100
 
+        # The content has changed, so refresh the fingerprint used for rename detection
+        try:
+            self._file_data.content_fingerprint = compute_partial_hash(input_file_path)
+        except OSError as e:
+            logging.error(f"Could not fingerprint {input_file_path}: {e}")
+            self._file_data.content_fingerprint = None
+
         media_collection.update_one(
             {"filename": self._file_data.filename},
             {
@@ -597,6 +1161,7 @@ class Converter:
                     "overwrite_in_progress": self._file_data.overwrite_in_progress,
                     "temp_output_path": self._file_data.temp_output_path,
                     "backup_path": self._file_data.backup_path,
+                    "content_fingerprint": self._file_data.content_fingerprint,
                 }
             },
         )
@@ -799,6 +1364,7 @@ class Converter:
 
     def _recover_interrupted_overwrite(self, file_data: FileData) -> None:
         self._file_data = file_data
+        self._open_progress()
         self._temporary_output_path = (
             Path(file_data.temp_output_path)
             if file_data.temp_output_path is not None
@@ -963,11 +1529,21 @@ class Converter:
     ) -> None:
         preserve_overwrite_recovery = self._overwrite_recovery_active()
 
+        # Keep the staged input and finished segments of a stopped segmented
+        # encode so the next claim of the file resumes it
+        preserve_segments = (
+            not conversion_failed
+            and not preserve_overwrite_recovery
+            and self._segmented_encode is not None
+            and config.config_data.segments.resume
+        )
+
         if self._file_data is not None:
             # Log that ffmpeg was terminated and we are cleaning up
             logging.info(
                 f"ffmpeg terminating for {self._file_data.filename}. Cleaning up..."
             )
+            self._discard_pending_progress()
 
             # Update the file_data object
             self._file_data.converting = False
@@ -989,24 +1565,29 @@ class Converter:
                     "Conversion Failed", f"{Path(self._file_data.filename).name}"
                 )
 
+            fields = {
+                "converting": False,
+                "copying": self._file_data.copying,
+                "start_copy_time": self._file_data.start_copy_time,
+                "start_conversion_time": self._file_data.start_conversion_time,
+                "percentage_complete": self._file_data.percentage_complete,
+                "overwrite_in_progress": self._file_data.overwrite_in_progress,
+                "temp_output_path": self._file_data.temp_output_path,
+                "backup_path": self._file_data.backup_path,
+                "conversion_error": self._file_data.conversion_error,
+                "conversion_error_message": self._file_data.conversion_error_message,
+                "prefetched": False,
+            }
+            if not preserve_segments:
+                # Start any later encode of the file from scratch
+                fields["segment_plan"] = None
+                fields["completed_segments"] = []
+
             try:
                 # Update fields converting, start_conversion_time and percentage_complete the in MongoDB
                 media_collection.update_one(
                     {"filename": self._file_data.filename},
-                    {
-                        "$set": {
-                            "converting": False,
-                            "copying": self._file_data.copying,
-                            "start_copy_time": self._file_data.start_copy_time,
-                            "start_conversion_time": self._file_data.start_conversion_time,
-                            "percentage_complete": self._file_data.percentage_complete,
-                            "overwrite_in_progress": self._file_data.overwrite_in_progress,
-                            "temp_output_path": self._file_data.temp_output_path,
-                            "backup_path": self._file_data.backup_path,
-                            "conversion_error": self._file_data.conversion_error,
-                            "conversion_error_message": self._file_data.conversion_error_message,
-                        }
-                    },
+                    {"$set": fields},
                 )
             except ServerSelectionTimeoutError:
                 logging.error("Could not connect to MongoDB.")
@@ -1028,6 +1609,26 @@ class Converter:
             # Set ffmpeg to None
             self._ffmpeg = None
 
+        # Terminate every ffmpeg process of a segmented encode
+        if self._segmented_encode is not None:
+            if preserve_segments:
+                self._segmented_encode.suspend()
+
+                # Only the joined output is deleted below
+                self._segmented_encode = None
+                self._temporary_input_path = None
+            else:
+                self._segmented_encode.terminate()
+
+        # Stop the sample encodes
+        if self._size_predictor is not None:
+            self._size_predictor.terminate()
+
+        # Hand a segment of another backend's file back
+        if self._segment_helper is not None:
+            self._segment_helper.terminate()
+            self._segment_helper = None
+
         if not preserve_overwrite_recovery:
             self._delete_temporary_files()
 
@@ -1042,31 +1643,18 @@ class Converter:
             # Set the backup path to None
             self._backup_path = None
 
-        if not conversion_failed:
-            # Exit the application
-            sys.exit(0)
+    def terminate(self) -> None:
+        """Stop the conversion from another thread and clean up after it."""
+        self._terminated = True
+        self._cleanup_and_terminate()
 
     # Get the highest-priority unprocessed file, preferring ones that still
     # require conversion and then falling back to files that only need to be
     # marked as processed.
-    def _get_highest_bit_rate(self) -> FileData | None:
-        # Claim the next file atomically. Files requiring conversion are chosen
-        # first, then remaining unprocessed files are claimed as a fallback.
+    def _get_highest_bit_rate(self, prefetch: bool = False) -> FileData | None:
+        # Claim the next file requiring conversion atomically, highest bit rate first
         try:
-            db_file = media_collection.find_one_and_update(
-                {
-                    "converting": {"$ne": True},
-                    "converted": {"$ne": True},
-                    "conversion_error": {"$ne": True},
-                    "deleted": {"$ne": True},
-                    "copying": {"$ne": True},
-                },
-                {"$set": {"converting": True}},
-                sort=[
-                    ("conversion_required", DESCENDING),
-                    ("video_information.format.bit_rate", DESCENDING),
-                ],
-            )
+            db_file = claim_next(media_collection, prefetch)
         except ServerSelectionTimeoutError:
             logging.error("Could not connect to MongoDB.")
             db_file = None
@@ -1087,39 +1675,38 @@ class Converter:
         else:
             return None
 
-    def convert(self):
+    def convert(self) -> None:
+        """Convert the next file, leaving the converter ready for another."""
+        self._reset_job_state()
+        try:
+            self._convert()
+        finally:
+            self._reset_job_state()
+
+    def _convert(self) -> None:
         recovery_file = self._claim_pending_recovery()
         if recovery_file is not None:
+            if self._on_claimed is not None:
+                self._on_claimed(recovery_file)
             self._recover_interrupted_overwrite(recovery_file)
             return
 
-        # Get a file that needs to be converted from MongoDB
-        self._file_data = self._get_highest_bit_rate()
+        # Help encode segments of files other backends are converting first
+        if config.config_data.segments.distributed and self._run_segment_helper():
+            return
+
+        # Use the file staged while the previous one encoded, or claim one from MongoDB
+        prefetched_file = (
+            self._prefetcher.take() if self._prefetcher is not None else None
+        )
+        self._file_data = prefetched_file or self._get_highest_bit_rate()
 
         if self._file_data is not None:
-            if not self._file_data.conversion_required:
-                self._file_data.conversion_required = True
+            self._open_progress()
 
-                try:
-                    media_collection.update_one(
-                        {"filename": self._file_data.filename},
-                        {"$set": {"conversion_required": True}},
-                    )
-                except ServerSelectionTimeoutError:
-                    logging.error("Could not connect to MongoDB.")
-                    self._file_data.converting = False
-                    self._file_data = None
-                    return
-                except NetworkTimeout:
-                    logging.error("Could not connect to MongoDB.")
-                    self._file_data.converting = False
-                    self._file_data = None
-                    return
-                except AutoReconnect:
-                    logging.error("Could not connect to MongoDB.")
-                    self._file_data.converting = False
-                    self._file_data = None
-                    return
+            # Let the scheduler size the slot for the claimed file
+            if self._on_claimed is not None:
+                self._on_claimed(self._file_data)
 
             # Map the stored Docker path to the local filesystem path when needed
             input_file_path = self._resolve_source_path(self._file_data.filename)
@@ -1146,6 +1733,7 @@ class Converter:
                         {
                             "$set": {
                                 "converting": self._file_data.converting,
+                                "prefetched": False,
                             }
                         },
                     )
@@ -1162,7 +1750,7 @@ class Converter:
 
             # Log the bitrate of the file we are converting
             logging.info(
-                f"Converting {self._file_data.filename} with bitrate {self._file_data.video_information.format.bit_rate}"
+                f"{'Remuxing' if self._is_remux() else 'Converting'} {self._file_data.filename} with bitrate {self._file_data.video_information.format.bit_rate}"
             )
 
             # Update the file_data object
@@ -1170,12 +1758,13 @@ class Converter:
             self._file_data.start_copy_time = self._utc_now()
             self._file_data.start_conversion_time = None
             self._file_data.backend_name = os.getenv("BACKEND_NAME", "None")
+            self._file_data.backend_slot = self._slot
+            self._file_data.prefetched = False
             self._file_data.speed = 0
             self._file_data.copying = True
             self._file_data.conversion_error = False
             self._file_data.conversion_error_message = None
             self._file_data.percentage_complete = 0
-            self._last_progress_update_time = None
 
             try:
                 # Update the file in MongoDB
@@ -1187,6 +1776,8 @@ class Converter:
                             "start_copy_time": self._file_data.start_copy_time,
                             "start_conversion_time": self._file_data.start_conversion_time,
                             "backend_name": self._file_data.backend_name,
+                            "backend_slot": self._file_data.backend_slot,
+                            "prefetched": self._file_data.prefetched,
                             "speed": 0,
                             "copying": self._file_data.copying,
                             "conversion_error": self._file_data.conversion_error,
@@ -1214,30 +1805,46 @@ class Converter:
                 self._file_data = None
                 return
 
-            # Get filename and extension
-            filename = input_file_path.stem
-            extension = input_file_path.suffix
-
             # Ensure the conversion staging directory exists before copying
             config.config_data.folders.conversions.mkdir(parents=True, exist_ok=True)
 
             # Create temporary input and output paths
-            self._temporary_input_path = Path(
-                config.config_data.folders.conversions, filename + extension
-            )
-            self._temporary_output_path = Path(
-                config.config_data.folders.conversions, filename + ".hevc.mkv"
+            self._temporary_input_path, self._temporary_output_path = (
+                self._get_staging_paths(input_file_path)
             )
+            staged_input_path = self._temporary_input_path
 
-            # Copy the file to the temporary input path
-            try:
-                self._copy_file_with_progress(
-                    input_file_path,
-                    self._temporary_input_path,
-                )
-            except OSError as e:
-                self._record_copy_failure(self._format_copy_failure_message(e))
-                self._delete_temporary_files()
+            if self._can_resume_segments(input_file_path):
+                # The staged input of a stopped segmented encode was kept
+                logging.info(f"Reusing staged input {self._temporary_input_path}")
+            else:
+                # Forget checkpoints that cannot be used without their staged input
+                self._file_data.segment_plan = None
+                self._file_data.completed_segments = []
+
+                if prefetched_file is not None and self._staged_input_matches(
+                    input_file_path
+                ):
+                    logging.info(f"Using prefetched input {self._temporary_input_path}")
+                else:
+                    # Copy the file to the temporary input path
+                    try:
+                        source_checksum = self._copy_file_with_progress(
+                            input_file_path,
+                            self._temporary_input_path,
+                        )
+                    except OSError as e:
+                        self._record_copy_failure(self._format_copy_failure_message(e))
+                        self._delete_temporary_files()
+                        return
+
+                    # Kept for later re-verification and duplicate detection
+                    if source_checksum is not None:
+                        self._file_data.source_checksum = source_checksum
+
+            # Stopped by the scheduler while copying
+            if self._terminated:
+                staged_input_path.unlink(missing_ok=True)
                 return
 
             # Set the start conversion tima and clear the copying flag in the db and the file_data object
@@ -1254,6 +1861,7 @@ class Converter:
                             "start_copy_time": self._file_data.start_copy_time,
                             "start_conversion_time": self._file_data.start_conversion_time,
                             "copying": self._file_data.copying,
+                            "source_checksum": self._file_data.source_checksum,
                         }
                     },
                 )
@@ -1308,59 +1916,106 @@ class Converter:
 
             output_options = self._build_output_options(subtitle_codec)
 
-            try:
-                self._ensure_encoder_available(output_options["c:v"])
-            except (RuntimeError, subprocess.CalledProcessError) as e:
-                logging.error(e)
-                self._cleanup_and_terminate(conversion_failed=True)
-                return
-
-            # Convert the file
-            self._ffmpeg = (
-                FFmpeg.option(FFmpeg(), "y")
-                .input(self._temporary_input_path)
-                .output(
-                    self._temporary_output_path,
-                    output_options,
-                    map=mapping,
-                )
-            )
-
-            # Log the ffmpeg command
-            logging.info(f'ffmpeg command: {" ".join(self._ffmpeg.arguments)}')
+            if not self._is_remux():
+                try:
+                    self._ensure_encoder_available(output_options["c:v"])
+                except (RuntimeError, subprocess.CalledProcessError) as e:
+                    logging.error(e)
+                    self._cleanup_and_terminate(conversion_failed=True)
+                    return
 
-            # Store the last update time
-            self._last_progress_update_time = None
+            # Stage the next file while this one encodes
+            if self._prefetcher is not None:
+                self._prefetcher.start()
 
-            # Update the progress bar when ffmpeg emits a progress event
-            @self._ffmpeg.on("progress")
-            def _on_progress(ffmpeg_progress: FFmpegProgress) -> None:
-                if self._file_data is not None:
-                    # Calculate the percentage complete
-                    duration = timedelta(
-                        seconds=self._file_data.video_information.format.duration
-                    )
-                    percentage_complete = (ffmpeg_progress.time / duration) * 100
+            # Predict the output size from a few samples before the full encode
+            if self._should_sample():
+                try:
+                    prediction = self._predict_output_size(output_options)
+                except (FFmpegError, OSError) as e:
+                    # Sampling is only an optimisation, so encode the file anyway
+                    logging.error(f"Could not sample {self._file_data.filename}")
+                    logging.error(e)
+                    prediction = None
+
+                if prediction is not None and not self._record_prediction(prediction):
+                    self._delete_temporary_files()
+                    self._file_data = None
+                    return
 
-                    self._update_percentage_complete(
-                        percentage_complete,
-                        speed=ffmpeg_progress.speed,
+            # Split long files into segments encoded in parallel when enabled
+            segments = self._plan_segments()
+
+            if segments is None:
+                # Convert the file in a single ffmpeg process
+                self._ffmpeg = (
+                    FFmpeg.option(FFmpeg(), "y")
+                    .input(self._temporary_input_path)
+                    .output(
+                        self._temporary_output_path,
+                        output_options,
+                        map=mapping,
                     )
+                )
 
-                    # Log the progress
-                    logging.debug(ffmpeg_progress)
-
-            @self._ffmpeg.on("terminated")
-            def _on_terminated() -> None:
-                if self._file_data is not None:
-                    # Log that ffmpeg was terminated
-                    logging.info(
-                        f"ffmpeg was terminated successfullty for {self._file_data.filename}"
-                    )
+                # Log the ffmpeg command
+                logging.info(f'ffmpeg command: {" ".join(self._ffmpeg.arguments)}')
+
+                # Stop encodes whose output is on course to be thrown away
+                size_projector = self._get_size_projector(input_file_path)
+                self._early_abort_size = None
+
+                # Update the progress bar when ffmpeg emits a progress event
+                @self._ffmpeg.on("progress")
+                def _on_progress(ffmpeg_progress: FFmpegProgress) -> None:
+                    if self._file_data is not None:
+                        # Calculate the percentage complete
+                        duration = timedelta(
+                            seconds=self._file_data.video_information.format.duration
+                        )
+                        percentage_complete = (ffmpeg_progress.time / duration) * 100
+
+                        self._update_percentage_complete(
+                            percentage_complete,
+                            speed=ffmpeg_progress.speed,
+                            phase="encoding",
+                        )
+
+                        # Log the progress
+                        logging.debug(ffmpeg_progress)
+
+                        if size_projector is not None and self._early_abort_size is None:
+                            self._early_abort_size = size_projector.projected_oversize(
+                                ffmpeg_progress.time.total_seconds(),
+                                ffmpeg_progress.size,
+                            )
+                            if (
+                                self._early_abort_size is not None
+                                and self._ffmpeg is not None
+                            ):
+                                logging.info(
+                                    f"Projected size {self._early_abort_size} of "
+                                    f"{self._file_data.filename} is too large, stopping"
+                                )
+                                self._ffmpeg.terminate()
+
+                @self._ffmpeg.on("terminated")
+                def _on_terminated() -> None:
+                    if self._file_data is not None:
+                        # Log that ffmpeg was terminated
+                        logging.info(
+                            f"ffmpeg was terminated successfullty for {self._file_data.filename}"
+                        )
 
             try:
-                # Execute the ffmpeg command
-                self._ffmpeg.execute()
+                if segments is not None:
+                    if not self._run_segmented_encode(
+                        segments, output_options, subtitle_codec, mapping
+                    ):
+                        return
+                else:
+                    # Execute the ffmpeg command
+                    self._ffmpeg.execute()
             except FFmpegError as e:
                 # There was an error executing the ffmpeg command
                 logging.error(
@@ -1386,19 +2041,38 @@ class Converter:
                 )
                 logging.error(e)
 
+                # Clean up and terminate
+                self._cleanup_and_terminate(conversion_failed=True)
+            except OSError as e:
+                # A segment of a segmented encode could not be written
+                logging.error(
+                    f"OS Error writing segments for {self._file_data.filename}"
+                )
+                logging.error(e)
+
                 # Clean up and terminate
                 self._cleanup_and_terminate(conversion_failed=True)
             else:
+                # Stopped by the scheduler, which already cleaned up
+                if self._terminated:
+                    return
+
+                if self._early_abort_size is not None:
+                    self._abort_oversized_encode()
+                    return
+
                 # ffmpeg executed successfully
                 logging.info(f"Successfully converted {self._file_data.filename}")
 
-                # Check that the file size has been reduced
-                file_size_reduced = (
+                # Check that the file size has been reduced, a remux only changes the
+                # container so its output is kept whatever its size
+                file_size_reduced = self._is_remux() or (
                     self._temporary_output_path.stat().st_size
                     < input_file_path.stat().st_size
                 )
 
                 # Update the file_data object
+                self._discard_pending_progress()
                 self._file_data.converting = False
                 self._file_data.converted = True
                 self._file_data.conversion_error = False
@@ -1430,6 +2104,8 @@ class Converter:
                                 "end_conversion_time": self._file_data.end_conversion_time,
                                 "percentage_complete": self._file_data.percentage_complete,
                                 "current_size": self._file_data.current_size,
+                                "segment_plan": None,
+                                "completed_segments": [],
                             }
                         },
                     )
@@ -1468,6 +2144,9 @@ class Converter:
                     self._delete_temporary_files()
                     return
 
+                # ffmpeg has exited, so the copies below report progress again
+                self._open_progress()
+
                 total_post_copy_bytes = (
                     self._temporary_input_path.stat().st_size
                     + self._temporary_output_path.stat().st_size
@@ -1516,6 +2195,12 @@ class Converter:
                 logging.error("Could not find private_key.pem")
                 return
 
+            # The push and cover art stacks are only loaded once a notification is sent
+            from pywebpush import webpush, WebPushException
+            from requests.status_codes import codes
+
+            from .cover_art import notification_image_fields
+
             source_path = None
             if self._file_data is not None and self._file_data.filename:
                 source_path = self._file_data.filename
@@ -0,0 +1,179 @@
+"""Copy a file with the cheapest mechanism the filesystems allow.
+
+On Linux a copy is first attempted as a ``FICLONE`` reflink, which shares
+extents on btrfs and XFS and finishes almost at once, then in the kernel with
+``copy_file_range`` and ``sendfile``. Anything else falls back to reading and
+writing through a reused buffer. A mechanism that is not supported is only
+abandoned before it has copied anything, so each copy is done by one of them.
+
+For full-file verification the copy is hashed as it passes through the
+userspace loop, using BLAKE2b or, when the optional ``xxhash`` package is
+installed, xxh3. Checksums are stored as ``"<algorithm>:<hex digest>"``.
+"""
+
+from __future__ import annotations
+
+import errno
+import hashlib
+import logging
+import os
+from pathlib import Path
+import sys
+from typing import Any, BinaryIO, Callable, Literal
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+ChecksumAlgorithm = Literal["blake2b", "xxh3"]
+
+# _IOW(0x94, 9, int) from linux/fs.h
+FICLONE = 0x40049409
+
+# Errors meaning the mechanism does not apply to these files, rather than a failed copy
+_UNSUPPORTED_ERRNOS = {
+    errno.EBADF,
+    errno.EINVAL,
+    errno.ENOSYS,
+    errno.ENOTSUP,
+    errno.EOPNOTSUPP,
+    errno.ENOTTY,
+    errno.EXDEV,
+    errno.EPERM,
+}
+
+
+class FileHasher:
+    def __init__(self, algorithm: ChecksumAlgorithm) -> None:
+        if algorithm == "xxh3" and xxhash is None:
+            logging.warning("xxhash is not installed, using blake2b checksums")
+            algorithm = "blake2b"
+
+        self.algorithm = algorithm
+        self._hash: Any = (
+            xxhash.xxh3_128() if algorithm == "xxh3" else hashlib.blake2b(digest_size=32)
+        )
+
+    def update(self, data: bytes | memoryview) -> None:
+        self._hash.update(data)
+
+    @property
+    def checksum(self) -> str:
+        return f"{self.algorithm}:{self._hash.hexdigest()}"
+
+
+def hash_file(path: Path, algorithm: ChecksumAlgorithm, chunk_size: int) -> str:
+    hasher = FileHasher(algorithm)
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+
+    with path.open("rb") as file_handle:
+        # A file that was just written is normally read back from the page cache
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(file_handle.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        while count := file_handle.readinto(buffer):
+            hasher.update(view[:count])
+
+    return hasher.checksum
+
+
+def _is_unsupported(exc: OSError) -> bool:
+    return exc.errno in _UNSUPPORTED_ERRNOS
+
+
+def _reflink(source_fd: int, destination_fd: int) -> bool:
+    if fcntl is None or not sys.platform.startswith("linux"):
+        return False
+
+    try:
+        fcntl.ioctl(destination_fd, FICLONE, source_fd)
+    except OSError as exc:
+        if _is_unsupported(exc):
+            return False
+        raise
+    return True
+
+
+def _copy_in_kernel(
+    copy_chunk: Callable[[int, int], int],
+    size: int,
+    chunk_size: int,
+    on_progress: Callable[[int], None],
+) -> bool:
+    copied = 0
+    while copied < size:
+        try:
+            count = copy_chunk(copied, min(chunk_size, size - copied))
+        except OSError as exc:
+            if copied == 0 and _is_unsupported(exc):
+                return False
+            raise
+
+        # The source was truncated while copying
+        if count == 0:
+            break
+
+        copied += count
+        on_progress(copied)
+    return True
+
+
+def copy_file(
+    source_file: BinaryIO,
+    destination_file: BinaryIO,
+    size: int,
+    chunk_size: int,
+    on_progress: Callable[[int], None],
+    hasher: FileHasher | None = None,
+) -> str:
+    """Copy ``size`` bytes between open files, returning the mechanism used.
+
+    ``on_progress`` is called with the bytes copied so far after each chunk.
+    With a ``hasher`` the bytes go through userspace so they can be hashed.
+    """
+    source_fd = source_file.fileno()
+    destination_fd = destination_file.fileno()
+
+    if hasher is None and size > 0 and _reflink(source_fd, destination_fd):
+        on_progress(size)
+        return "reflink"
+
+    if hasher is None and size > 0 and sys.platform.startswith("linux"):
+        if hasattr(os, "copy_file_range") and _copy_in_kernel(
+            lambda offset, count: os.copy_file_range(
+                source_fd, destination_fd, count, offset, offset
+            ),
+            size,
+            chunk_size,
+            on_progress,
+        ):
+            return "copy_file_range"
+
+        if _copy_in_kernel(
+            lambda offset, count: os.sendfile(destination_fd, source_fd, offset, count),
+            size,
+            chunk_size,
+            on_progress,
+        ):
+            return "sendfile"
+
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    copied = 0
+    while True:
+        count = source_file.readinto(buffer)
+        if not count:
+            break
+        destination_file.write(view[:count])
+        if hasher is not None:
+            hasher.update(view[:count])
+        copied += count
+        on_progress(copied)
+
+    return "userspace"
@@ -1,13 +1,35 @@
 from pathlib import Path
 import logging
+import os
+import time
 
 from . import config
-from .models import FileInfo
-from .unicode_paths import clear_directory_cache, path_identity_key
+from .models import FileInfo, WalkDiff
+from .unicode_paths import PathIdentityIndex, clear_directory_cache
+from .walk_snapshot import DirectoryRecord, WalkSnapshot
+
+# File extensions picked up by the walk
+VIDEO_SUFFIXES = frozenset(
+    [
+        ".mkv",
+        ".mp4",
+        ".avi",
+        ".mov",
+        ".wmv",
+        ".flv",
+        ".webm",
+        ".m4v",
+        "mpg",
+    ]
+)
+
+# Directories modified this close to the walk may change again within the
+# same mtime tick, so they are re-listed on the next walk.
+_RACY_MTIME_WINDOW_NS = 2_000_000_000
 
 
 class FolderWalker:
-    def __init__(self) -> None:
+    def __init__(self, snapshot: WalkSnapshot | None = None) -> None:
         # List of paths to walk
         self._paths: list[Path] = []
 
@@ -23,26 +45,217 @@ class FolderWalker:
         # List of files found
         self._files: list[FileInfo] = []
 
-    def walk_folders(self) -> None:
+        # Snapshot of the previous walk, only used by the scandir engine
+        self._snapshot = (
+            snapshot if config.config_data.walker.engine == "scandir" else None
+        )
+
+        # Directory listings from the previous walk that may be reused
+        self._previous_directories: dict[str, DirectoryRecord] = {}
+
+        # Directory listings from this walk, committed to the snapshot later
+        self._directories: dict[str, DirectoryRecord] = {}
+
+        # Directories to re-list on a refresh, None to check every directory's mtime
+        self._dirty_directories: set[str] | None = None
+
+        # Added and removed paths since the previous walk, None if unknown
+        self.diff: WalkDiff | None = None
+
+        # Directories that could not be read and had no earlier listing to fall
+        # back on, whose files must not be taken as deleted
+        self.unreadable_directories: set[str] = set()
+
+        # Identity keys of the walked paths, shared with the CodecDetector
+        self.identity_index = PathIdentityIndex()
+
+    @staticmethod
+    def load_snapshot() -> WalkSnapshot:
+        folders = config.config_data.folders
+        signature = [
+            *(f"include:{path.as_posix()}" for path in folders.include),
+            *(f"exclude:{path.as_posix()}" for path in folders.exclude),
+            *(f"suffix:{suffix}" for suffix in sorted(VIDEO_SUFFIXES)),
+        ]
+        return WalkSnapshot(
+            config.config_data.runtime.state_directory / "walk_snapshot.json",
+            signature,
+        )
+
+    def walk_folders(self, full: bool = False) -> None:
         clear_directory_cache()
+
+        if self._snapshot is not None and not full:
+            # Trust the directory mtimes recorded by the previous walk
+            self._previous_directories = self._snapshot.directories
+
+        engine = config.config_data.walker.engine
         for path in self._paths:
-            self._walk(path)
+            if engine == "scandir":
+                self._walk_scandir(path)
+            else:
+                self._walk(path)
 
-        seen_identity_keys: set[str] = set()
         files_dict: dict[str, FileInfo] = {}
         for file_info in self._files:
-            identity_key = path_identity_key(file_info.filename)
-            if identity_key in seen_identity_keys:
+            if not self.identity_index.add(file_info.filename):
                 logging.warning(
                     "Skipping duplicate path during walk: %s",
                     file_info.filename,
                 )
                 continue
-            seen_identity_keys.add(identity_key)
             files_dict[file_info.filename] = file_info
 
         self.files_dict = files_dict
 
+        if self._snapshot is not None and self._snapshot.directories:
+            previous_stats = self._snapshot.file_stats()
+            walked_paths = {file_info.filename for file_info in self._files}
+            self.diff = WalkDiff(
+                added={path for path in files_dict if path not in previous_stats},
+                removed=previous_stats.keys() - walked_paths,
+                changed={
+                    path
+                    for path, file_info in files_dict.items()
+                    if path in previous_stats
+                    and previous_stats[path] != (file_info.size, file_info.mtime_ns)
+                },
+            )
+            logging.info(
+                f"Walk found {len(self.diff.added)} added, "
+                f"{len(self.diff.changed)} changed and "
+                f"{len(self.diff.removed)} removed file(s)"
+            )
+
+    def refresh_directories(self, directories: set[str]) -> None:
+        # Re-list only the given directories, reusing the snapshot for the rest
+        # of the tree without touching the disk
+        self._dirty_directories = directories
+        self.walk_folders()
+
+    @property
+    def directories(self) -> list[str]:
+        return list(self._directories)
+
+    def commit_snapshot(self) -> None:
+        # Persist this walk's listings once its results have been stored
+        if self._snapshot is not None:
+            self._snapshot.commit(self._directories)
+
+    def _walk_scandir(self, root: Path) -> None:
+        # Iterative walk that reuses the type and stat information cached on
+        # each DirEntry instead of issuing is_dir()/is_file() stats per entry.
+        stack = [os.fspath(root)]
+
+        while stack:
+            directory = stack.pop()
+
+            record = self._get_directory_record(directory)
+            if record is None:
+                continue
+
+            self._directories[directory] = record
+
+            for name, (size, mtime_ns) in record.files.items():
+                self._files.append(
+                    FileInfo(
+                        filename=os.path.join(directory, name),
+                        size=size,
+                        mtime_ns=mtime_ns,
+                    )
+                )
+
+            stack.extend(os.path.join(directory, name) for name in record.dirs)
+
+    def _get_directory_record(self, directory: str) -> DirectoryRecord | None:
+        previous = self._previous_directories.get(directory)
+        if self._dirty_directories is not None:
+            if previous is not None and directory not in self._dirty_directories:
+                return previous
+
+            # Rewritten files do not change the directory mtime, so always re-list
+            previous = None
+
+        try:
+            mtime_ns = os.stat(directory).st_mtime_ns
+        except OSError as e:
+            logging.error(f"Could not stat {directory}: {e}")
+            return self._get_unreadable_record(directory)
+
+        # Reuse the previous listing if the directory has not changed
+        if previous is not None and previous.mtime_ns == mtime_ns:
+            return previous
+
+        if time.time_ns() - mtime_ns < _RACY_MTIME_WINDOW_NS:
+            mtime_ns = -1
+
+        return self._scan_directory(directory, mtime_ns)
+
+    def _get_previous_record(self, directory: str) -> DirectoryRecord | None:
+        # The snapshot is consulted even on full walks, which do not reuse listings
+        if self._snapshot is None:
+            return None
+        return self._snapshot.directories.get(directory)
+
+    def _get_unreadable_record(self, directory: str) -> DirectoryRecord | None:
+        # Dropping the directory would make its files look deleted, so keep the
+        # previous listing and list it again on the next walk
+        previous = self._get_previous_record(directory)
+        if previous is None:
+            self.unreadable_directories.add(directory)
+            return None
+
+        logging.warning(f"Reusing the previous listing of {directory}")
+        return DirectoryRecord(
+            mtime_ns=-1, dirs=list(previous.dirs), files=dict(previous.files)
+        )
+
+    def _scan_directory(self, directory: str, mtime_ns: int) -> DirectoryRecord | None:
+        excluded = {
+            os.fspath(path) for path in config.config_data.folders.exclude
+        }
+        dirs: list[str] = []
+        files: dict[str, tuple[int, int]] = {}
+        previous = self._get_previous_record(directory)
+
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir():
+                            if entry.path in excluded:
+                                logging.debug(f"Skipping {entry.name}")
+                            else:
+                                logging.debug(f"Entering {entry.name}")
+                                dirs.append(entry.name)
+                        elif (
+                            os.path.splitext(entry.name)[1] in VIDEO_SUFFIXES
+                            and entry.is_file()
+                        ):
+                            entry_stat = entry.stat()
+                            files[entry.name] = (
+                                entry_stat.st_size,
+                                entry_stat.st_mtime_ns,
+                            )
+                    except OSError as e:
+                        logging.error(f"Could not read {entry.path}: {e}")
+
+                        # Keep what the previous walk knew about the entry
+                        if previous is not None and entry.name in previous.dirs:
+                            dirs.append(entry.name)
+                        elif previous is not None and entry.name in previous.files:
+                            files[entry.name] = previous.files[entry.name]
+                        else:
+                            self.unreadable_directories.add(directory)
+
+                        # List the directory again next walk
+                        mtime_ns = -1
+        except OSError as e:
+            logging.error(f"Could not list {directory}: {e}")
+            return self._get_unreadable_record(directory)
+
+        return DirectoryRecord(mtime_ns=mtime_ns, dirs=dirs, files=files)
+
     def _walk(self, path: Path) -> None:
         for file in path.iterdir():
             # Check if the file is a directory
@@ -58,17 +271,7 @@ class FolderWalker:
                     # If it's not, log a message and walk it
                     logging.debug(f"Entering {file.name}")
                     self._walk(file)
-            elif file.is_file() and file.suffix in [
-                ".mkv",
-                ".mp4",
-                ".avi",
-                ".mov",
-                ".wmv",
-                ".flv",
-                ".webm",
-                ".m4v",
-                "mpg",
-            ]:
+            elif file.is_file() and file.suffix in VIDEO_SUFFIXES:
                 # Create a FileInfo object
                 file_info = FileInfo(filename=file.as_posix())
 
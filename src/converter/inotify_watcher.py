@@ -0,0 +1,204 @@
+"""Linux inotify change feed for the folder walker.
+
+Watches every directory the walker has listed and collects the directories
+whose entries were created, deleted, moved or finished being written. The
+scheduler drains them once the feed has been quiet for the debounce period and
+re-lists only those directories, instead of polling the whole library every
+minute. A file still being copied in when it is first probed is probed again
+once the writer closes it, as its size has changed since.
+
+Uses ``inotify`` through ``ctypes`` so the walker image needs no extra
+packages. Construction raises ``OSError`` where inotify is unavailable, and
+``alive`` turns False if reading events fails later, after which no more
+changes are reported.
+"""
+
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import struct
+import sys
+import threading
+import time
+from typing import Iterable
+
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_MOVE_SELF = 0x00000800
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ONLYDIR = 0x01000000
+
+_WATCH_MASK = (
+    _IN_CLOSE_WRITE
+    | _IN_CREATE
+    | _IN_DELETE
+    | _IN_MOVED_FROM
+    | _IN_MOVED_TO
+    | _IN_DELETE_SELF
+    | _IN_MOVE_SELF
+    | _IN_ONLYDIR
+)
+
+# struct inotify_event { int wd; uint32_t mask, cookie, len; char name[]; }
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+class InotifyWatcher:
+    _read_size = 64 * 1024
+
+    def __init__(self) -> None:
+        if not sys.platform.startswith("linux"):
+            raise OSError(errno.ENOSYS, "inotify is only available on Linux")
+
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._fd = self._libc.inotify_init1(os.O_CLOEXEC)
+        if self._fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, f"inotify_init1 failed: {os.strerror(error)}")
+
+        # Watch descriptor to directory, and directory to watch descriptor
+        self._directories: dict[int, str] = {}
+        self._watches: dict[str, int] = {}
+
+        # Directories with changes that have not been drained yet
+        self._lock = threading.Lock()
+        self._dirty_directories: set[str] = set()
+        self._overflowed = False
+        self._last_event_time = 0.0
+
+        self._reader = threading.Thread(
+            target=self._read_events,
+            name="inotify-reader",
+            daemon=True,
+        )
+        self._reader.start()
+
+    @property
+    def alive(self) -> bool:
+        return self._reader.is_alive()
+
+    def sync(self, directories: Iterable[str]) -> None:
+        """Watch exactly ``directories``, adding and removing watches as needed.
+
+        Directories that are newly watched are queued for one more listing, so
+        entries created or written between their listing and the watch are not
+        missed.
+        """
+        wanted = set(directories)
+
+        with self._lock:
+            stale = [directory for directory in self._watches if directory not in wanted]
+            new = [directory for directory in wanted if directory not in self._watches]
+
+        for directory in stale:
+            self._remove_watch(directory)
+
+        added: list[str] = []
+        for directory in new:
+            wd = self._libc.inotify_add_watch(
+                self._fd, os.fsencode(directory), _WATCH_MASK
+            )
+            if wd < 0:
+                error = ctypes.get_errno()
+                if error == errno.ENOSPC:
+                    raise OSError(
+                        error,
+                        "inotify watch limit reached, raise fs.inotify.max_user_watches",
+                    )
+                logging.debug(f"Could not watch {directory}: {os.strerror(error)}")
+                continue
+
+            with self._lock:
+                self._directories[wd] = directory
+                self._watches[directory] = wd
+            added.append(directory)
+
+        if added:
+            logging.debug(f"Watching {len(added)} new director(ies)")
+            with self._lock:
+                self._dirty_directories.update(added)
+                self._last_event_time = time.monotonic()
+
+    def requeue(self, directories: Iterable[str]) -> None:
+        # Put back directories whose changes could not be stored
+        with self._lock:
+            self._dirty_directories.update(directories)
+            self._last_event_time = time.monotonic()
+
+    def take_changes(self, debounce_seconds: float) -> tuple[set[str], bool] | None:
+        """Return the changed directories and the overflow flag once quiet.
+
+        Returns None while there are no changes or events are still arriving.
+        """
+        with self._lock:
+            if not self._dirty_directories and not self._overflowed:
+                return None
+            if time.monotonic() - self._last_event_time < debounce_seconds:
+                return None
+
+            changes = (self._dirty_directories, self._overflowed)
+            self._dirty_directories = set()
+            self._overflowed = False
+            return changes
+
+    def close(self) -> None:
+        try:
+            os.close(self._fd)
+        except OSError:
+            pass
+
+    def _remove_watch(self, directory: str) -> None:
+        with self._lock:
+            wd = self._watches.pop(directory, None)
+            if wd is not None:
+                self._directories.pop(wd, None)
+        if wd is not None:
+            self._libc.inotify_rm_watch(self._fd, wd)
+
+    def _read_events(self) -> None:
+        while True:
+            try:
+                buffer = os.read(self._fd, self._read_size)
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                logging.error(f"inotify reader stopped: {e}")
+                return
+
+            offset = 0
+            with self._lock:
+                while offset + _EVENT_HEADER.size <= len(buffer):
+                    wd, mask, _, name_length = _EVENT_HEADER.unpack_from(buffer, offset)
+                    offset += _EVENT_HEADER.size + name_length
+
+                    if mask & _IN_Q_OVERFLOW:
+                        self._overflowed = True
+                        continue
+
+                    directory = self._directories.get(wd)
+                    if directory is None:
+                        continue
+
+                    if mask & _IN_IGNORED:
+                        # The watch was removed by the kernel
+                        self._directories.pop(wd, None)
+                        if self._watches.get(directory) == wd:
+                            del self._watches[directory]
+                        continue
+
+                    if mask & (_IN_DELETE_SELF | _IN_MOVE_SELF):
+                        # Removals are picked up when the parent is re-listed
+                        self._dirty_directories.add(os.path.dirname(directory))
+                    else:
+                        self._dirty_directories.add(directory)
+
+                self._last_event_time = time.monotonic()
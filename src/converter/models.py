@@ -1,8 +1,13 @@
 from datetime import datetime
+from typing import Literal
 
 from pydantic import BaseModel
 
 
+# "encode" re-encodes the video, "remux" stream-copies it into Matroska
+ConversionMode = Literal["encode", "remux"]
+
+
 class Disposition(BaseModel):
     default: int | None = None
     dub: int | None = None
@@ -116,11 +121,42 @@ class VideoInformation(BaseModel):
     format: Format
 
 
+class Segment(BaseModel):
+    index: int
+    start: float
+    # None for the last segment, which runs to the end of the file
+    end: float | None = None
+
+
+class SegmentJob(BaseModel):
+    # Media file the segment belongs to, and its source in the library
+    filename: str
+    input_path: str
+    index: int
+    start: float
+    end: float | None = None
+    # Encoded segment on storage shared by every backend, in library path form
+    output_path: str
+    video_stream: int
+    video_codec: str
+    video_options: dict[str, str | None]
+    state: Literal["pending", "claimed", "done", "failed"] = "pending"
+    created_time: datetime
+    claim_token: str | None = None
+    claimed_by: str | None = None
+    heartbeat_time: datetime | None = None
+    position: float = 0
+    speed: float | None = None
+    error_message: str | None = None
+
+
 class FileData(BaseModel):
     filename: str
     deleted: bool
     video_information: VideoInformation
     conversion_required: bool
+    conversion_skip_reason: str | None = None
+    conversion_mode: ConversionMode = "encode"
     converting: bool
     converted: bool
     conversion_error: bool
@@ -142,7 +178,22 @@ class FileData(BaseModel):
     pre_conversion_size: int
     current_size: int
     backend_name: str = "None"
+    backend_slot: int | None = None
+    # Claimed and staged by a backend for its next conversion
+    prefetched: bool = False
+    # Full-file checksum of the source taken while staging, as "<algorithm>:<hex digest>"
+    source_checksum: str | None = None
     speed: float | None = None
+    # What the percentage complete measures: "copying" or "encoding"
+    progress_phase: str | None = None
+    content_fingerprint: str | None = None
+    # Segment plan and finished segments of a stopped encode, kept to resume it
+    segment_plan: list[Segment] | None = None
+    completed_segments: list[int] = []
+    # Size predicted from sample encodes, and whether it ruled the file out
+    predicted_size: int | None = None
+    predicted_saving: float | None = None
+    incompressible: bool = False
 
 
 class ConvertedFileDataFromDb(BaseModel):
@@ -154,5 +205,26 @@ class ConvertedFileDataFromDb(BaseModel):
 
 
 class FileInfo:
-    def __init__(self, filename: str) -> None:
-        self.filename = filename
\ No newline at end of file
+    def __init__(
+        self,
+        filename: str,
+        size: int | None = None,
+        mtime_ns: int | None = None,
+        content_fingerprint: str | None = None,
+    ) -> None:
+        self.filename = filename
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.content_fingerprint = content_fingerprint
+
+class WalkDiff:
+    def __init__(
+        self,
+        added: set[str],
+        removed: set[str],
+        changed: set[str] | None = None,
+    ) -> None:
+        self.added = added
+        self.removed = removed
+        # Paths still on disk whose size or mtime differs from the previous walk
+        self.changed = changed if changed is not None else set()
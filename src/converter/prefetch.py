@@ -0,0 +1,91 @@
+"""Stage the next file while the current one encodes.
+
+Once a conversion starts encoding, the prefetcher claims the next file with
+``prefetched`` set, so other backends skip it, and copies and verifies it in
+a background thread with a converter of its own. The next ``convert()``
+takes it instead of claiming a file and finds the staged input in place.
+Outside the conversion window, or when the backend stops, the claim is
+released and the staged input deleted.
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+
+from .converter import Converter
+from .models import FileData
+
+
+class StagingPrefetcher:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+        # Converter holding the claim of the staged file
+        self._converter: Converter | None = None
+        self._file_data: FileData | None = None
+
+    def start(self) -> None:
+        """Start staging the next file unless one is staged or being staged."""
+        with self._lock:
+            if self._thread is not None or self._file_data is not None:
+                return
+
+            self._converter = Converter()
+            # Daemon thread so stopping the backend does not wait for the copy
+            self._thread = threading.Thread(
+                target=self._stage, args=(self._converter,), name="prefetch", daemon=True
+            )
+            self._thread.start()
+
+    def _stage(self, converter: Converter) -> None:
+        try:
+            file_data = converter.stage_next()
+        except Exception:
+            logging.exception("Could not prefetch the next file")
+            file_data = None
+
+        with self._lock:
+            self._thread = None
+            if converter is not self._converter:
+                # Released while staging
+                return
+            self._file_data = file_data
+            if file_data is None:
+                self._converter = None
+
+    def _join(self) -> None:
+        with self._lock:
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+
+    def take(self) -> FileData | None:
+        """Wait for the file being staged and hand it over, if there is one."""
+        self._join()
+
+        with self._lock:
+            file_data = self._file_data
+            self._file_data = None
+            self._converter = None
+
+        if file_data is not None:
+            logging.info(f"Taking prefetched file {file_data.filename}")
+        return file_data
+
+    def release(self, wait: bool = True) -> None:
+        """Give the staged file back and delete its staged input.
+
+        Without ``wait`` a copy in progress is abandoned, for use when exiting.
+        """
+        if wait:
+            self._join()
+
+        with self._lock:
+            converter = self._converter
+            self._converter = None
+            self._file_data = None
+
+        if converter is not None:
+            logging.info("Releasing prefetched file")
+            converter.terminate()
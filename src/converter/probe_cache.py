@@ -0,0 +1,259 @@
+"""Local cache of raw ffprobe output for the codec detector.
+
+Entries are keyed on file size, mtime and the partial content hash, so a file
+that is renamed, restored from backup or re-imported with the same content and
+timestamps is not probed again. The cache lives in SQLite under the runtime
+state directory and evicts the least recently used entries beyond
+``probe.cache_max_entries``.
+
+Files that fail to probe are recorded in the same database, keyed on path,
+size and mtime, and are not probed again until an exponentially growing
+retry delay has passed. After ``probe.failure_max_attempts`` failures a file
+is given up on until it changes; ``src/probe_failures.py`` lists those.
+"""
+
+from __future__ import annotations
+
+import logging
+from pathlib import Path
+import sqlite3
+import threading
+import time
+from typing import Container, Iterable
+
+from . import config
+
+_cache: ProbeCache | None = None
+_init_lock = threading.Lock()
+
+
+class ProbeFailure:
+    def __init__(
+        self,
+        size: int,
+        mtime_ns: int,
+        attempts: int,
+        retry_after: float,
+        permanent: bool,
+    ) -> None:
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.attempts = attempts
+        self.retry_after = retry_after
+        self.permanent = permanent
+
+    def pending(self, size: int | None, mtime_ns: int | None, now: float) -> bool:
+        # A file that changed since it failed is probed again straight away
+        if size != self.size or mtime_ns != self.mtime_ns:
+            return False
+        return self.permanent or now < self.retry_after
+
+
+class ProbeCache:
+    def __init__(
+        self,
+        path: Path,
+        max_entries: int,
+        failure_retry_seconds: float = 60,
+        failure_retry_max_seconds: float = 86400,
+        failure_max_attempts: int = 10,
+    ) -> None:
+        self._max_entries = max_entries
+        self._failure_retry_seconds = failure_retry_seconds
+        self._failure_retry_max_seconds = failure_retry_max_seconds
+        self._failure_max_attempts = failure_max_attempts
+        self._lock = threading.Lock()
+
+        # Counters since the walker started
+        self.hits = 0
+        self.misses = 0
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS probe_cache (
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                partial_hash TEXT NOT NULL,
+                probe_json TEXT NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (size, mtime_ns, partial_hash)
+            )
+            """
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS probe_cache_last_used ON probe_cache (last_used)"
+        )
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS probe_failures (
+                filename TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                attempts INTEGER NOT NULL,
+                retry_after REAL NOT NULL,
+                permanent INTEGER NOT NULL,
+                last_error TEXT NOT NULL,
+                last_failure REAL NOT NULL
+            )
+            """
+        )
+        self._connection.commit()
+
+        (self._entries,) = self._connection.execute(
+            "SELECT COUNT(*) FROM probe_cache"
+        ).fetchone()
+
+    def get(self, size: int, mtime_ns: int, partial_hash: str) -> str | None:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT probe_json FROM probe_cache "
+                "WHERE size = ? AND mtime_ns = ? AND partial_hash = ?",
+                (size, mtime_ns, partial_hash),
+            ).fetchone()
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            self._connection.execute(
+                "UPDATE probe_cache SET last_used = ? "
+                "WHERE size = ? AND mtime_ns = ? AND partial_hash = ?",
+                (time.time(), size, mtime_ns, partial_hash),
+            )
+            self._connection.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, size: int, mtime_ns: int, partial_hash: str, probe_json: str) -> None:
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO probe_cache "
+                "(size, mtime_ns, partial_hash, probe_json, last_used) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (size, mtime_ns, partial_hash, probe_json, time.time()),
+            )
+
+            # Replaced rows are counted too, so recount before evicting
+            self._entries += 1
+            if self._entries > self._max_entries:
+                (self._entries,) = self._connection.execute(
+                    "SELECT COUNT(*) FROM probe_cache"
+                ).fetchone()
+
+            if self._entries > self._max_entries:
+                # Evict the least recently used entries
+                self._connection.execute(
+                    "DELETE FROM probe_cache WHERE rowid IN ("
+                    "SELECT rowid FROM probe_cache ORDER BY last_used LIMIT ?)",
+                    (self._entries - self._max_entries,),
+                )
+                self._entries = self._max_entries
+
+            self._connection.commit()
+
+    def get_failures(self) -> dict[str, ProbeFailure]:
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT filename, size, mtime_ns, attempts, retry_after, permanent "
+                "FROM probe_failures"
+            ).fetchall()
+
+        return {
+            filename: ProbeFailure(size, mtime_ns, attempts, retry_after, bool(permanent))
+            for filename, size, mtime_ns, attempts, retry_after, permanent in rows
+        }
+
+    def record_failure(self, filename: str, size: int, mtime_ns: int, error: str) -> None:
+        now = time.time()
+
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT size, mtime_ns, attempts FROM probe_failures WHERE filename = ?",
+                (filename,),
+            ).fetchone()
+
+            # Count attempts again from one if the file changed since it last failed
+            attempts = 1
+            if row is not None and row[0] == size and row[1] == mtime_ns:
+                attempts = row[2] + 1
+
+            delay = min(
+                self._failure_retry_seconds * 2 ** (attempts - 1),
+                self._failure_retry_max_seconds,
+            )
+            permanent = attempts >= self._failure_max_attempts
+
+            self._connection.execute(
+                "INSERT OR REPLACE INTO probe_failures "
+                "(filename, size, mtime_ns, attempts, retry_after, permanent, "
+                "last_error, last_failure) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (filename, size, mtime_ns, attempts, now + delay, permanent, error, now),
+            )
+            self._connection.commit()
+
+        if permanent:
+            logging.warning(
+                f"Giving up on probing {filename} after {attempts} attempts "
+                "until it changes"
+            )
+        else:
+            logging.info(f"Will retry probing {filename} in {delay:.0f} seconds")
+
+    def clear_failures(self, filenames: Iterable[str]) -> None:
+        with self._lock:
+            self._connection.executemany(
+                "DELETE FROM probe_failures WHERE filename = ?",
+                ((filename,) for filename in filenames),
+            )
+            self._connection.commit()
+
+    def prune_failures(self, existing_filenames: Container[str]) -> None:
+        # Forget failures of files that are no longer on disk
+        with self._lock:
+            filenames = [
+                filename
+                for (filename,) in self._connection.execute(
+                    "SELECT filename FROM probe_failures"
+                )
+            ]
+        self.clear_failures(
+            filename for filename in filenames if filename not in existing_filenames
+        )
+
+    def log_stats(self) -> None:
+        lookups = self.hits + self.misses
+        hit_rate = (self.hits / lookups) * 100 if lookups else 0.0
+        logging.info(
+            f"Probe cache: {self.hits} hit(s), {self.misses} miss(es) "
+            f"({hit_rate:.0f}% hit rate), {self._entries} entries"
+        )
+
+
+def get_probe_cache() -> ProbeCache | None:
+    """Open the shared probe cache once, or return None if it is disabled."""
+    global _cache
+
+    probe_config = config.config_data.probe
+    if not probe_config.cache_enabled:
+        return None
+
+    with _init_lock:
+        if _cache is None:
+            cache_path = config.config_data.runtime.state_directory / "probe_cache.sqlite3"
+            try:
+                _cache = ProbeCache(
+                    cache_path,
+                    probe_config.cache_max_entries,
+                    failure_retry_seconds=probe_config.failure_retry_seconds,
+                    failure_retry_max_seconds=probe_config.failure_retry_max_seconds,
+                    failure_max_attempts=probe_config.failure_max_attempts,
+                )
+            except (OSError, sqlite3.Error) as e:
+                logging.error(f"Could not open probe cache {cache_path}: {e}")
+                return None
+            logging.info(f"Opened probe cache {cache_path}")
+
+    return _cache
@@ -0,0 +1,188 @@
+"""Bounded pool of ffprobe workers for the codec detector.
+
+Each probe first checks the probe cache, then runs in its own ``ffprobe``
+process with a timeout, so a hung probe is killed instead of stalling the
+walk. Results are yielded as soon as each probe completes rather than in
+submission order.
+"""
+
+from __future__ import annotations
+
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+import logging
+from pathlib import Path
+import sqlite3
+import subprocess
+from typing import Iterable, Iterator
+
+from .content_fingerprint import compute_partial_hash
+from .models import FileInfo
+from .probe_cache import ProbeCache
+from .unicode_paths import resolve_filesystem_path
+
+# The base command to run ffprobe
+FFPROBE_BASE_COMMAND = [
+    "ffprobe",
+    "-v",
+    "quiet",
+    "-print_format",
+    "json",
+    "-show_format",
+    "-show_streams",
+]
+
+
+class ProbeResult:
+    def __init__(
+        self,
+        file_info: FileInfo,
+        file_size: int | None,
+        returncode: int | None,
+        stdout: str,
+        stderr: str,
+        partial_hash: str | None = None,
+        mtime_ns: int | None = None,
+    ) -> None:
+        self.file_info = file_info
+        self.file_size = file_size
+        self.mtime_ns = mtime_ns
+
+        # Partial content hash, stored as the content fingerprint
+        self.partial_hash = partial_hash
+
+        # None when ffprobe could not be run or was killed after the timeout
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+
+    @property
+    def successful(self) -> bool:
+        return self.returncode == 0
+
+
+def run_ffprobe(
+    file_info: FileInfo,
+    timeout_seconds: float | None,
+    cache: ProbeCache | None = None,
+) -> ProbeResult:
+    probe_path = resolve_filesystem_path(Path(file_info.filename))
+
+    try:
+        # Reuse the size and mtime collected by the walk when they are available
+        if file_info.size is not None and file_info.mtime_ns is not None:
+            file_size = file_info.size
+            mtime_ns = file_info.mtime_ns
+        else:
+            file_stat = probe_path.stat()
+            file_size = file_stat.st_size
+            mtime_ns = file_stat.st_mtime_ns
+
+        # Reuse the fingerprint if rename detection already computed it
+        if file_info.content_fingerprint is not None:
+            partial_hash = file_info.content_fingerprint
+        else:
+            partial_hash = compute_partial_hash(probe_path, file_size)
+    except OSError as e:
+        return ProbeResult(file_info, None, None, "", str(e))
+
+    if cache is not None:
+        # A cache that cannot be read only costs a probe
+        try:
+            cached_json = cache.get(file_size, mtime_ns, partial_hash)
+        except sqlite3.Error as e:
+            logging.error(f"Could not read the probe cache for {file_info.filename}: {e}")
+            cached_json = None
+        if cached_json is not None:
+            return ProbeResult(
+                file_info, file_size, 0, cached_json, "", partial_hash, mtime_ns
+            )
+
+    ffprobe_command = list(FFPROBE_BASE_COMMAND)
+    ffprobe_command.append(probe_path.as_posix())
+
+    try:
+        # subprocess.run kills the process if the timeout expires
+        ffprobe_output = subprocess.run(
+            ffprobe_command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+            timeout=timeout_seconds,
+        )
+    except subprocess.TimeoutExpired:
+        return ProbeResult(
+            file_info,
+            file_size,
+            None,
+            "",
+            f"ffprobe timed out after {timeout_seconds} seconds",
+            partial_hash,
+            mtime_ns,
+        )
+    except OSError as e:
+        return ProbeResult(
+            file_info, file_size, None, "", str(e), partial_hash, mtime_ns
+        )
+
+    if cache is not None and ffprobe_output.returncode == 0:
+        try:
+            cache.put(file_size, mtime_ns, partial_hash, ffprobe_output.stdout)
+        except sqlite3.Error as e:
+            logging.error(f"Could not write the probe cache for {file_info.filename}: {e}")
+
+    return ProbeResult(
+        file_info,
+        file_size,
+        ffprobe_output.returncode,
+        ffprobe_output.stdout,
+        ffprobe_output.stderr,
+        partial_hash,
+        mtime_ns,
+    )
+
+
+class ProbePool:
+    def __init__(
+        self,
+        workers: int,
+        timeout_seconds: float | None,
+        cache: ProbeCache | None = None,
+    ) -> None:
+        self._workers = max(1, workers)
+        self._timeout_seconds = timeout_seconds
+        self._cache = cache
+
+    def probe(self, files: Iterable[FileInfo]) -> Iterator[ProbeResult]:
+        # Keep at most two probes queued per worker so huge batches are not
+        # all submitted up front
+        pending_files = iter(files)
+        max_in_flight = self._workers * 2
+
+        with ThreadPoolExecutor(
+            max_workers=self._workers, thread_name_prefix="ffprobe"
+        ) as executor:
+            in_flight: set[Future[ProbeResult]] = set()
+
+            def submit_next() -> bool:
+                file_info = next(pending_files, None)
+                if file_info is None:
+                    return False
+                in_flight.add(
+                    executor.submit(
+                        run_ffprobe, file_info, self._timeout_seconds, self._cache
+                    )
+                )
+                return True
+
+            while len(in_flight) < max_in_flight and submit_next():
+                pass
+
+            while in_flight:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        yield future.result()
+                    except Exception as e:
+                        # One bad probe must not stop the walk
+                        logging.exception(f"ffprobe worker failed: {e}")
+                    submit_next()
@@ -0,0 +1,122 @@
+"""Write conversion progress to MongoDB from a background thread.
+
+Copy and encode callbacks only post their latest progress into a mailbox
+holding one entry per file, so they never wait on MongoDB. The reporter
+thread writes each pending entry as a single ``$set`` every
+``progress.interval_seconds``; values posted in between are merged into the
+entry, so percentage, speed and phase land together and intermediate values
+are dropped rather than queued. Once a file's progress is discarded, further
+reports for it are ignored until its next job opens it again, so an ffmpeg
+output thread that outlives its job cannot overwrite the final state.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from typing import Any
+
+from pymongo.errors import ServerSelectionTimeoutError, NetworkTimeout, AutoReconnect
+
+from . import media_collection, config
+
+
+class ProgressReporter:
+    def __init__(self, interval_seconds: float) -> None:
+        self._interval_seconds = interval_seconds
+
+        self._lock = threading.Lock()
+        # Held while writing, so a discarded entry cannot land after its discard
+        self._write_lock = threading.Lock()
+        # Latest unwritten progress fields of each file
+        self._pending: dict[str, dict[str, Any]] = {}
+        # Files whose progress was discarded, until their next job starts
+        self._closed: set[str] = set()
+        self._wake = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def _start(self) -> None:
+        # Called with the lock held
+        if self._thread is None:
+            # Daemon thread so stopping the backend does not wait for a write
+            self._thread = threading.Thread(
+                target=self._run, name="progress-reporter", daemon=True
+            )
+            self._thread.start()
+
+    def report(self, filename: str, fields: dict[str, Any]) -> None:
+        """Post the latest progress of a file, replacing any unwritten values."""
+        with self._lock:
+            if filename in self._closed:
+                return
+            self._pending.setdefault(filename, {}).update(fields)
+            self._start()
+        self._wake.set()
+
+    def open(self, filename: str) -> None:
+        """Accept progress for a file again when a job for it starts."""
+        with self._lock:
+            self._closed.discard(filename)
+
+    def flush(self, filename: str, fields: dict[str, Any] | None = None) -> None:
+        """Write the pending progress of a file now, merged with ``fields``."""
+        with self._write_lock:
+            with self._lock:
+                update_fields = self._pending.pop(filename, {})
+            update_fields.update(fields or {})
+            if update_fields:
+                self._write(filename, update_fields)
+
+    def discard(self, filename: str) -> None:
+        """Drop unwritten progress before the file's state is written directly.
+
+        Later reports for the file are ignored until ``open`` is called for it.
+        """
+        with self._write_lock:
+            with self._lock:
+                self._pending.pop(filename, None)
+                self._closed.add(filename)
+
+    def _write(self, filename: str, update_fields: dict[str, Any]) -> None:
+        # Progress is advisory, so a lost write is only superseded by the next one
+        try:
+            media_collection.update_one(
+                {"filename": filename},
+                {"$set": update_fields},
+            )
+        except ServerSelectionTimeoutError:
+            pass
+        except NetworkTimeout:
+            pass
+        except AutoReconnect:
+            pass
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+
+            with self._write_lock:
+                with self._lock:
+                    pending = self._pending
+                    self._pending = {}
+
+                for filename, update_fields in pending.items():
+                    self._write(filename, update_fields)
+
+            # Coalesce everything posted until the next write
+            time.sleep(self._interval_seconds)
+
+
+_reporter: ProgressReporter | None = None
+_reporter_lock = threading.Lock()
+
+
+def get_progress_reporter() -> ProgressReporter:
+    """Return the reporter shared by every converter in this process."""
+    global _reporter
+
+    with _reporter_lock:
+        if _reporter is None:
+            _reporter = ProgressReporter(config.config_data.progress.interval_seconds)
+        return _reporter
@@ -0,0 +1,146 @@
+"""Predict the converted size of a file from a few sample encodes.
+
+Short clips spread evenly across the staged input are encoded with the real
+video options. Their size per second is extrapolated to the whole duration,
+and the audio and subtitle streams, which are copied, are added back from the
+source's video bit rate. Files predicted to save less than
+``sampling.min_predicted_saving`` are marked incompressible without a full
+encode.
+"""
+
+from __future__ import annotations
+
+import logging
+from pathlib import Path
+import shutil
+import threading
+from typing import Any
+
+from ffmpeg import FFmpeg, FFmpegError
+
+from .models import Segment
+from .segments import build_segment_ffmpeg, get_video_options
+
+
+class SizePrediction:
+    def __init__(self, predicted_size: int, pre_conversion_size: int) -> None:
+        self.predicted_size = predicted_size
+        self.predicted_saving = (
+            1 - predicted_size / pre_conversion_size if pre_conversion_size > 0 else 0.0
+        )
+
+
+def get_sample_segments(
+    duration: float, sample_count: int, sample_seconds: float
+) -> list[Segment]:
+    # Centre each sample in an equal share of the file, avoiding the very start and end
+    samples: list[Segment] = []
+    for index in range(sample_count):
+        centre = duration * (index + 1) / (sample_count + 1)
+        start = max(0.0, centre - sample_seconds / 2)
+        end = min(duration, start + sample_seconds)
+        if end > start:
+            samples.append(Segment(index=index, start=start, end=end))
+    return samples
+
+
+class SizePredictor:
+    def __init__(
+        self,
+        input_path: Path,
+        work_directory: Path,
+        duration: float,
+        video_stream: int,
+        video_bit_rate: int | None,
+        output_options: dict[str, Any],
+        sample_count: int,
+        sample_seconds: float,
+    ) -> None:
+        self._input_path = input_path
+        self._work_directory = work_directory
+        self._duration = duration
+        self._video_stream = video_stream
+        self._video_bit_rate = video_bit_rate
+        self._video_options = get_video_options(output_options)
+        self._samples = get_sample_segments(duration, sample_count, sample_seconds)
+
+        self._lock = threading.Lock()
+        self._ffmpeg: FFmpeg | None = None
+        self._terminated = threading.Event()
+
+    def _encode_sample(self, sample: Segment) -> int | None:
+        """Encode one sample, returning its size or None if terminated."""
+        sample_path = self._work_directory / f"sample-{sample.index:02d}.mkv"
+        ffmpeg = build_segment_ffmpeg(
+            self._input_path, sample_path, sample, self._video_stream, self._video_options
+        )
+
+        with self._lock:
+            if self._terminated.is_set():
+                return None
+            self._ffmpeg = ffmpeg
+
+        logging.debug(f'ffmpeg command: {" ".join(ffmpeg.arguments)}')
+
+        try:
+            ffmpeg.execute()
+        finally:
+            with self._lock:
+                self._ffmpeg = None
+
+        if self._terminated.is_set():
+            return None
+
+        return sample_path.stat().st_size
+
+    def predict(self, pre_conversion_size: int) -> SizePrediction | None:
+        """Encode the samples and extrapolate, returning None if terminated.
+
+        Raises ``FFmpegError`` or ``OSError`` if a sample cannot be encoded.
+        """
+        if not self._samples or self._duration <= 0:
+            return None
+
+        self._work_directory.mkdir(parents=True, exist_ok=True)
+        try:
+            sample_bytes = 0
+            sample_seconds = 0.0
+            for sample in self._samples:
+                sample_size = self._encode_sample(sample)
+                if sample_size is None:
+                    return None
+                sample_bytes += sample_size
+                sample_seconds += (sample.end or self._duration) - sample.start
+        finally:
+            shutil.rmtree(self._work_directory, ignore_errors=True)
+
+        if sample_seconds <= 0:
+            return None
+
+        predicted_video_size = sample_bytes / sample_seconds * self._duration
+
+        # Everything but the video is copied unchanged; without a known video bit
+        # rate the video is taken to be the whole file, which can only overstate
+        # the saving
+        copied_size = 0.0
+        if self._video_bit_rate:
+            copied_size = max(
+                0.0, pre_conversion_size - self._video_bit_rate / 8 * self._duration
+            )
+
+        return SizePrediction(
+            int(predicted_video_size + copied_size), pre_conversion_size
+        )
+
+    def terminate(self) -> None:
+        self._terminated.set()
+
+        with self._lock:
+            ffmpeg = self._ffmpeg
+
+        if ffmpeg is not None:
+            try:
+                ffmpeg.terminate()
+            except (FFmpegError, OSError):
+                # The process has not started or has already exited
+                pass
@@ -0,0 +1,617 @@
+"""Segment jobs shared between backends through MongoDB.
+
+With ``segments.distributed`` enabled, the backend converting a file stores
+each planned segment as a job in ``segment_jobs``. Its own segment workers
+and any other backend with the same encoder claim jobs atomically with
+``find_one_and_update``, much like files are claimed from the media
+collection. A claimed job is kept alive with heartbeats and is handed to
+another backend once its heartbeat is older than
+``segments.stale_claim_seconds``. When every job is done the originating
+backend joins the segments and runs the usual backup and commit path.
+
+Job paths are stored in library path form and mapped with ``[path_map]`` by
+each backend, so the segment directory must be on shared storage.
+"""
+
+from __future__ import annotations
+
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta, timezone
+import hashlib
+import logging
+from pathlib import Path
+import time
+from typing import Any, Callable
+
+from bson import ObjectId
+from ffmpeg import FFmpeg, FFmpegError
+from ffmpeg import Progress as FFmpegProgress
+from pydantic import ValidationError
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import AutoReconnect, NetworkTimeout, ServerSelectionTimeoutError
+
+from . import config, segment_jobs_collection
+from .models import Segment, SegmentJob
+from .segments import SegmentedEncode, build_segment_ffmpeg, get_part_path
+
+# Projection that leaves out the ObjectId, which SegmentJob does not model
+_JOB_PROJECTION = {"_id": 0}
+
+
+def _utc_now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def get_shared_directory(filename: str) -> str:
+    # One directory per file, named from the library path
+    directory_name = hashlib.sha256(filename.encode("utf-8")).hexdigest()[:16]
+    return (config.config_data.segments.shared_directory / directory_name).as_posix()
+
+
+class SegmentJobStore:
+    """MongoDB operations on ``segment_jobs``.
+
+    Connection errors are logged and reported as "nothing happened", so
+    callers simply try again on their next poll.
+    """
+
+    def create(self, jobs: list[SegmentJob]) -> bool:
+        try:
+            # Jobs left by an earlier attempt at the same file are replaced
+            segment_jobs_collection.delete_many({"filename": jobs[0].filename})
+            segment_jobs_collection.insert_many([job.model_dump() for job in jobs])
+        except ServerSelectionTimeoutError:
+            logging.error("Could not connect to MongoDB.")
+            return False
+        except NetworkTimeout:
+            logging.error("Could not connect to MongoDB.")
+            return False
+        except AutoReconnect:
+            logging.error("Could not connect to MongoDB.")
+            return False
+        return True
+
+    def claim(
+        self,
+        claimed_by: str,
+        *,
+        filename: str | None = None,
+        video_codec: str | None = None,
+    ) -> SegmentJob | None:
+        now = _utc_now()
+        stale_time = now - timedelta(
+            seconds=config.config_data.segments.stale_claim_seconds
+        )
+
+        job_filter: dict[str, Any] = {
+            "$or": [
+                {"state": "pending"},
+                {"state": "claimed", "heartbeat_time": {"$lt": stale_time}},
+            ]
+        }
+        if filename is not None:
+            job_filter["filename"] = filename
+        if video_codec is not None:
+            job_filter["video_codec"] = video_codec
+
+        try:
+            document = segment_jobs_collection.find_one_and_update(
+                job_filter,
+                {
+                    "$set": {
+                        "state": "claimed",
+                        "claim_token": str(ObjectId()),
+                        "claimed_by": claimed_by,
+                        "heartbeat_time": now,
+                        "position": 0,
+                        "speed": None,
+                    }
+                },
+                projection=_JOB_PROJECTION,
+                sort=[("created_time", ASCENDING), ("index", ASCENDING)],
+                return_document=ReturnDocument.AFTER,
+            )
+        except ServerSelectionTimeoutError:
+            logging.error("Could not connect to MongoDB.")
+            return None
+        except NetworkTimeout:
+            logging.error("Could not connect to MongoDB.")
+            return None
+        except AutoReconnect:
+            logging.error("Could not connect to MongoDB.")
+            return None
+
+        if document is None:
+            return None
+
+        try:
+            return SegmentJob.model_validate(document)
+        except ValidationError as e:
+            logging.error(f"Invalid segment job for {document.get('filename')}: {e}")
+            self.fail(
+                document.get("filename"),
+                document.get("index"),
+                document.get("claim_token"),
+                str(e),
+            )
+            return None
+
+    def _update_claimed(self, job: SegmentJob, fields: dict[str, Any]) -> bool | None:
+        # Returns whether the job is still held by this claim, None if unknown
+        try:
+            result = segment_jobs_collection.update_one(
+                {
+                    "filename": job.filename,
+                    "index": job.index,
+                    "claim_token": job.claim_token,
+                    "state": "claimed",
+                },
+                {"$set": fields},
+            )
+        except ServerSelectionTimeoutError:
+            logging.error("Could not connect to MongoDB.")
+            return None
+        except NetworkTimeout:
+            logging.error("Could not connect to MongoDB.")
+            return None
+        except AutoReconnect:
+            logging.error("Could not connect to MongoDB.")
+            return None
+        return result.matched_count == 1
+
+    def heartbeat(self, job: SegmentJob, position: float, speed: float | None) -> bool:
+        """Record progress, returning False unless the claim is confirmed.
+
+        A backend cut off from MongoDB stops too, as once its heartbeat is stale
+        another backend can take the segment over.
+        """
+        still_claimed = self._update_claimed(
+            job,
+            {"heartbeat_time": _utc_now(), "position": position, "speed": speed},
+        )
+        return still_claimed is True
+
+    def complete(self, job: SegmentJob) -> bool:
+        return bool(self._update_claimed(job, {"state": "done", "speed": None}))
+
+    def release(self, job: SegmentJob) -> None:
+        self._update_claimed(
+            job,
+            {
+                "state": "pending",
+                "claim_token": None,
+                "claimed_by": None,
+                "heartbeat_time": None,
+                "position": 0,
+                "speed": None,
+            },
+        )
+
+    def requeue_done(self, job: SegmentJob) -> None:
+        # Hand a finished segment out again when its file has gone missing
+        try:
+            segment_jobs_collection.update_one(
+                {"filename": job.filename, "index": job.index, "state": "done"},
+                {
+                    "$set": {
+                        "state": "pending",
+                        "claim_token": None,
+                        "claimed_by": None,
+                        "heartbeat_time": None,
+                        "position": 0,
+                        "speed": None,
+                    }
+                },
+            )
+        except ServerSelectionTimeoutError:
+            logging.error("Could not connect to MongoDB.")
+        except NetworkTimeout:
+            logging.error("Could not connect to MongoDB.")
+        except AutoReconnect:
+            logging.error("Could not connect to MongoDB.")
+
+    def fail(
+        self, filename: str | None, index: int | None, claim_token: str | None, message: str
+    ) -> None:
+        try:
+            segment_jobs_collection.update_one(
+                {"filename": filename, "index": index, "claim_token": claim_token},
+                {"$set": {"state": "failed", "error_message": message, "speed": None}},
+            )
+        except ServerSelectionTimeoutError:
+            logging.error("Could not connect to MongoDB.")
+        except NetworkTimeout:
+            logging.error("Could not connect to MongoDB.")
+        except AutoReconnect:
+            logging.error("Could not connect to MongoDB.")
+
+    def get_jobs(self, filename: str) -> list[SegmentJob] | None:
+        try:
+            documents = list(
+                segment_jobs_collection.find({"filename": filename}, _JOB_PROJECTION)
+            )
+        except ServerSelectionTimeoutError:
+            logging.error("Could not connect to MongoDB.")
+            return None
+        except NetworkTimeout:
+            logging.error("Could not connect to MongoDB.")
+            return None
+        except AutoReconnect:
+            logging.error("Could not connect to MongoDB.")
+            return None
+
+        jobs: list[SegmentJob] = []
+        for document in documents:
+            try:
+                jobs.append(SegmentJob.model_validate(document))
+            except ValidationError as e:
+                logging.error(f"Invalid segment job for {filename}: {e}")
+        return jobs
+
+    def delete(self, filename: str) -> None:
+        try:
+            segment_jobs_collection.delete_many({"filename": filename})
+        except ServerSelectionTimeoutError:
+            logging.error("Could not connect to MongoDB.")
+        except NetworkTimeout:
+            logging.error("Could not connect to MongoDB.")
+        except AutoReconnect:
+            logging.error("Could not connect to MongoDB.")
+
+
+class DistributedSegmentedEncode(SegmentedEncode):
+    """Segmented encode whose segments any backend can claim.
+
+    The local workers claim this file's jobs like any other backend, reading
+    the staged input, while other backends read the library file.
+    """
+
+    def __init__(
+        self,
+        filename: str,
+        input_path: Path,
+        resolve_path: Callable[[str], Path],
+        segments: list[Segment],
+        duration: float,
+        video_stream: int,
+        output_options: dict[str, Any],
+        workers: int,
+        on_progress: Callable[[float, float | None], None],
+        claimed_by: str,
+        completed: set[int] | None = None,
+        on_segment_completed: Callable[[int], None] | None = None,
+    ) -> None:
+        self._filename = filename
+        self._shared_directory = get_shared_directory(filename)
+        self._claimed_by = claimed_by
+        self._store = SegmentJobStore()
+
+        super().__init__(
+            input_path,
+            resolve_path(self._shared_directory),
+            segments,
+            duration,
+            video_stream,
+            output_options,
+            workers,
+            on_progress,
+            completed,
+            on_segment_completed,
+        )
+        self._video_codec = str(output_options["c:v"])
+
+        # Claim held by the local worker encoding each segment
+        self._claims: dict[int, SegmentJob] = {}
+        self._last_heartbeat: dict[int, float] = {}
+
+    def create_jobs(self) -> bool:
+        created_time = _utc_now()
+        jobs = [
+            SegmentJob(
+                filename=self._filename,
+                input_path=self._filename,
+                index=segment.index,
+                start=segment.start,
+                end=segment.end,
+                output_path=(
+                    f"{self._shared_directory}/{self.segment_path(segment).name}"
+                ),
+                video_stream=self._video_stream,
+                video_codec=self._video_codec,
+                video_options=self._video_options,
+                # Segments kept from a stopped encode are not handed out again
+                state="done" if segment.index in self._completed else "pending",
+                created_time=created_time,
+            )
+            for segment in self._segments
+        ]
+
+        try:
+            self._work_directory.mkdir(parents=True, exist_ok=True)
+        except OSError as e:
+            logging.error(f"Could not create segment directory {self._work_directory}: {e}")
+            return False
+
+        return self._store.create(jobs)
+
+    def _record_progress(self, segment: Segment, position: float, speed: float) -> None:
+        job = self._claims.get(segment.index)
+        if job is None:
+            return
+
+        # Progress is reported from the job documents, so only heartbeat here
+        now = time.monotonic()
+        if (
+            now - self._last_heartbeat.get(segment.index, 0)
+            < config.config_data.segments.heartbeat_seconds
+        ):
+            return
+        self._last_heartbeat[segment.index] = now
+
+        if not self._store.heartbeat(job, position, speed):
+            logging.info(
+                f"Lost the claim of segment {segment.index} of {self._filename}"
+            )
+            self._cancel_segment(segment.index)
+
+    def _get_part_path(self, segment: Segment) -> Path:
+        job = self._claims.get(segment.index)
+        return get_part_path(
+            self.segment_path(segment), job.claim_token if job is not None else None
+        )
+
+    def _commit_segment(self, segment: Segment, part_path: Path) -> bool:
+        job = self._claims.get(segment.index)
+        if job is None:
+            part_path.unlink(missing_ok=True)
+            return False
+
+        # The segment is in place before its job is done, so a crash in between
+        # leaves a claim that goes stale and is taken over, never a missing file.
+        # A backend that took the claim over encodes the same segment, so its
+        # part may replace this one.
+        try:
+            part_path.replace(self.segment_path(segment))
+        except OSError as e:
+            self._store.fail(job.filename, job.index, job.claim_token, str(e))
+            raise
+        return self._store.complete(job)
+
+    def _record_completed(self, segment: Segment) -> None:
+        pass
+
+    def _report_job_progress(self, jobs: list[SegmentJob]) -> None:
+        encoded_seconds = 0.0
+        speed = 0.0
+        for job in jobs:
+            segment = Segment(index=job.index, start=job.start, end=job.end)
+            if job.state == "done":
+                encoded_seconds += self._segment_duration(segment)
+            elif job.state == "claimed":
+                encoded_seconds += min(job.position, self._segment_duration(segment))
+                speed += job.speed or 0
+
+        percentage_complete = (
+            (encoded_seconds / self._duration) * 100 if self._duration > 0 else 0.0
+        )
+        self._on_progress(percentage_complete, speed or None)
+
+    def _check_jobs(self) -> bool:
+        """Report progress, returning True once every job is done.
+
+        Raises ``FFmpegError`` if a backend failed to encode a segment.
+        """
+        jobs = self._store.get_jobs(self._filename)
+        if jobs is None:
+            return False
+
+        for job in jobs:
+            if job.state == "failed":
+                raise FFmpegError(
+                    f"Segment {job.index} failed on {job.claimed_by}: {job.error_message}",
+                    [],
+                )
+
+        for job in jobs:
+            if job.state != "done":
+                continue
+
+            segment = Segment(index=job.index, start=job.start, end=job.end)
+            if self.segment_path(segment).exists():
+                self._checkpoint(job.index)
+            else:
+                logging.warning(
+                    f"Segment {job.index} of {self._filename} is done but missing, "
+                    "encoding it again"
+                )
+                self._store.requeue_done(job)
+                job.state = "pending"
+
+        self._report_job_progress(jobs)
+        return len(jobs) == len(self._segments) and all(
+            job.state == "done" for job in jobs
+        )
+
+    def _work(self) -> None:
+        poll_seconds = config.config_data.segments.poll_seconds
+
+        while not self._terminated.is_set():
+            job = self._store.claim(self._claimed_by, filename=self._filename)
+            if job is None:
+                # Wait for other backends, reclaiming their segments if they stall
+                if self._check_jobs():
+                    return
+                self._terminated.wait(poll_seconds)
+                continue
+
+            segment = Segment(index=job.index, start=job.start, end=job.end)
+            self._claims[segment.index] = job
+            self._last_heartbeat.pop(segment.index, None)
+
+            try:
+                completed = self._encode_segment(segment)
+            except FFmpegError as e:
+                self._store.fail(job.filename, job.index, job.claim_token, str(e))
+                raise
+            finally:
+                self._claims.pop(segment.index, None)
+
+            if completed:
+                self._checkpoint(segment.index)
+
+    def encode(self) -> bool:
+        poll_seconds = config.config_data.segments.poll_seconds
+
+        with ThreadPoolExecutor(
+            max_workers=self._workers, thread_name_prefix="segment"
+        ) as executor:
+            futures = [executor.submit(self._work) for _ in range(self._workers)]
+
+            while True:
+                done, pending = wait(
+                    futures, timeout=poll_seconds, return_when=FIRST_EXCEPTION
+                )
+                for future in done:
+                    if future.exception() is not None:
+                        self.terminate()
+                        raise future.exception()
+
+                if not pending:
+                    break
+
+                try:
+                    self._check_jobs()
+                except FFmpegError:
+                    self.terminate()
+                    raise
+
+        return not self._terminated.is_set()
+
+    def cleanup(self) -> None:
+        self._store.delete(self._filename)
+        super().cleanup()
+
+    def suspend(self) -> None:
+        # Stop the helpers too, the jobs are created again on resume
+        super().suspend()
+        self._store.delete(self._filename)
+
+
+class SegmentHelper:
+    """Encode one claimable segment of a file another backend is converting."""
+
+    def __init__(
+        self,
+        claimed_by: str,
+        video_codec: str,
+        resolve_path: Callable[[str], Path],
+        on_claimed: Callable[[SegmentJob], None] | None = None,
+    ) -> None:
+        self._claimed_by = claimed_by
+        self._video_codec = video_codec
+        self._resolve_path = resolve_path
+        self._on_claimed = on_claimed
+        self._store = SegmentJobStore()
+
+        self._job: SegmentJob | None = None
+        self._ffmpeg: FFmpeg | None = None
+        self._cancelled = False
+        self._last_heartbeat = 0.0
+
+    def run_next(self) -> bool:
+        """Claim and encode one segment, returning False if there was none."""
+        self._job = self._store.claim(self._claimed_by, video_codec=self._video_codec)
+        if self._job is None:
+            return False
+
+        job = self._job
+        if self._on_claimed is not None:
+            self._on_claimed(job)
+
+        segment = Segment(index=job.index, start=job.start, end=job.end)
+        input_path = self._resolve_path(job.input_path)
+        segment_path = self._resolve_path(job.output_path)
+        part_path = get_part_path(segment_path, job.claim_token)
+        segment_duration = (job.end - job.start) if job.end is not None else None
+
+        logging.info(
+            f"Encoding segment {job.index} of {job.filename} for another backend"
+        )
+
+        self._cancelled = False
+        self._last_heartbeat = time.monotonic()
+        self._ffmpeg = build_segment_ffmpeg(
+            input_path,
+            part_path,
+            segment,
+            job.video_stream,
+            job.video_options,
+        )
+
+        @self._ffmpeg.on("progress")
+        def _on_progress(ffmpeg_progress: FFmpegProgress) -> None:
+            now = time.monotonic()
+            if now - self._last_heartbeat < config.config_data.segments.heartbeat_seconds:
+                return
+            self._last_heartbeat = now
+
+            position = ffmpeg_progress.time.total_seconds()
+            if segment_duration is not None:
+                position = min(position, segment_duration)
+
+            if not self._store.heartbeat(job, position, ffmpeg_progress.speed):
+                logging.info(f"Lost the claim of segment {job.index} of {job.filename}")
+                self._cancelled = True
+                self._terminate_ffmpeg()
+
+        try:
+            part_path.parent.mkdir(parents=True, exist_ok=True)
+            self._ffmpeg.execute()
+        except (FFmpegError, OSError) as e:
+            logging.error(f"Could not encode segment {job.index} of {job.filename}")
+            logging.error(e)
+            self._store.fail(job.filename, job.index, job.claim_token, str(e))
+            part_path.unlink(missing_ok=True)
+            self._job = None
+            self._ffmpeg = None
+            return True
+
+        # The segment is put in place before its job is marked done, so the job is
+        # never done without its file
+        if self._cancelled:
+            part_path.unlink(missing_ok=True)
+        else:
+            try:
+                part_path.replace(segment_path)
+            except OSError as e:
+                logging.error(f"Could not store segment {job.index} of {job.filename}")
+                logging.error(e)
+                self._store.fail(job.filename, job.index, job.claim_token, str(e))
+                part_path.unlink(missing_ok=True)
+            else:
+                if self._store.complete(job):
+                    logging.info(f"Finished segment {job.index} of {job.filename}")
+                else:
+                    logging.info(
+                        f"Lost the claim of segment {job.index} of {job.filename}"
+                    )
+
+        self._job = None
+        self._ffmpeg = None
+        return True
+
+    def _terminate_ffmpeg(self) -> None:
+        if self._ffmpeg is None:
+            return
+        try:
+            self._ffmpeg.terminate()
+        except (FFmpegError, OSError):
+            pass
+
+    def terminate(self) -> None:
+        # Stop encoding and hand the segment back straight away
+        self._cancelled = True
+        self._terminate_ffmpeg()
+        if self._job is not None:
+            self._store.release(self._job)
+            self._job = None
@@ -0,0 +1,409 @@
+"""Segment-parallel encoding for long files.
+
+The staged input is split at video keyframes found by probing packet flags
+around evenly spaced target times, as in ``probe_video.py``. Each segment's
+video is encoded by its own ffmpeg process, several at once, and the encoded
+segments are joined with the concat demuxer while the audio and subtitle
+streams are copied from the staged input, so the join is lossless.
+
+Finished segments are renamed from ``.part.mkv`` to ``.mkv`` only once their
+ffmpeg process succeeds, which makes each one a checkpoint. A stopped encode
+keeps its finished segments and is resumed from them with the same plan.
+"""
+
+from __future__ import annotations
+
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+import json
+import logging
+import math
+import os
+from pathlib import Path
+import shutil
+import subprocess
+import threading
+from typing import Any, Callable
+
+from ffmpeg import FFmpeg, FFmpegError
+from ffmpeg import Progress as FFmpegProgress
+
+from .models import Segment
+
+
+def get_segment_workers(configured_workers: int) -> int:
+    # libx265 frame threading stops scaling at about eight threads
+    if configured_workers > 0:
+        return configured_workers
+    return max(1, (os.cpu_count() or 1) // 8)
+
+
+def _find_keyframe_after(
+    input_path: Path,
+    video_stream: int,
+    position: float,
+    search_seconds: float,
+) -> float | None:
+    ffprobe_command = [
+        "ffprobe",
+        "-v",
+        "error",
+        "-read_intervals",
+        f"{position}%+{search_seconds}",
+        "-select_streams",
+        str(video_stream),
+        "-show_entries",
+        "packet=pts_time,flags",
+        "-of",
+        "json",
+        input_path.as_posix(),
+    ]
+
+    try:
+        ffprobe_output = subprocess.run(
+            ffprobe_command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+            check=True,
+        )
+        packets = json.loads(ffprobe_output.stdout).get("packets", [])
+    except (OSError, subprocess.CalledProcessError, json.JSONDecodeError) as e:
+        logging.error(f"Could not find keyframes in {input_path} near {position}: {e}")
+        return None
+
+    # Keyframes are flagged with a "K" (e.g. "K__"); the seek lands on the
+    # keyframe before the position, so take the first one at or after it
+    keyframe_times: list[float] = []
+    for packet in packets:
+        if "K" not in packet.get("flags", ""):
+            continue
+        try:
+            keyframe_times.append(float(packet["pts_time"]))
+        except (KeyError, ValueError):
+            continue
+
+    following = [time for time in keyframe_times if time >= position]
+    return min(following) if following else None
+
+
+def plan_segments(
+    input_path: Path,
+    video_stream: int,
+    duration: float,
+    segment_seconds: float,
+    search_seconds: float,
+) -> list[Segment]:
+    """Split ``duration`` into keyframe-aligned segments of about ``segment_seconds``."""
+    segment_count = max(1, math.ceil(duration / segment_seconds))
+    split_points: list[float] = []
+
+    for index in range(1, segment_count):
+        keyframe_time = _find_keyframe_after(
+            input_path, video_stream, duration * index / segment_count, search_seconds
+        )
+
+        # Merge into the previous segment if no usable keyframe was found
+        if keyframe_time is None or keyframe_time >= duration:
+            continue
+        if split_points and keyframe_time <= split_points[-1]:
+            continue
+        if keyframe_time <= 0:
+            continue
+        split_points.append(keyframe_time)
+
+    starts = [0.0, *split_points]
+    return [
+        Segment(
+            index=index,
+            start=start,
+            end=starts[index + 1] if index + 1 < len(starts) else None,
+        )
+        for index, start in enumerate(starts)
+    ]
+
+
+def get_video_options(output_options: dict[str, Any]) -> dict[str, Any]:
+    # Video only, audio and subtitles are copied from the input when joining
+    video_options = {
+        key: value for key, value in output_options.items() if key not in ("c:a", "c:s")
+    }
+    video_options.update({"an": None, "sn": None, "dn": None})
+    return video_options
+
+
+def build_segment_ffmpeg(
+    input_path: Path,
+    output_path: Path,
+    segment: Segment,
+    video_stream: int,
+    video_options: dict[str, Any],
+) -> FFmpeg:
+    # Bounding the input rather than the output keeps every frame; an output
+    # duration drops the last frame of each segment to rounding
+    input_options = {"ss": f"{segment.start:.6f}"}
+    if segment.end is not None:
+        input_options["to"] = f"{segment.end:.6f}"
+
+    return (
+        FFmpeg.option(FFmpeg(), "y")
+        .input(input_path, input_options)
+        .output(output_path, video_options, map=[f"0:{video_stream}"])
+    )
+
+
+def get_part_path(segment_path: Path, claim_token: str | None = None) -> Path:
+    # Each claim of a shared segment writes its own part, so a backend that lost
+    # its claim can never write over the part of the backend that took it over
+    if claim_token is not None:
+        return segment_path.with_suffix(f".{claim_token}.part.mkv")
+    return segment_path.with_suffix(".part.mkv")
+
+
+class SegmentedEncode:
+    def __init__(
+        self,
+        input_path: Path,
+        work_directory: Path,
+        segments: list[Segment],
+        duration: float,
+        video_stream: int,
+        output_options: dict[str, Any],
+        workers: int,
+        on_progress: Callable[[float, float | None], None],
+        completed: set[int] | None = None,
+        on_segment_completed: Callable[[int], None] | None = None,
+    ) -> None:
+        self._input_path = input_path
+        self._work_directory = work_directory
+        self._segments = segments
+        self._duration = duration
+        self._video_stream = video_stream
+        self._workers = max(1, workers)
+        self._on_progress = on_progress
+        self._on_segment_completed = on_segment_completed
+
+        self._video_options = get_video_options(output_options)
+
+        # Running ffmpeg processes, so all of them can be terminated, and
+        # segments whose encode was stopped on its own
+        self._lock = threading.Lock()
+        self._running: dict[int, FFmpeg] = {}
+        self._cancelled: set[int] = set()
+        self._terminated = threading.Event()
+
+        # Seconds encoded and current speed of each segment
+        self._positions: dict[int, float] = {}
+        self._speeds: dict[int, float] = {}
+
+        # Segments finished by an earlier run are only trusted if their file is kept
+        self._completed: set[int] = set()
+        for segment in segments:
+            if segment.index in (completed or ()) and self.segment_path(segment).exists():
+                self._completed.add(segment.index)
+                self._positions[segment.index] = self._segment_duration(segment)
+
+    @property
+    def terminated(self) -> bool:
+        return self._terminated.is_set()
+
+    def segment_path(self, segment: Segment) -> Path:
+        return self._work_directory / f"segment-{segment.index:04d}.mkv"
+
+    def _segment_duration(self, segment: Segment) -> float:
+        end = segment.end if segment.end is not None else self._duration
+        return max(0.0, end - segment.start)
+
+    def _report_progress(self) -> None:
+        with self._lock:
+            encoded_seconds = sum(self._positions.values())
+            speed = sum(self._speeds.values()) if self._speeds else None
+
+        percentage_complete = (
+            (encoded_seconds / self._duration) * 100 if self._duration > 0 else 0.0
+        )
+        self._on_progress(percentage_complete, speed)
+
+    def _record_progress(self, segment: Segment, position: float, speed: float) -> None:
+        with self._lock:
+            self._positions[segment.index] = position
+            self._speeds[segment.index] = speed
+        self._report_progress()
+
+    def _record_completed(self, segment: Segment) -> None:
+        with self._lock:
+            self._positions[segment.index] = self._segment_duration(segment)
+        self._report_progress()
+        self._checkpoint(segment.index)
+
+    def _checkpoint(self, index: int) -> None:
+        with self._lock:
+            if index in self._completed:
+                return
+            self._completed.add(index)
+
+        if self._on_segment_completed is not None:
+            self._on_segment_completed(index)
+
+    def _get_part_path(self, segment: Segment) -> Path:
+        return get_part_path(self.segment_path(segment))
+
+    def _commit_segment(self, segment: Segment, part_path: Path) -> bool:
+        """Move a finished part into place, returning False if it was not kept."""
+        part_path.replace(self.segment_path(segment))
+        return True
+
+    def _cancel_segment(self, index: int) -> None:
+        # Stop one segment without terminating the whole encode
+        with self._lock:
+            self._cancelled.add(index)
+            ffmpeg = self._running.get(index)
+
+        if ffmpeg is not None:
+            try:
+                ffmpeg.terminate()
+            except (FFmpegError, OSError):
+                pass
+
+    def _encode_segment(self, segment: Segment) -> bool:
+        """Encode one segment, returning False if it was stopped."""
+        part_path = self._get_part_path(segment)
+
+        ffmpeg = build_segment_ffmpeg(
+            self._input_path, part_path, segment, self._video_stream, self._video_options
+        )
+
+        @ffmpeg.on("progress")
+        def _on_progress(ffmpeg_progress: FFmpegProgress) -> None:
+            self._record_progress(
+                segment,
+                min(
+                    ffmpeg_progress.time.total_seconds(),
+                    self._segment_duration(segment),
+                ),
+                ffmpeg_progress.speed,
+            )
+
+        with self._lock:
+            if self._terminated.is_set():
+                return False
+            self._cancelled.discard(segment.index)
+            self._running[segment.index] = ffmpeg
+
+        logging.info(
+            f"Encoding segment {segment.index} of {self._input_path.name} "
+            f"from {segment.start:.3f}s"
+        )
+        logging.debug(f'ffmpeg command: {" ".join(ffmpeg.arguments)}')
+
+        try:
+            ffmpeg.execute()
+        finally:
+            with self._lock:
+                self._running.pop(segment.index, None)
+                self._speeds.pop(segment.index, None)
+
+        # A terminated ffmpeg returns without raising
+        with self._lock:
+            stopped = self._terminated.is_set() or segment.index in self._cancelled
+
+        if stopped:
+            part_path.unlink(missing_ok=True)
+            return False
+
+        if not self._commit_segment(segment, part_path):
+            return False
+
+        self._record_completed(segment)
+        return True
+
+    def encode(self) -> bool:
+        """Encode every segment, returning False if terminated.
+
+        Raises the first ``FFmpegError`` after terminating the other segments.
+        """
+        self._work_directory.mkdir(parents=True, exist_ok=True)
+        if self._completed:
+            logging.info(
+                f"Resuming {self._input_path.name} after "
+                f"{len(self._completed)} finished segment(s)"
+            )
+
+        with ThreadPoolExecutor(
+            max_workers=self._workers, thread_name_prefix="segment"
+        ) as executor:
+            futures = [
+                executor.submit(self._encode_segment, segment)
+                for segment in self._segments
+                if segment.index not in self._completed
+            ]
+            done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+
+            for future in done:
+                if future.exception() is not None:
+                    self.terminate()
+                    for pending in futures:
+                        pending.cancel()
+                    raise future.exception()
+
+        return not self._terminated.is_set()
+
+    def join(self, output_path: Path, subtitle_codec: str, mapping: list[str]) -> bool:
+        """Join the encoded segments into ``output_path``, returning False if terminated.
+
+        ``mapping`` refers to the staged input as input 1, the joined video is input 0.
+        """
+        concat_list_path = self._work_directory / "segments.txt"
+        with concat_list_path.open("w", encoding="utf-8") as f:
+            for segment in self._segments:
+                escaped_path = self.segment_path(segment).as_posix().replace("'", "'\\''")
+                f.write(f"file '{escaped_path}'\n")
+
+        join_options = {
+            "c:v": "copy",
+            "c:a": "copy",
+            "c:s": subtitle_codec,
+            "map_metadata": "1",
+            "map_chapters": "1",
+        }
+
+        ffmpeg = (
+            FFmpeg.option(FFmpeg(), "y")
+            .input(concat_list_path, f="concat", safe="0")
+            .input(self._input_path)
+            .output(output_path, join_options, map=mapping)
+        )
+
+        with self._lock:
+            if self._terminated.is_set():
+                return False
+            self._running[-1] = ffmpeg
+
+        logging.info(f'ffmpeg command: {" ".join(ffmpeg.arguments)}')
+
+        try:
+            ffmpeg.execute()
+        finally:
+            with self._lock:
+                self._running.pop(-1, None)
+
+        return not self._terminated.is_set()
+
+    def cleanup(self) -> None:
+        shutil.rmtree(self._work_directory, ignore_errors=True)
+
+    def suspend(self) -> None:
+        """Stop encoding, keeping the finished segments for a later resume."""
+        self.terminate()
+
+    def terminate(self) -> None:
+        self._terminated.set()
+
+        with self._lock:
+            running = list(self._running.values())
+
+        for ffmpeg in running:
+            try:
+                ffmpeg.terminate()
+            except (FFmpegError, OSError):
+                # The process has not started or has already exited
+                pass
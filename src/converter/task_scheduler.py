@@ -5,17 +5,36 @@ from zoneinfo import ZoneInfo
 import signal
 import sys
 import os
+from typing import TYPE_CHECKING
 
 from .folder_walker import FolderWalker
 from .codec_detector import CodecDetector
-from .converter import Converter
-from . import config
+from .inotify_watcher import InotifyWatcher
+from .walk_snapshot import WalkSnapshot
+from . import bootstrap, config
+
+# The conversion stack (ffmpeg, push notifications and cover art) is only
+# imported by backends, so the walker starts without loading it
+if TYPE_CHECKING:
+    from .conversion_slots import ConversionSlots
+    from .converter import Converter
+    from .prefetch import StagingPrefetcher
 
 class TaskScheduler:
     def __init__(self) -> None:
         # Set the next walk time to now so that the folders are walked immediately on startup
         self._next_walk_time = datetime.now().astimezone(timezone.utc)
 
+        # The first walk is always a full reconciliation
+        self._next_full_reconcile_time = self._next_walk_time
+
+        # Snapshot of the previous walk, loaded on the first incremental walk
+        self._walk_snapshot: WalkSnapshot | None = None
+
+        # inotify change feed, started after the first walk when enabled
+        self._watcher: InotifyWatcher | None = None
+        self._use_inotify = config.config_data.walker.discovery == "inotify"
+
         # Get the scan time, start conversion time, and end conversion time from the config
         self._scan_time = config.config_data.schedule.scan_time
         self._start_conversion_time = config.config_data.schedule.start_conversion_time
@@ -24,6 +43,19 @@ class TaskScheduler:
         # Boolean to keep track of whether the conversion is running
         self._conversion_running = False
 
+        # Concurrent conversions, when more than one slot is configured
+        self._slots: "ConversionSlots | None" = None
+
+        # Stages the next file during each encode when converting one at a time
+        self._prefetcher: "StagingPrefetcher | None" = None
+
+        # One converter converts file after file when converting one at a time,
+        # keeping its process, connections and imports between files
+        self._converter: "Converter | None" = None
+
+        if os.getenv("FOLDER_WALKER") != "TRUE":
+            self._create_converters()
+
         # Register signal handlers
         self._register_signal_handlers()
 
@@ -41,16 +73,41 @@ class TaskScheduler:
                 "WALKER_IDLE=TRUE: folder walks disabled; container staying up for manual use"
             )
 
+    def _create_converters(self) -> None:
+        from .conversion_slots import ConversionSlots
+        from .converter import Converter
+        from .prefetch import StagingPrefetcher
+
+        if config.config_data.slots.max_slots > 1:
+            self._slots = ConversionSlots()
+            return
+
+        if config.config_data.prefetch.enabled:
+            self._prefetcher = StagingPrefetcher()
+
+        self._converter = Converter(prefetcher=self._prefetcher)
+
     def _signal_handler(self, sig: int, _):
         # Handle SIGINT and SIGTERM signals to ensure the Docker container stops gracefully
         match sig:
             case signal.SIGINT:
                 logging.info("Stopping due to keyboard interrupt...")
+                self._terminate_conversions()
                 sys.exit(0)
             case signal.SIGTERM:
                 logging.info("Stopping due to SIGTERM...")
+                self._terminate_conversions()
                 sys.exit(0)
 
+    def _terminate_conversions(self) -> None:
+        # Stop every conversion's ffmpeg processes and give back a prefetched file before exiting
+        if self._converter is not None:
+            self._converter.terminate()
+        if self._slots is not None:
+            self._slots.terminate()
+        if self._prefetcher is not None:
+            self._prefetcher.release(wait=False)
+
     def _register_signal_handlers(self) -> None:
         # Register signal handlers
         signal.signal(signal.SIGINT, self._signal_handler)
@@ -58,6 +115,9 @@ class TaskScheduler:
 
     def run(self) -> None:
         while True:
+            # Retry a bootstrap that could not reach MongoDB, a no-op once it succeeded
+            bootstrap()
+
             # Get the current time in UTC
             now = datetime.now().astimezone(timezone.utc)
 
@@ -73,9 +133,29 @@ class TaskScheduler:
                     logging.info("Walk folders")
                     self._walk_folders()
 
-                    # Set the next walk time to the next scan time
-                    self._next_walk_time = datetime.now().astimezone(timezone.utc) + timedelta(minutes=1)
+                    # Set the next walk time, only reconciling occasionally when inotify reports changes
+                    if self._watcher is not None:
+                        walk_interval = timedelta(
+                            minutes=config.config_data.walker.full_reconcile_minutes
+                        )
+                    else:
+                        walk_interval = timedelta(minutes=1)
+                    self._next_walk_time = datetime.now().astimezone(timezone.utc) + walk_interval
                     logging.info(f"Next walk time: {self._next_walk_time}")
+                elif self._watcher is not None and not self._watcher.alive:
+                    self._stop_watching("inotify reader stopped")
+                elif self._watcher is not None:
+                    changes = self._watcher.take_changes(
+                        config.config_data.walker.debounce_seconds
+                    )
+                    if changes is not None:
+                        dirty_directories, overflowed = changes
+                        if overflowed:
+                            # Events were lost, so fall back to checking every directory
+                            logging.warning("inotify queue overflowed, walking folders")
+                            self._next_walk_time = now
+                        else:
+                            self._refresh_folders(dirty_directories)
             else:
                 # Get the start conversion time in UTC
                 start_conversion_datetime = datetime.combine(
@@ -95,31 +175,110 @@ class TaskScheduler:
                     # If the current time is between the start conversion time and the end conversion time, start the conversion
                     self._conversion_running = True
 
-                    # Construct a Converter object
-                    converter = Converter()
-
-                    # Start the conversion
-                    converter.convert()
-
-                    # Reregister the signal handlers now that the conversion has finished
-                    self._register_signal_handlers()
+                    if self._slots is not None:
+                        # Start another conversion if a slot and enough cores are free
+                        self._slots.fill()
+                    elif self._converter is not None:
+                        # Convert the next file in this process
+                        self._converter.convert()
                 else:
                     logging.debug(f'Current time: {now}, start conversion time: {self._start_conversion_time}, end conversion time: {self._end_conversion_time}')
                     # If the current time is not between the start conversion time and the end conversion time, stop the conversion
                     self._conversion_running = False
 
+                    # Give back a file staged for a conversion that will not run now
+                    if self._prefetcher is not None:
+                        self._prefetcher.release()
+
             # Sleep for 1 second
             sleep(1)
 
     def _walk_folders(self) -> None:
+        now = datetime.now().astimezone(timezone.utc)
+        full_reconcile = now >= self._next_full_reconcile_time
+
+        if (
+            config.config_data.walker.incremental or self._use_inotify
+        ) and self._walk_snapshot is None:
+            self._walk_snapshot = FolderWalker.load_snapshot()
+
         # Construct a FolderWalker object
-        walker = FolderWalker()
+        walker = FolderWalker(snapshot=self._walk_snapshot)
 
-        # Walk the folders
-        walker.walk_folders()
+        # Walk the folders, re-listing every directory on a full reconciliation
+        walker.walk_folders(full=full_reconcile)
 
-        # Construct a CodecDetector object
-        detector = CodecDetector(files=walker.files_dict)
+        # Construct a CodecDetector object, passing only the changes on incremental walks
+        detector = CodecDetector(
+            files=walker.files_dict,
+            diff=None if full_reconcile else walker.diff,
+            identity_index=walker.identity_index,
+            unreadable_directories=walker.unreadable_directories,
+        )
 
         # Get the file encodings
         detector.get_file_encoding()
+
+        # Only move the snapshot on once the changes are stored, so failed walks are retried
+        if detector.connection_successful and detector.write_successful:
+            walker.commit_snapshot()
+
+            if full_reconcile:
+                self._next_full_reconcile_time = now + timedelta(
+                    minutes=config.config_data.walker.full_reconcile_minutes
+                )
+
+        if self._use_inotify:
+            self._watch_folders(walker)
+
+    def _refresh_folders(self, directories: set[str]) -> None:
+        logging.info(f"Refreshing {len(directories)} changed director(ies)")
+
+        # Re-list only the directories reported by inotify
+        walker = FolderWalker(snapshot=self._walk_snapshot)
+        walker.refresh_directories(directories)
+
+        detector = CodecDetector(
+            files=walker.files_dict,
+            diff=walker.diff,
+            identity_index=walker.identity_index,
+            unreadable_directories=walker.unreadable_directories,
+        )
+        detector.get_file_encoding()
+
+        if detector.connection_successful and detector.write_successful:
+            walker.commit_snapshot()
+        elif self._watcher is not None:
+            # Try these directories again once MongoDB is back
+            self._watcher.requeue(directories)
+
+        self._watch_folders(walker)
+
+    def _stop_watching(self, reason: str) -> None:
+        logging.error(f"{reason}, falling back to polling")
+        if self._watcher is not None:
+            self._watcher.close()
+        self._watcher = None
+        self._use_inotify = False
+
+        # Changes may have been missed, so walk on the next pass and every minute after
+        self._next_walk_time = datetime.now().astimezone(timezone.utc)
+
+    def _watch_folders(self, walker: FolderWalker) -> None:
+        # Keep an inotify watch on every directory the walker listed
+        initial_sync = self._watcher is None
+
+        try:
+            if self._watcher is None:
+                self._watcher = InotifyWatcher()
+            self._watcher.sync(walker.directories)
+        except OSError as e:
+            self._stop_watching(f"inotify unavailable: {e}")
+            return
+
+        if not self._watcher.alive:
+            self._stop_watching("inotify reader stopped")
+            return
+
+        if initial_sync:
+            logging.info(f"Watching {len(walker.directories)} directories for changes")
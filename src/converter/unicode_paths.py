@@ -2,8 +2,10 @@
 
 from __future__ import annotations
 
+from functools import lru_cache
 import unicodedata
 from pathlib import Path
+from typing import Iterable
 
 _directory_cache: dict[Path, tuple[Path, ...]] = {}
 
@@ -12,8 +14,12 @@ def normalize_path(path: str) -> str:
     return unicodedata.normalize("NFC", path)
 
 
+@lru_cache(maxsize=1 << 18)
 def path_identity_key(path: str) -> str:
-    """Identity for same-file checks on case-insensitive APFS (NFC + casefold)."""
+    """Identity for same-file checks on case-insensitive APFS (NFC + casefold).
+
+    Memoized because every walk computes keys for the same library paths.
+    """
     return normalize_path(path).casefold()
 
 
@@ -33,6 +39,36 @@ def find_equivalent_path(name: str, candidates: set[str]) -> str | None:
     return None
 
 
+class PathIdentityIndex:
+    """Map identity keys to paths so equivalent-path lookups are O(1).
+
+    Build once per walk instead of calling ``find_equivalent_path`` against
+    every candidate for each lookup.
+    """
+
+    def __init__(self, paths: Iterable[str] = ()) -> None:
+        self._paths: dict[str, str] = {}
+        for path in paths:
+            self.add(path)
+
+    def add(self, path: str) -> bool:
+        """Add ``path``, returning False if an equivalent path is already indexed."""
+        identity_key = path_identity_key(path)
+        if identity_key in self._paths:
+            return False
+        self._paths[identity_key] = path
+        return True
+
+    def find(self, name: str) -> str | None:
+        return self._paths.get(path_identity_key(name))
+
+    def __contains__(self, name: str) -> bool:
+        return path_identity_key(name) in self._paths
+
+    def __len__(self) -> int:
+        return len(self._paths)
+
+
 def clear_directory_cache() -> None:
     _directory_cache.clear()
 
@@ -0,0 +1,102 @@
+"""Persisted per-directory listing used to make folder walks incremental.
+
+Each walked directory is stored with its mtime, the child directories that
+were entered and the matching video files with their size and mtime. A later
+walk only re-lists directories whose mtime has changed, so a quiet library
+costs one ``stat`` per directory instead of a full listing.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+from pathlib import Path
+
+
+class DirectoryRecord:
+    def __init__(
+        self,
+        mtime_ns: int,
+        dirs: list[str],
+        files: dict[str, tuple[int, int]],
+    ) -> None:
+        # Directory mtime when it was listed, -1 forces a re-list next walk
+        self.mtime_ns = mtime_ns
+
+        # Names of the child directories to walk
+        self.dirs = dirs
+
+        # Matching video file names mapped to (size, mtime_ns)
+        self.files = files
+
+
+class WalkSnapshot:
+    _version = 1
+
+    def __init__(self, path: Path, signature: list[str]) -> None:
+        self._path = path
+
+        # The include/exclude configuration the snapshot was built for
+        self._signature = signature
+
+        # Directory path to its last committed listing
+        self.directories: dict[str, DirectoryRecord] = {}
+
+        self._load()
+
+    def _load(self) -> None:
+        try:
+            with self._path.open("r") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logging.warning(f"Could not read walk snapshot {self._path}: {e}")
+            return
+
+        if data.get("version") != self._version or data.get("signature") != self._signature:
+            logging.info("Walk snapshot is out of date, starting a new one")
+            return
+
+        self.directories = {
+            directory: DirectoryRecord(
+                mtime_ns=mtime_ns,
+                dirs=dirs,
+                files={name: (size, mtime) for name, (size, mtime) in files.items()},
+            )
+            for directory, (mtime_ns, dirs, files) in data["directories"].items()
+        }
+        logging.info(
+            f"Loaded walk snapshot with {len(self.directories)} directories"
+        )
+
+    def file_stats(self) -> dict[str, tuple[int, int]]:
+        # Every file in the snapshot mapped to its (size, mtime_ns)
+        return {
+            os.path.join(directory, name): stats
+            for directory, record in self.directories.items()
+            for name, stats in record.files.items()
+        }
+
+    def commit(self, directories: dict[str, DirectoryRecord]) -> None:
+        # Replace the committed listing and persist it atomically
+        self.directories = directories
+
+        data = {
+            "version": self._version,
+            "signature": self._signature,
+            "directories": {
+                directory: [record.mtime_ns, record.dirs, record.files]
+                for directory, record in directories.items()
+            },
+        }
+
+        temporary_path = self._path.with_name(self._path.name + ".tmp")
+        try:
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            with temporary_path.open("w") as f:
+                json.dump(data, f, separators=(",", ":"))
+            temporary_path.replace(self._path)
+        except OSError as e:
+            logging.error(f"Could not write walk snapshot {self._path}: {e}")
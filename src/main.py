@@ -1,6 +1,10 @@
+from converter import bootstrap
 from converter.task_scheduler import TaskScheduler
 
 def main() -> None:
+    # Connect to MongoDB and check the indexes before starting work
+    bootstrap()
+
     # Create the task scheduler
     scheduler = TaskScheduler()
 
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""List files the walker could not probe, from the probe cache database.
+
+By default only lists files that have been given up on until they change.
+Run on the walker host, or point --state-directory at its state directory.
+
+Example:
+    python src/probe_failures.py
+    python src/probe_failures.py --all
+    python src/probe_failures.py --clear "/Media/TV/Some Show/broken.mkv"
+    docker compose exec walker-1 python3 /src/probe_failures.py
+"""
+
+from __future__ import annotations
+
+import argparse
+from datetime import datetime
+import logging
+import os
+from pathlib import Path
+import sqlite3
+import sys
+import tomllib
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+DEFAULT_CONFIG_PATH = REPO_ROOT / "src/config.toml"
+DEFAULT_STATE_DIRECTORY = Path("/tmp/convert-to-h265/state")
+
+
+def _configure_logging(verbose: bool) -> None:
+    level = logging.DEBUG if verbose else logging.INFO
+    logging.basicConfig(level=level, format="%(asctime)s - %(levelname)s - %(message)s")
+
+
+def _state_directory_from_config() -> Path:
+    config_path = Path(os.getenv("CONVERTER_CONFIG_PATH", DEFAULT_CONFIG_PATH))
+    with config_path.open("rb") as f:
+        config_data = tomllib.load(f)
+
+    state_directory = Path(
+        config_data.get("runtime", {}).get("state_directory", DEFAULT_STATE_DIRECTORY)
+    )
+    return state_directory if state_directory.is_absolute() else REPO_ROOT / state_directory
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="List files that failed to probe and are no longer retried."
+    )
+    parser.add_argument(
+        "--state-directory",
+        type=Path,
+        help="Walker state directory (default: runtime.state_directory from the config).",
+    )
+    parser.add_argument(
+        "--all",
+        action="store_true",
+        help="Also list files that are still being retried.",
+    )
+    parser.add_argument(
+        "--clear",
+        nargs="+",
+        metavar="FILENAME",
+        help="Forget the failures of these files so the next walk probes them again.",
+    )
+    parser.add_argument(
+        "--verbose",
+        "-v",
+        action="store_true",
+        help="Verbose logging.",
+    )
+    args = parser.parse_args()
+    _configure_logging(verbose=args.verbose)
+
+    state_directory = args.state_directory or _state_directory_from_config()
+    cache_path = state_directory / "probe_cache.sqlite3"
+    if not cache_path.exists():
+        logging.error("No probe cache at %s", cache_path)
+        return 1
+
+    connection = sqlite3.connect(cache_path)
+    try:
+        if args.clear:
+            connection.executemany(
+                "DELETE FROM probe_failures WHERE filename = ?",
+                ((filename,) for filename in args.clear),
+            )
+            connection.commit()
+            logging.info("Cleared %s file(s)", len(args.clear))
+            return 0
+
+        query = (
+            "SELECT filename, attempts, permanent, retry_after, last_failure, last_error "
+            "FROM probe_failures"
+        )
+        if not args.all:
+            query += " WHERE permanent = 1"
+        rows = connection.execute(query + " ORDER BY filename").fetchall()
+    except sqlite3.OperationalError as exc:
+        logging.error("Could not read %s: %s", cache_path, exc)
+        return 1
+    finally:
+        connection.close()
+
+    for filename, attempts, permanent, retry_after, last_failure, last_error in rows:
+        status = (
+            "given up"
+            if permanent
+            else f"retry after {datetime.fromtimestamp(retry_after):%Y-%m-%d %H:%M}"
+        )
+        print(filename)
+        print(
+            f"    {attempts} attempt(s), last failed "
+            f"{datetime.fromtimestamp(last_failure):%Y-%m-%d %H:%M}, {status}"
+        )
+        if last_error:
+            print(f"    {last_error.splitlines()[-1]}")
+
+    logging.info("%s file(s)", len(rows))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
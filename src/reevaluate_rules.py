@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""Re-apply the [conversion_rules] config to files already in media_collection.
+
+Only files that are not converted or being converted are updated, and files
+that sample encodes showed would not shrink are left alone. Run after
+changing the rules; the walker only evaluates them for new files.
+
+Example:
+    python src/reevaluate_rules.py --dry-run
+    python src/reevaluate_rules.py
+    docker compose exec walker-1 python3 /src/reevaluate_rules.py
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+import sys
+
+from pydantic import ValidationError
+from pymongo import UpdateOne
+from pymongo.errors import AutoReconnect, NetworkTimeout, ServerSelectionTimeoutError
+
+from converter import config, media_collection
+from converter.bulk_writer import bulk_write_batches
+from converter.conversion_rules import decide
+from converter.models import VideoInformation
+
+
+def _configure_logging(verbose: bool) -> None:
+    level = logging.DEBUG if verbose else logging.INFO
+    logging.basicConfig(level=level, format="%(asctime)s - %(levelname)s - %(message)s")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Re-evaluate conversion_required for existing files."
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Preview changes without writing to MongoDB.",
+    )
+    parser.add_argument(
+        "--verbose",
+        "-v",
+        action="store_true",
+        help="Verbose logging.",
+    )
+    args = parser.parse_args()
+    _configure_logging(verbose=args.verbose)
+
+    rules = config.config_data.conversion_rules
+    operations: list[UpdateOne] = []
+    filenames: list[str] = []
+    checked = 0
+
+    try:
+        documents = media_collection.find(
+            {
+                "deleted": {"$ne": True},
+                "converted": {"$ne": True},
+                "converting": {"$ne": True},
+                "incompressible": {"$ne": True},
+            },
+            {
+                "filename": 1,
+                "video_information": 1,
+                "first_video_stream": 1,
+                "conversion_required": 1,
+                "conversion_skip_reason": 1,
+                "conversion_mode": 1,
+                "_id": 0,
+            },
+        )
+
+        for document in documents:
+            checked += 1
+            try:
+                video_information = VideoInformation.model_validate(
+                    document.get("video_information")
+                )
+            except ValidationError:
+                logging.warning(
+                    "Skipping %s: invalid video information", document["filename"]
+                )
+                continue
+
+            decision = decide(
+                video_information, document.get("first_video_stream"), rules
+            )
+            conversion_mode = decision.conversion_mode or "encode"
+            if (
+                document.get("conversion_required") == decision.conversion_required
+                and document.get("conversion_skip_reason") == decision.skip_reason
+                and document.get("conversion_mode", "encode") == conversion_mode
+            ):
+                continue
+
+            logging.debug(
+                "%s: %s",
+                document["filename"],
+                (
+                    conversion_mode.upper()
+                    if decision.conversion_required
+                    else f"OK ({decision.skip_reason})"
+                ),
+            )
+            operations.append(
+                UpdateOne(
+                    {"filename": document["filename"], "converting": {"$ne": True}},
+                    {
+                        "$set": {
+                            "conversion_required": decision.conversion_required,
+                            "conversion_skip_reason": decision.skip_reason,
+                            "conversion_mode": conversion_mode,
+                        }
+                    },
+                )
+            )
+            filenames.append(document["filename"])
+    except ServerSelectionTimeoutError:
+        logging.error("Could not connect to MongoDB")
+        return 1
+    except NetworkTimeout:
+        logging.error("Could not connect to MongoDB")
+        return 1
+    except AutoReconnect:
+        logging.error("Could not connect to MongoDB")
+        return 1
+
+    logging.info("Checked %s file(s), %s to update", checked, len(operations))
+
+    if args.dry_run:
+        logging.info("Dry run; no changes written")
+        return 0
+
+    outcome = bulk_write_batches(
+        media_collection, operations, config.config_data.walker.reconcile_batch_size
+    )
+    for index, message in outcome.failures.items():
+        logging.error("Could not update %s: %s", filenames[index], message)
+    if not outcome.connection_successful:
+        return 1
+
+    logging.info("Updated %s file(s)", len(operations) - len(outcome.failures))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())